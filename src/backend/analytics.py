@@ -0,0 +1,447 @@
+"""
+Аналитика посещаемости: где и сколько времени проводят платы.
+
+Каждый записанный фикс сразу добавляется в накопители (см.
+mqtt_server.store_fix, cluster.tail_positions), поэтому запросы не
+читают BoardPosition. Время между соседними фиксами платы (не больше
+MAX_DWELL_GAP) приписывается ячейке и зоне предыдущего фикса:
+- тепловая карта - секунды в ячейках HEAT_CELL x HEAT_CELL, общая и по
+  часовым корзинам (кольцо из MAX_BUCKETS корзин);
+- зоны - точки интереса графа помещения (ячейки ближе ZONE_RADIUS к
+  poi): секунды пребывания и число заходов по тем же корзинам.
+
+Накопители ведутся по этажам (этаж фикса - этаж самого сильного маяка,
+см. rssi_position.heard_floor), у каждого этажа своя сетка и зоны.
+Раз в SNAPSHOT_INTERVAL накопители копируются в неизменяемый снимок:
+копируются только корзины, изменившиеся с прошлого снимка, остальные
+снимок делит с предыдущим. На диск (каталог ANALYTICS_PATH) так же
+пишутся только изменившиеся корзины. API отдаёт плитки из снимка срезом
+массива, время ответа не зависит от длины истории; до первых данных
+снимок пустой.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import metrics
+from beacon_registry import registry
+from navigation import navigator
+
+CUR_DIR = os.path.dirname(os.path.realpath(__file__))
+ANALYTICS_PATH = os.path.join(CUR_DIR, "data", "analytics")
+
+# AKL_ANALYTICS=0 - фиксы не учитываются
+ENABLED = os.environ.get("AKL_ANALYTICS", "1") == "1"
+
+# ячейка тепловой карты (м) и запас вокруг помещения
+HEAT_CELL = 0.5
+HEAT_MARGIN = 2.0
+# корзины по времени: час, неделя истории
+BUCKET_SECONDS = 3600
+MAX_BUCKETS = 24 * 7
+# больший разрыв между фиксами платы (сек) не считается пребыванием
+MAX_DWELL_GAP = 30.0
+ZONE_RADIUS = 3.0
+SNAPSHOT_INTERVAL = 60.0
+# сторона плитки в ячейках
+TILE_SIZE = 64
+
+FIXES_COUNTED = metrics.counter("akl_analytics_fixes_total", "Fixes added to heatmap and dwell accumulators")
+SNAPSHOT_TIME = metrics.histogram("akl_analytics_snapshot_seconds", "Analytics snapshot copy duration")
+SNAPSHOT_BUCKETS = metrics.counter("akl_analytics_snapshot_buckets_total", "Heatmap buckets copied into snapshots")
+
+
+@dataclass(frozen=True)
+class HeatGrid:
+    """Сетка тепловой карты этажа и растр зон (номер зоны ячейки, -1 - вне зон)."""
+    floor: int
+    origin: tuple[float, float]
+    step: float
+    shape: tuple[int, int]
+    zones: tuple[str, ...]
+    zone_map: np.ndarray
+
+    def same(self, other: "HeatGrid") -> bool:
+        return (self.floor == other.floor and self.origin == other.origin and self.step == other.step
+                and self.shape == other.shape and self.zones == other.zones
+                and np.array_equal(self.zone_map, other.zone_map))
+
+
+def venue_floors(graph=None) -> list[int]:
+    """Этажи маяков, узлов графа и плана помещения."""
+    floors = set(registry.snapshot().floor.tolist())
+    if graph is not None:
+        floors.update(graph.floor.tolist())
+        floors.update(int(fl) for fl in (graph.plan.get("floors") or {}))
+    return sorted(floors)
+
+
+def build_grid(graph=None, floor: int = 0, step: float = HEAT_CELL) -> Optional[HeatGrid]:
+    """Сетка этажа по узлам и контуру плана помещения, без графа - по маякам."""
+    points = []
+    on_floor = np.zeros(0, dtype=bool)
+    if graph is not None and len(graph):
+        on_floor = graph.floor == floor
+        points.append(graph.xy[on_floor])
+        for fl, plan in (graph.plan.get("floors") or {}).items():
+            if int(fl) == floor:
+                points.append(np.asarray(plan.get("outline") or [], dtype=np.float64).reshape(-1, 2))
+    snap = registry.snapshot()
+    points.append(snap.xy[snap.floor == floor])
+    points = [p for p in points if len(p)]
+    if not points:
+        return None
+    pts = np.concatenate(points)
+    lo = np.floor((pts.min(axis=0) - HEAT_MARGIN) / step) * step
+    hi = pts.max(axis=0) + HEAT_MARGIN
+    nx, ny = (np.ceil((hi - lo) / step).astype(int) + 1).tolist()
+    zones, zone_map = (), np.full((ny, nx), -1, dtype=np.int16)
+    pois = {name: node for name, node in (graph.pois.items() if graph is not None else ()) if on_floor[node]}
+    if pois:
+        zones = tuple(sorted(pois))
+        cx = lo[0] + (np.arange(nx) + 0.5) * step
+        cy = lo[1] + (np.arange(ny) + 0.5) * step
+        best = np.full((ny, nx), ZONE_RADIUS * ZONE_RADIUS)
+        for z, name in enumerate(zones):
+            px, py = graph.xy[pois[name]]
+            d = (cx[None, :] - px) ** 2 + (cy[:, None] - py) ** 2
+            closer = d <= best
+            zone_map[closer] = z
+            best = np.where(closer, d, best)
+    return HeatGrid(floor, (float(lo[0]), float(lo[1])), step, (ny, nx), zones, zone_map)
+
+
+@dataclass(frozen=True)
+class FloorSnapshot:
+    """
+    Копия накопителей этажа: heat - по массиву (ny, nx) на корзину кольца
+    (неизменившиеся корзины общие с прошлым снимком), total (ny, nx) -
+    секунды в ячейках, dwell/visits (MAX_BUCKETS, Z) и их суммы по зонам;
+    bucket_ids - номер часа в каждой корзине кольца (-1 - пустая).
+    """
+    grid: HeatGrid
+    bucket_ids: np.ndarray
+    heat: tuple[np.ndarray, ...]
+    total: np.ndarray
+    dwell: np.ndarray
+    visits: np.ndarray
+    dwell_total: np.ndarray
+    visits_total: np.ndarray
+
+    @property
+    def tiles(self) -> tuple[int, int]:
+        ny, nx = self.grid.shape
+        return -(-nx // TILE_SIZE), -(-ny // TILE_SIZE)
+
+    def recent(self, hours: int, now: Optional[float] = None) -> np.ndarray:
+        """Корзины кольца за последние hours часов."""
+        if now is None:
+            now = time.time()
+        current = int(now // BUCKET_SECONDS)
+        return np.flatnonzero((self.bucket_ids > current - hours) & (self.bucket_ids <= current))
+
+    def tile(self, tx: int, ty: int, hours: Optional[int] = None) -> Optional[np.ndarray]:
+        """Плитка TILE_SIZE x TILE_SIZE (у края меньше); None вне сетки."""
+        ntx, nty = self.tiles
+        if not (0 <= tx < ntx and 0 <= ty < nty):
+            return None
+        rows = slice(ty * TILE_SIZE, (ty + 1) * TILE_SIZE)
+        cols = slice(tx * TILE_SIZE, (tx + 1) * TILE_SIZE)
+        if hours is None:
+            return self.total[rows, cols]
+        out = np.zeros_like(self.total[rows, cols])
+        for slot in self.recent(hours).tolist():
+            out += self.heat[slot][rows, cols]
+        return out
+
+    def zone_stats(self, hours: Optional[int] = None) -> list[dict]:
+        if hours is None:
+            dwell, visits = self.dwell_total, self.visits_total
+        else:
+            sel = self.recent(hours)
+            dwell, visits = self.dwell[sel].sum(axis=0), self.visits[sel].sum(axis=0)
+        return [{"zone": name, "floor": self.grid.floor, "dwell_s": round(float(dwell[z]), 1),
+                 "visits": int(visits[z])} for z, name in enumerate(self.grid.zones)]
+
+    def meta(self) -> dict:
+        ntx, nty = self.tiles
+        ids = self.bucket_ids[self.bucket_ids >= 0]
+        return {
+            "floor": self.grid.floor,
+            "origin": list(self.grid.origin),
+            "cell": self.grid.step,
+            "shape": list(self.grid.shape),
+            "tiles": [ntx, nty],
+            "buckets": sorted(int(b) * BUCKET_SECONDS for b in ids),
+            "zones": list(self.grid.zones),
+        }
+
+
+@dataclass(frozen=True)
+class AnalyticsSnapshot:
+    """Снимок всех этажей; version 0 - пустой снимок до первых данных."""
+    version: int
+    taken_at: float
+    floors: dict[int, FloorSnapshot]
+
+    def floor(self, floor: Optional[int] = None) -> Optional[FloorSnapshot]:
+        """Этаж floor, по умолчанию - нижний."""
+        if floor is None:
+            floor = min(self.floors, default=None)
+        return self.floors.get(floor)
+
+    def zone_stats(self, hours: Optional[int] = None) -> list[dict]:
+        return [z for fl in sorted(self.floors) for z in self.floors[fl].zone_stats(hours)]
+
+    def meta(self) -> dict:
+        return {
+            "version": self.version,
+            "taken_at": self.taken_at,
+            "tile_size": TILE_SIZE,
+            "bucket_seconds": BUCKET_SECONDS,
+            "floors": [self.floors[fl].meta() for fl in sorted(self.floors)],
+        }
+
+
+EMPTY_SNAPSHOT = AnalyticsSnapshot(0, 0.0, {})
+
+
+class FloorHeat():
+    """Накопители одного этажа; changed - корзины, изменившиеся с прошлого снимка."""
+
+    def __init__(self, grid: HeatGrid):
+        ny, nx = grid.shape
+        z = len(grid.zones)
+        self.grid = grid
+        self.bucket_ids = np.full(MAX_BUCKETS, -1, dtype=np.int64)
+        self.heat = np.zeros((MAX_BUCKETS, ny, nx), dtype=np.float32)
+        self.total = np.zeros((ny, nx), dtype=np.float32)
+        self.dwell = np.zeros((MAX_BUCKETS, z))
+        self.visits = np.zeros((MAX_BUCKETS, z), dtype=np.int64)
+        self.dwell_total = np.zeros(z)
+        self.visits_total = np.zeros(z, dtype=np.int64)
+        self.heat_flat = self.heat.reshape(MAX_BUCKETS, -1)
+        self.total_flat = self.total.reshape(-1)
+        self.changed: set[int] = set(range(MAX_BUCKETS))
+        # корзины, ещё не записанные на диск
+        self.unsaved: set[int] = set()
+
+    def locate(self, x: float, y: float) -> tuple[int, int]:
+        """Ячейка (iy * nx + ix, -1 вне сетки) и зона точки."""
+        grid = self.grid
+        ix = int((x - grid.origin[0]) // grid.step)
+        iy = int((y - grid.origin[1]) // grid.step)
+        ny, nx = grid.shape
+        cell = iy * nx + ix if 0 <= ix < nx and 0 <= iy < ny else -1
+        return cell, int(grid.zone_map.flat[cell]) if cell >= 0 else -1
+
+    def slot(self, ts: float) -> int:
+        bucket = int(ts // BUCKET_SECONDS)
+        slot = bucket % MAX_BUCKETS
+        if self.bucket_ids[slot] != bucket:
+            self.bucket_ids[slot] = bucket
+            self.heat[slot] = 0.0
+            self.dwell[slot] = 0.0
+            self.visits[slot] = 0
+        self.changed.add(slot)
+        return slot
+
+    def snapshot(self, prev: Optional[FloorSnapshot]) -> FloorSnapshot:
+        """Копирует только изменившиеся корзины; остальные берутся из prev."""
+        if prev is None or prev.grid is not self.grid:
+            self.changed = set(range(MAX_BUCKETS))
+        heat = [self.heat[slot].copy() if slot in self.changed else prev.heat[slot] for slot in range(MAX_BUCKETS)]
+        SNAPSHOT_BUCKETS.inc(len(self.changed))
+        self.unsaved |= self.changed
+        self.changed = set()
+        return FloorSnapshot(self.grid, self.bucket_ids.copy(), tuple(heat), self.total.copy(), self.dwell.copy(),
+                             self.visits.copy(), self.dwell_total.copy(), self.visits_total.copy())
+
+
+ARRAYS = ("bucket_ids", "total", "dwell", "visits", "dwell_total", "visits_total")
+
+
+class Accumulator():
+    """Накопители тепловой карты и зон по этажам; add - на каждый записанный фикс."""
+
+    def __init__(self, path: str = ANALYTICS_PATH, interval: float = SNAPSHOT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.floors: dict[int, FloorHeat] = {}
+        self._graph_version = -1
+        self._synced = False
+        # плата -> (ts, этаж, ячейка, зона) последнего фикса
+        self._last: dict[str, tuple[float, int, int, int]] = {}
+        self._snapshot: AnalyticsSnapshot = EMPTY_SNAPSHOT
+        self._version = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sync_grid(self):
+        """Сетки под текущий граф помещения; этаж, у которого изменилась геометрия, накапливается заново."""
+        graph = navigator.graph()
+        version = graph.version if graph is not None else 0
+        if version == self._graph_version and self._synced:
+            return
+        grids = {fl: build_grid(graph, fl) for fl in venue_floors(graph)}
+        with self._lock:
+            self._graph_version = version
+            self._synced = True
+            floors = {}
+            for fl, grid in grids.items():
+                if grid is None:
+                    continue
+                old = self.floors.get(fl)
+                if old is not None and old.grid.same(grid):
+                    floors[fl] = old
+                    continue
+                if old is not None:
+                    print(f"Сетка аналитики этажа {fl} изменилась, накопители сброшены")
+                floors[fl] = FloorHeat(grid)
+                self._load(floors[fl])
+            self.floors = floors
+            self._last.clear()
+
+    def add(self, board_id: str, ts: float, x: float, y: float, floor: Optional[int] = None):
+        if not ENABLED:
+            return
+        if not self._synced:
+            self.sync_grid()
+        floors = self.floors
+        if floor is None:
+            # фиксы без этажа (строки базы до появления колонки floor) - на нижний этаж
+            floor = min(floors, default=None)
+        heat = floors.get(floor)
+        if heat is None:
+            return
+        cell, zone = heat.locate(x, y)
+        with self._lock:
+            if self.floors.get(floor) is not heat:
+                return
+            last = self._last.get(board_id)
+            if last is not None:
+                last_ts, last_floor, last_cell, last_zone = last
+                prev = self.floors.get(last_floor)
+                dt = ts - last_ts
+                if 0.0 < dt <= MAX_DWELL_GAP and prev is not None:
+                    slot = prev.slot(last_ts)
+                    if last_cell >= 0:
+                        prev.heat_flat[slot, last_cell] += dt
+                        prev.total_flat[last_cell] += dt
+                    if last_zone >= 0:
+                        prev.dwell[slot, last_zone] += dt
+                        prev.dwell_total[last_zone] += dt
+                elif dt <= 0.0:
+                    # запоздавший фикс: позиция обновляется, время не учитывается
+                    ts = last_ts
+            if zone >= 0 and (last is None or last[1] != floor or last[3] != zone):
+                heat.visits[heat.slot(ts), zone] += 1
+                heat.visits_total[zone] += 1
+            self._last[board_id] = (ts, floor, cell, zone)
+        FIXES_COUNTED.inc()
+
+    def take_snapshot(self) -> AnalyticsSnapshot:
+        self.sync_grid()
+        t0 = time.perf_counter()
+        with self._lock:
+            prev = self._snapshot.floors
+            self._version += 1
+            snap = AnalyticsSnapshot(self._version, time.time(),
+                                     {fl: heat.snapshot(prev.get(fl)) for fl, heat in self.floors.items()})
+            # платы, молчащие дольше MAX_DWELL_GAP, больше не нужны
+            newest = max((v[0] for v in self._last.values()), default=0.0)
+            self._last = {b: v for b, v in self._last.items() if newest - v[0] <= MAX_DWELL_GAP}
+        self._snapshot = snap
+        SNAPSHOT_TIME.observe(time.perf_counter() - t0)
+        return snap
+
+    def snapshot(self) -> AnalyticsSnapshot:
+        """
+        Последний снимок (пустой до первых данных); без фонового потока
+        снимается по запросу не чаще interval.
+        """
+        snap = self._snapshot
+        if self._thread is None and time.time() - snap.taken_at >= self.interval:
+            snap = self.take_snapshot()
+        return snap
+
+    def _floor_path(self, floor: int, name: str) -> str:
+        return os.path.join(self.path, f"floor{floor}_{name}.npz")
+
+    def save(self, snap: AnalyticsSnapshot):
+        """Сводные массивы этажей и только те корзины, что изменились с прошлой записи."""
+        os.makedirs(self.path, exist_ok=True)
+        for fl, fs in snap.floors.items():
+            heat = self.floors.get(fl)
+            if heat is None or heat.grid is not fs.grid:
+                continue
+            with self._lock:
+                slots, heat.unsaved = heat.unsaved, set()
+            try:
+                # пустые корзины не пишутся: при загрузке читаются только корзины с bucket_ids >= 0
+                for slot in sorted(s for s in slots if fs.bucket_ids[s] >= 0):
+                    _save_npz(self._floor_path(fl, f"h{slot}"), heat=fs.heat[slot])
+                grid = fs.grid
+                _save_npz(self._floor_path(fl, "meta"), origin=np.array(grid.origin), step=np.array(grid.step),
+                          zones=np.array(grid.zones, dtype=str), zone_map=grid.zone_map,
+                          **{name: getattr(fs, name) for name in ARRAYS})
+            except Exception:
+                with self._lock:
+                    heat.unsaved |= slots
+                raise
+
+    def _load(self, heat: FloorHeat):
+        """Накопители этажа с диска, если они сняты для той же сетки."""
+        path = self._floor_path(heat.grid.floor, "meta")
+        try:
+            with np.load(path) as f:
+                grid = HeatGrid(heat.grid.floor, tuple(f["origin"].tolist()), float(f["step"]), f["zone_map"].shape,
+                                tuple(f["zones"].tolist()), f["zone_map"])
+                if not heat.grid.same(grid):
+                    return
+                for name in ARRAYS:
+                    getattr(heat, name)[...] = f[name]
+            for slot in np.flatnonzero(heat.bucket_ids >= 0).tolist():
+                with np.load(self._floor_path(heat.grid.floor, f"h{slot}")) as f:
+                    heat.heat[slot] = f["heat"]
+        except (OSError, KeyError, ValueError) as e:
+            if os.path.exists(path):
+                print("Не удалось загрузить аналитику:", e)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            stopping = self._stop.wait(self.interval)
+            try:
+                self.save(self.take_snapshot())
+            except Exception as e:
+                print("Ошибка снимка аналитики:", e)
+            if stopping:
+                return
+
+
+def _save_npz(path: str, **arrays):
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+accumulator = Accumulator()
@@ -23,6 +23,8 @@ class GlobalState():
     def __init__(self):
         if not self._is_init:
             self._cur_state = AppStates.WAITING
+            self._route_id = None
+            self._is_init = True
 
     def get_state(self) -> AppStates:
         return self._cur_state
@@ -30,6 +32,12 @@ class GlobalState():
     def set_state(self, state: AppStates):
         self._cur_state = state
 
+    def get_route_id(self):
+        return self._route_id
+
+    def set_route_id(self, route_id):
+        self._route_id = route_id
+
     def save_last_updated(self):
         self._last_board_updated = datetime.now()
 
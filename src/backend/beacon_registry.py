@@ -0,0 +1,237 @@
+import os
+import csv
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+CUR_DIR = os.path.dirname(os.path.realpath(__file__))
+BEACONS_PATH = os.path.join(CUR_DIR, "data", "beacons.txt")
+# подобранные калибровкой RSSI0/N/SIGMA, перекрывают значения из beacons.txt
+CALIBRATION_PATH = os.path.join(CUR_DIR, "data", "calibration.json")
+
+DEFAULT_RSSI0 = -59.0
+DEFAULT_N = 2.0
+DEFAULT_SIGMA_RSSI = 3.0
+DEFAULT_FLOOR = 0
+
+# как часто (сек) проверять mtime файла маяков
+MTIME_CHECK_INTERVAL = 1.0
+
+
+@dataclass(frozen=True)
+class BeaconSnapshot:
+    """
+    Неизменяемый снимок реестра маяков.
+    Координаты и параметры модели лежат в непрерывных массивах,
+    строка i соответствует маяку names[i].
+    """
+    version: int
+    names: tuple[str, ...]
+    index: dict[str, int]
+    xy: np.ndarray
+    rssi0: np.ndarray
+    n: np.ndarray
+    sigma: np.ndarray
+    floor: np.ndarray
+    # mtime файла маяков и файла калибровки
+    mtime: Optional[tuple[Optional[int], Optional[int]]] = None
+    ids: tuple[str, ...] = field(default=())
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def lookup(self, names) -> np.ndarray:
+        """Индексы маяков по именам, -1 для неизвестных."""
+        index = self.index
+        return np.fromiter((index.get(name, -1) for name in names), dtype=np.intp)
+
+    def to_list(self) -> list[dict]:
+        return [
+            {"id": id_, "name": name, "x": float(x), "y": float(y), "floor": floor}
+            for id_, name, (x, y), floor in zip(self.ids, self.names, self.xy.tolist(), self.floor.tolist())
+        ]
+
+
+def _beacon_id(name: str) -> str:
+    m = re.search(r"(\d+)$", name)
+    return m.group(1) if m else name
+
+
+def _parse_float(value: Optional[str], default: float) -> float:
+    if value is None or not value.strip():
+        return default
+    return float(value.strip().replace(",", "."))
+
+
+def parse_beacons(path: str) -> list[tuple[str, float, float, float, float, float, float]]:
+    """
+    Читает файл маяков "Name;X;Y[;RSSI0;N;SIGMA;FLOOR]".
+    Строки с ошибками и комментарии пропускаются.
+    """
+    rows = []
+    columns = {"rssi0": None, "n": None, "sigma": None, "floor": None}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f, delimiter=";")
+        for row in reader:
+            if not row:
+                continue
+            first = row[0].strip().lower()
+            if first.startswith("#"):
+                continue
+            if first == "name":
+                header = [c.strip().lower() for c in row]
+                for key in columns:
+                    columns[key] = header.index(key) if key in header else None
+                continue
+            if len(row) < 3:
+                continue
+
+            def col(key):
+                i = columns[key]
+                return row[i] if i is not None and i < len(row) else None
+
+            try:
+                x = float(row[1].strip().replace(",", "."))
+                y = float(row[2].strip().replace(",", "."))
+                rssi0 = _parse_float(col("rssi0"), DEFAULT_RSSI0)
+                n = _parse_float(col("n"), DEFAULT_N)
+                sigma = _parse_float(col("sigma"), DEFAULT_SIGMA_RSSI)
+                floor = _parse_float(col("floor"), DEFAULT_FLOOR)
+            except ValueError:
+                continue
+            rows.append((row[0].strip(), x, y, rssi0, n, sigma, floor))
+    return rows
+
+
+def load_calibration(path: str) -> dict[str, dict[str, float]]:
+    """{"name": {"rssi0": ..., "n": ..., "sigma": ...}}; пустой словарь, если файла нет или он битый."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def apply_calibration(rows, calibration: dict[str, dict[str, float]]):
+    """Подставляет откалиброванные параметры в строки parse_beacons."""
+    out = []
+    for name, x, y, rssi0, n, sigma, floor in rows:
+        c = calibration.get(name)
+        if c:
+            rssi0 = float(c.get("rssi0", rssi0))
+            n = float(c.get("n", n))
+            sigma = float(c.get("sigma", sigma))
+        out.append((name, x, y, rssi0, n, sigma, floor))
+    return out
+
+
+def build_snapshot(rows, version: int, mtime=None) -> BeaconSnapshot:
+    names = []
+    index = {}
+    for name, *_ in rows:
+        # при повторе имени побеждает последняя строка
+        if name in index:
+            continue
+        index[name] = len(names)
+        names.append(name)
+    last = {name: r for name, *r in rows}
+    values = np.array([last[name] for name in names], dtype=np.float64).reshape(-1, 6)
+
+    snap = BeaconSnapshot(
+        version=version,
+        names=tuple(names),
+        index=index,
+        xy=np.ascontiguousarray(values[:, 0:2]),
+        rssi0=np.ascontiguousarray(values[:, 2]),
+        n=np.ascontiguousarray(values[:, 3]),
+        sigma=np.ascontiguousarray(values[:, 4]),
+        floor=values[:, 5].astype(np.int32),
+        mtime=mtime,
+        ids=tuple(_beacon_id(name) for name in names),
+    )
+    for arr in (snap.xy, snap.rssi0, snap.n, snap.sigma, snap.floor):
+        arr.setflags(write=False)
+    return snap
+
+
+class BeaconRegistry():
+    """
+    Кэш маяков в памяти. Файл читается один раз и перечитывается
+    только после reload() или при изменении его mtime (или mtime файла калибровки).
+    Каждая перезагрузка получает новый номер версии.
+    """
+
+    def __init__(self, path: str = BEACONS_PATH, check_interval: float = MTIME_CHECK_INTERVAL,
+                 calibration_path: str = CALIBRATION_PATH):
+        self.path = path
+        self.calibration_path = calibration_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = 0
+        self._last_check = 0.0
+        self._snap: Optional[BeaconSnapshot] = None
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _stat_mtime(self) -> tuple[Optional[int], Optional[int]]:
+        return self._mtime(self.path), self._mtime(self.calibration_path)
+
+    def reload(self) -> BeaconSnapshot:
+        with self._lock:
+            mtime = self._stat_mtime()
+            rows = parse_beacons(self.path) if mtime[0] is not None else []
+            if mtime[1] is not None:
+                rows = apply_calibration(rows, load_calibration(self.calibration_path))
+            self._version += 1
+            self._snap = build_snapshot(rows, self._version, mtime)
+            self._last_check = time.monotonic()
+            return self._snap
+
+    def snapshot(self) -> BeaconSnapshot:
+        snap = self._snap
+        if snap is None:
+            return self.reload()
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            if self._stat_mtime() != snap.mtime:
+                return self.reload()
+        return snap
+
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
+
+    def write(self, content: bytes) -> BeaconSnapshot:
+        """Атомарно заменяет файл маяков и перезагружает реестр."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+        return self.reload()
+
+    def calibration(self) -> dict[str, dict[str, float]]:
+        return load_calibration(self.calibration_path)
+
+    def write_calibration(self, calibration: dict[str, dict[str, float]]) -> BeaconSnapshot:
+        """Атомарно заменяет файл калибровки; новый снимок сразу виден решателю."""
+        # свой временный файл у каждого процесса, чтобы записи не смешивались
+        tmp_path = f"{self.calibration_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(calibration, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.calibration_path)
+        return self.reload()
+
+
+registry = BeaconRegistry()
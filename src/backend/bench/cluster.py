@@ -0,0 +1,154 @@
+"""
+Масштабирование приёма по процессам (см. cluster).
+
+Из src/backend:
+    python -m bench.cluster --workers 1 2 4 [--boards 40] [--duration 300]
+    python -m bench.cluster --workers 1 2 4 --broker localhost [--spawn-broker] [--shared]
+
+Без --broker каждый процесс сам подаёт свою долю синтетических сообщений
+(те, что брокер доставил бы ему по подпискам cluster) в on_board_message
+на максимальной скорости - меряется решение и запись без сети.
+С --broker запускаются настоящие воркеры cluster, сообщения публикуются
+в брокер, а результат считается по строкам, дошедшим до базы.
+--spawn-broker поднимает локальный mosquitto на --port на время замера.
+fanout - сколько раз брокер доставил каждое сообщение воркерам
+(по IngestWorker.received); при делении по корзинам оно 1.0.
+"""
+import argparse
+import multiprocessing as mp
+import shutil
+import subprocess
+import time
+
+from bench.scratch_db import use_scratch_db
+from bench.synthetic import generate
+
+
+def _direct_worker(index: int, count: int, boards: int, duration: float, seed: int, route_id: int,
+                   start: mp.Event, out: mp.Queue):
+    import ingest
+    import mqtt_server
+    from app_state import AppStates
+    from bench.replay import replay
+
+    mqtt_server.SHARD = (index, count)
+    mqtt_server.LOCAL_IDS = False
+    mqtt_server.pipeline = ingest.IngestPipeline(mqtt_server.solve_message, mqtt_server.store_fix,
+                                                 policy=ingest.BLOCK, prepare=mqtt_server.prepare_batch)
+    mqtt_server.global_state.set_route_id(route_id)
+    mqtt_server.global_state.set_state(AppStates.WRITE_WAY)
+    records = [r for r in generate(boards, duration, seed=seed).records if mqtt_server.owns_topic(r.topic)]
+    mqtt_server.start_ingest()
+
+    start.wait()
+    replay(records, mqtt_server.on_board_message, speed=0)
+    mqtt_server.pipeline.join()
+    mqtt_server.position_writer.flush()
+    out.put(len(records))
+    mqtt_server.shutdown()
+
+
+def run_direct(workers: int, boards: int, duration: float, seed: int) -> dict:
+    from data import db
+
+    route_id = db.create_route()
+    ctx = mp.get_context("spawn")
+    start = ctx.Event()
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_direct_worker, args=(i, workers, boards, duration, seed, route_id, start, out))
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+    # генерация и импорт в воркерах не входят в замер
+    time.sleep(2.0 + workers)
+    t0 = time.perf_counter()
+    start.set()
+    total = sum(out.get() for _ in procs)
+    elapsed = time.perf_counter() - t0
+    for p in procs:
+        p.join()
+    db.finish_route(route_id)
+    return {"workers": workers, "messages": total, "msgs_per_sec": total / elapsed}
+
+
+def run_broker(workers: int, boards: int, duration: float, seed: int, host: str, port: int,
+               shared: bool = False, timeout: float = 60.0) -> dict:
+    import paho.mqtt.client as mqtt
+
+    import cluster
+    from data import db
+
+    started = time.time()
+    procs = cluster.start_workers(workers, shared)
+    route_id = db.create_route()
+    time.sleep(2.0 + cluster.ROUTE_POLL_INTERVAL + workers)
+    records = generate(boards, duration, seed=seed).records
+    before = db.get_max_position_id()
+
+    client = mqtt.Client(client_id="akl-bench")
+    client.connect(host, port, 60)
+    client.loop_start()
+    t0 = time.perf_counter()
+    for r in records:
+        client.publish(r.topic, r.payload, qos=1)
+    # ждём, пока число строк перестанет расти
+    written, last_change = 0, time.perf_counter()
+    while time.perf_counter() - last_change < 2.0 and time.perf_counter() - t0 < timeout:
+        time.sleep(0.2)
+        now = db.get_max_position_id() - before
+        if now != written:
+            written, last_change = now, time.perf_counter()
+    elapsed = last_change - t0
+    client.loop_stop()
+    client.disconnect()
+    db.finish_route(route_id)
+    # счётчики приёма воркеры обновляют вместе с подтверждением маршрута
+    cluster.wait_for_workers(route_id)
+    received = sum(w["received"] for w in db.get_workers() if w["seen_at"] >= started)
+    for p in procs:
+        p.terminate()
+    return {"workers": workers, "messages": len(records), "written": written, "msgs_per_sec": written / elapsed,
+            "fanout": received / len(records)}
+
+
+def spawn_broker(port: int) -> subprocess.Popen:
+    exe = shutil.which("mosquitto")
+    if exe is None:
+        raise SystemExit("mosquitto не найден: установите его или запустите брокер сами и укажите --broker")
+    proc = subprocess.Popen([exe, "-p", str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0)
+    return proc
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--boards", type=int, default=40)
+    parser.add_argument("--duration", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--broker")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--spawn-broker", action="store_true", help="запустить mosquitto на --port")
+    parser.add_argument("--shared", action="store_true", help="воркеры с общей подпиской")
+    args = parser.parse_args()
+
+    # воркеры наследуют AKL_DB_PATH и пишут во временную базу
+    use_scratch_db()
+    broker = spawn_broker(args.port) if args.broker and args.spawn_broker else None
+    base = None
+    try:
+        for n in args.workers:
+            if args.broker:
+                res = run_broker(n, args.boards, args.duration, args.seed, args.broker, args.port, args.shared)
+            else:
+                res = run_direct(n, args.boards, args.duration, args.seed)
+            base = base or res["msgs_per_sec"] / n
+            print(f"workers={n:<3} {res['msgs_per_sec']:10.0f} msg/s  "
+                  f"scaling {res['msgs_per_sec'] / base / n:5.2f}  {res}")
+    finally:
+        if broker is not None:
+            broker.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Нагрузочный тест конвейера приёма.
+
+Запуск из src/backend:
+    python -m bench.ingest [--n 20000] [--boards 50]
+
+Вместо брокера сообщения подаются прямо в mqtt_server.on_board_message
+так быстро, как получается, - так измеряется, сколько сообщений в секунду
+выдерживает поток paho, и сколько фиксов в секунду доходит до базы.
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+import mqtt_server
+from app_state import AppStates
+from beacon_registry import registry
+from bench.scratch_db import use_scratch_db
+
+
+def make_messages(n: int, boards: int, seed: int = 0) -> list:
+    snap = registry.snapshot()
+    rng = np.random.default_rng(seed)
+    msgs = []
+    for i in range(n):
+        k = int(rng.integers(3, min(len(snap), 6) + 1))
+        sel = rng.choice(len(snap), size=k, replace=False)
+        payload = [{"name": snap.names[j], "rssi": int(rng.integers(-90, -50))} for j in sel]
+        topic = f"{mqtt_server.TOPIC}/board_{i % boards}"
+        msgs.append(SimpleNamespace(topic=topic, payload=json.dumps(payload).encode()))
+    return msgs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--boards", type=int, default=50)
+    args = parser.parse_args()
+
+    msgs = make_messages(args.n, args.boards)
+    use_scratch_db()
+    mqtt_server.global_state.set_state(AppStates.WRITE_WAY)
+    pipeline = mqtt_server.pipeline
+    mqtt_server.start_ingest()
+
+    t0 = time.perf_counter()
+    for msg in msgs:
+        mqtt_server.on_board_message(None, None, msg)
+    t_submit = time.perf_counter() - t0
+    pipeline.join()
+    mqtt_server.position_writer.flush()
+    t_total = time.perf_counter() - t0
+    mqtt_server.shutdown()
+
+    print(f"messages:           {args.n}")
+    print(f"callback:           {args.n / t_submit:10.0f} msg/s")
+    print(f"end-to-end:         {args.n / t_total:10.0f} msg/s")
+    for key, value in pipeline.stats().items():
+        print(f"{key + ':':<20}{value}")
+    print(f"{'db flushes:':<20}{mqtt_server.position_writer.flushes}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Стоимость перестроения маршрутов для многих движущихся плат.
+
+Из src/backend:
+    python -m bench.navigation [--size 60] [--users 300] [--steps 50] [--pois 10]
+
+Граф - сетка size x size узлов с шагом 2 м, часть рёбер удалена.
+Каждая плата идёт по своему кратчайшему пути к случайной точке интереса
+с шумом позиции; на каждом шаге запрашивается маршрут. Сравнивается
+A* на каждый запрос и Navigator (сессии, деревья путей до poi, LRU-кэш).
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import navigation
+from navigation import Navigator, astar, build_graph
+
+STEP = 2.0
+# доля удалённых рёбер сетки
+DROP_EDGES = 0.2
+POSITION_NOISE = 0.7
+
+
+def grid_venue(size: int, pois: int, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    nodes = [{"id": f"{i}_{j}", "x": i * STEP, "y": j * STEP} for i in range(size) for j in range(size)]
+    for k, node in enumerate(rng.choice(len(nodes), pois, replace=False).tolist()):
+        nodes[node]["poi"] = f"poi_{k}"
+    edges = []
+    for i in range(size):
+        for j in range(size):
+            if i + 1 < size:
+                edges.append([f"{i}_{j}", f"{i + 1}_{j}"])
+            if j + 1 < size:
+                edges.append([f"{i}_{j}", f"{i}_{j + 1}"])
+    keep = rng.random(len(edges)) >= DROP_EDGES
+    return {"nodes": nodes, "edges": [e for e, k in zip(edges, keep) if k]}
+
+
+def walks(graph, users: int, steps: int, seed: int = 0) -> list[tuple[int, np.ndarray]]:
+    """Для каждой платы: точка назначения и позиции вдоль её пути (steps, 2)."""
+    rng = np.random.default_rng(seed)
+    dests = list(graph.pois.values())
+    out = []
+    while len(out) < users:
+        src, dest = int(rng.integers(len(graph))), dests[int(rng.integers(len(dests)))]
+        res = astar(graph, src, dest)
+        if res is None or len(res[0]) < 2:
+            continue
+        path = res[0]
+        at = np.linspace(0, len(path) - 1, steps).round().astype(int)
+        xy = graph.xy[np.array(path)[at]] + rng.normal(0, POSITION_NOISE, (steps, 2))
+        out.append((dest, xy))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=60)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--pois", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    venue = grid_venue(args.size, args.pois, args.seed)
+    graph = build_graph(venue, 1)
+    plans = walks(graph, args.users, args.steps, args.seed)
+    queries = args.users * args.steps
+    print(f"nodes={len(graph)} users={args.users} queries={queries}")
+
+    t0 = time.perf_counter()
+    for step in range(args.steps):
+        for dest, xy in plans:
+            astar(graph, graph.snap(xy[step]), dest)
+    elapsed = time.perf_counter() - t0
+    print(f"{'astar':<16}{queries / elapsed:10.0f} routes/s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "venue.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(venue, f)
+        for precompute in (False, True):
+            navigation.PRECOMPUTE_POIS = precompute
+            nav = Navigator(path=path)
+            t_load = time.perf_counter()
+            graph = nav.graph()
+            t_load = time.perf_counter() - t_load
+            t0 = time.perf_counter()
+            replanned = 0
+            for step in range(args.steps):
+                for user, (dest, xy) in enumerate(plans):
+                    route = nav.route(str(user), xy[step], None, dest, graph)
+                    replanned += route is not None and route.replanned
+            elapsed = time.perf_counter() - t0
+            name = "navigator" + ("+trees" if precompute else "")
+            print(f"{name:<16}{queries / elapsed:10.0f} routes/s  replanned {replanned / queries:5.1%}"
+                  f"  load {t_load * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
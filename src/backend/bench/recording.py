@@ -0,0 +1,104 @@
+"""
+Запись сырых сообщений test/beacons в компактный файл и их чтение.
+
+Формат: заголовок MAGIC, затем записи
+    <d ts><H len(topic)><I len(payload)> topic payload
+ts - время приёма (unix, сек).
+
+Запись с брокера (из src/backend):
+    python -m bench.recording out.rec [--broker localhost] [--port 1883]
+"""
+import argparse
+import struct
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator
+
+MAGIC = b"AKLREC1\n"
+_HEADER = struct.Struct("<dHI")
+
+
+@dataclass
+class Record:
+    ts: float
+    topic: str
+    payload: bytes
+
+
+class Recorder():
+    def __init__(self, path: str):
+        self._f: BinaryIO = open(path, "wb")
+        self._f.write(MAGIC)
+        self.count = 0
+
+    def write(self, topic: str, payload: bytes, ts: float):
+        topic_b = topic.encode()
+        self._f.write(_HEADER.pack(ts, len(topic_b), len(payload)))
+        self._f.write(topic_b)
+        self._f.write(payload)
+        self.count += 1
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_recording(path: str, records) -> int:
+    with Recorder(path) as rec:
+        for r in records:
+            rec.write(r.topic, r.payload, r.ts)
+        return rec.count
+
+
+def read_recording(path: str) -> Iterator[Record]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: не файл записи")
+        while True:
+            head = f.read(_HEADER.size)
+            if len(head) < _HEADER.size:
+                return
+            ts, topic_len, payload_len = _HEADER.unpack(head)
+            topic = f.read(topic_len).decode()
+            payload = f.read(payload_len)
+            yield Record(ts, topic, payload)
+
+
+def main():
+    import paho.mqtt.client as mqtt
+    import mqtt_server
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--broker", default=mqtt_server.BROKER)
+    parser.add_argument("--port", type=int, default=mqtt_server.PORT)
+    args = parser.parse_args()
+
+    rec = Recorder(args.path)
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe([(mqtt_server.TOPIC, 0), (mqtt_server.BOARD_TOPIC, 0)])
+
+    def on_message(client, userdata, msg):
+        rec.write(msg.topic, msg.payload, time.time())
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port, 60)
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rec.close()
+        print(f"Записано сообщений: {rec.count}")
+
+
+if __name__ == "__main__":
+    main()
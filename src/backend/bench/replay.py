@@ -0,0 +1,79 @@
+"""
+Воспроизведение записанных сообщений.
+
+Из src/backend:
+    python -m bench.replay session.rec [--speed 1 | --speed 10 | --speed 0]
+
+speed=0 - максимальная скорость. Время записи подставляется в сообщение
+полем "ts", поэтому трек не зависит от скорости воспроизведения.
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+from typing import Callable, Iterable, Optional
+
+from bench.recording import Record, read_recording
+
+
+def with_timestamp(record: Record) -> bytes:
+    """Добавляет время записи в JSON-сообщение, если его там нет."""
+    try:
+        data = json.loads(record.payload)
+    except ValueError:
+        return record.payload
+    if isinstance(data, list):
+        data = {"ts": record.ts, "beacons": data}
+    elif isinstance(data, dict) and "ts" not in data:
+        data["ts"] = record.ts
+    return json.dumps(data).encode()
+
+
+def replay(records: Iterable[Record], on_message: Callable, speed: float = 1.0,
+           keep_time: bool = True) -> int:
+    """
+    Подаёт записи в on_message(client, userdata, msg) как callback paho.
+    speed - множитель скорости (1 - реальное время), 0 - без пауз.
+    """
+    start_wall: Optional[float] = None
+    start_rec = 0.0
+    count = 0
+    for record in records:
+        if speed > 0:
+            if start_wall is None:
+                start_wall = time.monotonic()
+                start_rec = record.ts
+            delay = (record.ts - start_rec) / speed - (time.monotonic() - start_wall)
+            if delay > 0:
+                time.sleep(delay)
+        payload = with_timestamp(record) if keep_time else record.payload
+        on_message(None, None, SimpleNamespace(topic=record.topic, payload=payload))
+        count += 1
+    return count
+
+
+def main():
+    from bench.scratch_db import use_scratch_db
+
+    use_scratch_db()
+    import mqtt_server
+    from app_state import AppStates
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    mqtt_server.global_state.set_state(AppStates.WRITE_WAY)
+    mqtt_server.start_ingest()
+    t0 = time.perf_counter()
+    count = replay(read_recording(args.path), mqtt_server.on_board_message, args.speed)
+    mqtt_server.pipeline.join()
+    elapsed = time.perf_counter() - t0
+    mqtt_server.shutdown()
+    print(f"Воспроизведено {count} сообщений за {elapsed:.2f} с")
+    print(mqtt_server.pipeline.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+Временная база для бенчмарков: рабочий data.db не трогается.
+
+use_scratch_db() ставит AKL_DB_PATH на новый файл во временном каталоге -
+его унаследуют дочерние процессы (bench.cluster). Если data.db уже
+импортирован, модуль и писатель позиций переключаются на этот файл.
+Вызывать до запуска конвейера; каталог удаляется при выходе.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+
+def use_scratch_db() -> str:
+    tmp = tempfile.mkdtemp(prefix="akl-bench-")
+    atexit.register(shutil.rmtree, tmp, True)
+    path = os.path.join(tmp, "bench.db")
+    os.environ["AKL_DB_PATH"] = path
+    if "data.db" in sys.modules:
+        from data import db
+        from data.writer import writer
+
+        db.use_database(path)
+        writer.engine = db.engine
+    return path
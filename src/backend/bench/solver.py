@@ -0,0 +1,124 @@
+"""
+Бенчмарк ядра трилатерации.
+
+Запуск из src/backend:
+    python -m bench.solver [--n 20000]
+
+Сравнивает rssi_position.gauss_newton с прежней построчной
+реализацией (reference_gauss_newton) по скорости и результату.
+Вырожденные случаи (ковариация GN_DEGENERATE_VAR * I хотя бы у одного
+решателя: решение ушло далеко от маяков) считаются отдельно и в
+сравнение результатов не входят.
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+import rssi_position
+from beacon_registry import registry
+
+
+def reference_gauss_newton(beacons, dists, vars_, x0, max_iter=10, tol=1e-3):
+    x, y = float(x0[0]), float(x0[1])
+    H = None
+    for _ in range(max_iter):
+        A = []
+        b_vec = []
+        for (bx, by), di in zip(beacons, dists):
+            r_est = math.hypot(x - bx, y - by)
+            if r_est < 1e-6:
+                r_est = 1e-6
+            A.append([(x - bx) / r_est, (y - by) / r_est])
+            b_vec.append(di - r_est)
+
+        A = np.array(A)
+        b_vec = np.array(b_vec)
+
+        w = 1.0 / vars_
+        sigma = np.std(b_vec) if np.std(b_vec) > 1e-3 else 1.0
+        c = 1.5 * sigma
+        for i in range(len(b_vec)):
+            if abs(b_vec[i]) > c:
+                w[i] *= c / abs(b_vec[i])
+
+        W = np.diag(w)
+        AtW = A.T @ W
+        H = AtW @ A
+        g = AtW @ b_vec
+
+        try:
+            dx = np.linalg.solve(H, g)
+        except np.linalg.LinAlgError:
+            break
+
+        x += dx[0]
+        y += dx[1]
+
+        if np.linalg.norm(dx) < tol:
+            break
+
+    # как в gauss_newton: по вырожденной матрице - запасная ковариация
+    det = np.linalg.det(H)
+    if not det > rssi_position.GN_MIN_REL_DET * np.trace(H) ** 2 or not np.isfinite(det):
+        return np.array([x, y]), np.eye(2) * rssi_position.GN_DEGENERATE_VAR
+    return np.array([x, y]), np.linalg.inv(H)
+
+
+def degenerate(cov: np.ndarray) -> bool:
+    return cov[0, 1] == 0.0 and cov[0, 0] == cov[1, 1] == rssi_position.GN_DEGENERATE_VAR
+
+
+def make_cases(n: int, seed: int = 0):
+    snap = registry.snapshot()
+    rng = np.random.default_rng(seed)
+    lo = snap.xy.min(axis=0)
+    hi = snap.xy.max(axis=0)
+    cases = []
+    for _ in range(n):
+        k = int(rng.integers(3, 5))
+        sel = rng.choice(len(snap), size=k, replace=False)
+        beacons = snap.xy[sel]
+        true = rng.uniform(lo, hi)
+        d_true = np.hypot(*(beacons - true).T)
+        rssi = snap.rssi0[sel] - 10 * snap.n[sel] * np.log10(np.maximum(d_true, 0.1))
+        rssi += rng.normal(0, snap.sigma[sel])
+        dists = rssi_position.rssi_to_distance(rssi, snap.rssi0[sel], snap.n[sel])
+        vars_ = rssi_position.var_distance_from_rssi(dists, snap.n[sel], snap.sigma[sel])
+        cases.append((beacons, dists, vars_, beacons.mean(axis=0)))
+    return cases
+
+
+def run(fn, cases):
+    out = []
+    t0 = time.perf_counter()
+    for beacons, dists, vars_, x0 in cases:
+        out.append(fn(beacons, dists, vars_, x0))
+    return time.perf_counter() - t0, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000)
+    args = parser.parse_args()
+
+    cases = make_cases(args.n)
+    t_ref, ref = run(reference_gauss_newton, cases)
+    t_new, new = run(rssi_position.gauss_newton, cases)
+
+    pairs = [(a, b) for a, b in zip(ref, new) if not degenerate(a[1]) and not degenerate(b[1])]
+    pos_err = max(float(np.max(np.abs(a[0] - b[0]) / (1.0 + np.abs(a[0])))) for a, b in pairs)
+    cov_err = max(float(np.max(np.abs(a[1] - b[1]) / (np.abs(a[1]) + 1e-9))) for a, b in pairs)
+
+    print(f"solves:          {args.n}")
+    print(f"reference:       {args.n / t_ref:10.0f} solves/s")
+    print(f"gauss_newton:    {args.n / t_new:10.0f} solves/s")
+    print(f"speedup:         {t_ref / t_new:10.2f}x")
+    print(f"degenerate:      {args.n - len(pairs):10d}")
+    print(f"max rel |dpos|:  {pos_err:.3g}")
+    print(f"max rel |dcov|:  {cov_err:.3g}")
+
+
+if __name__ == "__main__":
+    main()
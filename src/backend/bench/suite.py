@@ -0,0 +1,181 @@
+"""
+Набор бенчмарков локализации: скорость, задержка, память и точность.
+
+Из src/backend:
+    python -m bench.suite [--boards 20] [--duration 600] [--json out.json] [--baseline base.json]
+    python -m bench.suite --recording session.rec   # без эталона, только скорость
+    python -m bench.suite --engine fingerprint|particle
+    python -m bench.suite --wire binary
+    python -m bench.suite --spikes 0.05 [--no-prefilter]   # провалы RSSI, без предфильтра
+
+С --baseline сравнивает результат с сохранённым прогоном и завершается
+с кодом 1, если скорость упала или ошибка выросла больше допуска.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import ingest
+import particle_filter
+import rssi_filter
+import rssi_position
+import trackers
+from app_state import AppStates
+from bench.recording import read_recording
+from bench.replay import replay, with_timestamp
+from bench.scratch_db import use_scratch_db
+from bench.synthetic import generate
+
+# допустимое ухудшение относительно baseline
+MAX_SLOWDOWN = 0.15
+MAX_RMSE_GROWTH = 0.10
+
+
+def _raw(record) -> ingest.RawMessage:
+    return ingest.RawMessage(record.topic, with_timestamp(record), record.ts)
+
+
+def bench_solver(records, truth=None) -> dict:
+    """Решение по одному сообщению в текущем потоке: задержка и точность."""
+    import mqtt_server
+
+    trackers.pool = trackers.TrackerPool()
+    rssi_filter.pool = rssi_filter.FilterPool()
+    particle_filter.pool = particle_filter.ParticlePool(seed=0)
+    msgs = [_raw(r) for r in records]
+    latencies = np.empty(len(msgs))
+    errors = []
+    # двоичный формат передаёт время с точностью до мс
+    truth_idx = {b: {round(float(t), 3): i for i, t in enumerate(ts)} for b, (ts, _) in (truth or {}).items()}
+
+    t_start = time.perf_counter()
+    for i, msg in enumerate(msgs):
+        t0 = time.perf_counter()
+        fix = mqtt_server.solve_message(msg)
+        latencies[i] = time.perf_counter() - t0
+        if fix is not None and truth:
+            j = truth_idx[fix.board_id].get(round(fix.ts, 3))
+            if j is not None:
+                true_xy = truth[fix.board_id][1][j]
+                errors.append((fix.x - true_xy[0]) ** 2 + (fix.y - true_xy[1]) ** 2)
+    elapsed = time.perf_counter() - t_start
+
+    res = {
+        "messages": len(msgs),
+        "fixes_per_sec": len(msgs) / elapsed,
+        "latency_p50_us": float(np.percentile(latencies, 50) * 1e6),
+        "latency_p99_us": float(np.percentile(latencies, 99) * 1e6),
+    }
+    if errors:
+        res["rmse_m"] = float(np.sqrt(np.mean(errors)))
+    return res
+
+
+def bench_memory(records) -> dict:
+    import mqtt_server
+
+    trackers.pool = trackers.TrackerPool()
+    rssi_filter.pool = rssi_filter.FilterPool()
+    particle_filter.pool = particle_filter.ParticlePool(seed=0)
+    msgs = [_raw(r) for r in records]
+    tracemalloc.start()
+    for msg in msgs:
+        mqtt_server.solve_message(msg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"solver_peak_kb": peak / 1024}
+
+
+def bench_pipeline(records) -> dict:
+    """
+    Полный путь через on_board_message, очереди и запись в базу на
+    максимальной скорости; база - временный файл (см. main).
+    """
+    import mqtt_server
+
+    trackers.pool = trackers.TrackerPool()
+    rssi_filter.pool = rssi_filter.FilterPool()
+    particle_filter.pool = particle_filter.ParticlePool(seed=0)
+    pipeline = ingest.IngestPipeline(mqtt_server.solve_message, mqtt_server.store_fix, policy=ingest.BLOCK,
+                                     prepare=mqtt_server.prepare_batch)
+    mqtt_server.pipeline = pipeline
+    mqtt_server.global_state.set_state(AppStates.WRITE_WAY)
+    mqtt_server.start_ingest()
+
+    t0 = time.perf_counter()
+    replay(records, mqtt_server.on_board_message, speed=0)
+    pipeline.join()
+    mqtt_server.position_writer.flush()
+    elapsed = time.perf_counter() - t0
+    pipeline.stop()
+    stats = pipeline.stats()
+    return {
+        "pipeline_msgs_per_sec": len(records) / elapsed,
+        "pipeline_dropped": stats["dropped"] + stats["writer_dropped"],
+    }
+
+
+def compare(result: dict, baseline: dict) -> list[str]:
+    problems = []
+    for key in ("fixes_per_sec", "pipeline_msgs_per_sec"):
+        if key in result and key in baseline and result[key] < baseline[key] * (1 - MAX_SLOWDOWN):
+            problems.append(f"{key}: {result[key]:.0f} < {baseline[key]:.0f}")
+    if "rmse_m" in result and "rmse_m" in baseline and result["rmse_m"] > baseline["rmse_m"] * (1 + MAX_RMSE_GROWTH):
+        problems.append(f"rmse_m: {result['rmse_m']:.3f} > {baseline['rmse_m']:.3f}")
+    return problems
+
+
+def main():
+    # mqtt_server открывает data.db при импорте - до него переключаемся на временную базу
+    use_scratch_db()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--boards", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recording")
+    parser.add_argument("--json")
+    parser.add_argument("--baseline")
+    parser.add_argument("--no-pipeline", action="store_true")
+    parser.add_argument("--wire", choices=["json", "binary"], default="json")
+    parser.add_argument("--engine", choices=rssi_position.ALL_ENGINES, default=rssi_position.ENGINE)
+    parser.add_argument("--spikes", type=float, default=0.0, help="доля замеров с провалом RSSI")
+    parser.add_argument("--no-prefilter", action="store_true")
+    args = parser.parse_args()
+    rssi_position.ENGINE = args.engine
+    rssi_filter.ENABLED = rssi_filter.ENABLED and not args.no_prefilter
+
+    if args.recording:
+        records = list(read_recording(args.recording))
+        truth = None
+    else:
+        session = generate(args.boards, args.duration, seed=args.seed, binary=args.wire == "binary",
+                           spike_rate=args.spikes)
+        records, truth = session.records, session.truth
+
+    result = bench_solver(records, truth)
+    result.update(bench_memory(records))
+    if not args.no_pipeline:
+        result.update(bench_pipeline(records))
+
+    for key, value in result.items():
+        print(f"{key + ':':<24}{value:12.2f}" if isinstance(value, float) else f"{key + ':':<24}{value:12d}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(result, json.load(f))
+        for p in problems:
+            print("РЕГРЕССИЯ:", p)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Синтетические сессии с известной траекторией.
+
+Платы ходят случайными маршрутами внутри области маяков из beacons.txt,
+RSSI считается по лог-дистанционной модели (обратной к rssi_to_distance)
+с шумом SIGMA плюс пропуски дальних маяков.
+spike_rate - доля замеров с провалом на SPIKE_DB (многолучёвость, заслонение телом).
+binary=True - сообщения в двоичном формате wire, как у новых прошивок.
+
+Из src/backend:
+    python -m bench.synthetic out.rec [--boards 10] [--duration 600] [--binary]
+"""
+import argparse
+import json
+from dataclasses import dataclass
+
+import numpy as np
+
+from beacon_registry import BeaconSnapshot, registry
+import wire
+from bench.recording import Record, write_recording
+
+WALK_SPEED = 1.2
+# маяки дальше этого расстояния (м) не слышны
+MAX_RANGE = 25.0
+# глубина провалов RSSI (дБ), равномерно
+SPIKE_DB = (10.0, 25.0)
+
+
+@dataclass
+class Session:
+    records: list[Record]
+    # истинные позиции на момент каждого сообщения: board -> (ts (n,), xy (n,2))
+    truth: dict[str, tuple[np.ndarray, np.ndarray]]
+
+
+def distance_to_rssi(d: np.ndarray, rssi0: np.ndarray, n: np.ndarray) -> np.ndarray:
+    return rssi0 - 10.0 * n * np.log10(np.maximum(d, 0.1))
+
+
+def random_walk(rng: np.random.Generator, lo: np.ndarray, hi: np.ndarray, ts: np.ndarray) -> np.ndarray:
+    """Движение между случайными точками с постоянной скоростью."""
+    out = np.empty((len(ts), 2))
+    pos = rng.uniform(lo, hi)
+    target = rng.uniform(lo, hi)
+    prev = ts[0]
+    for i, t in enumerate(ts):
+        step = WALK_SPEED * (t - prev)
+        prev = t
+        while step > 0:
+            delta = target - pos
+            dist = float(np.hypot(*delta))
+            if dist <= step:
+                pos = target
+                step -= dist
+                target = rng.uniform(lo, hi)
+            else:
+                pos = pos + delta / dist * step
+                step = 0
+        out[i] = pos
+    return out
+
+
+def generate(boards: int = 10, duration: float = 600.0, period: float = 2.0, jitter: float = 0.2,
+             snap: BeaconSnapshot = None, seed: int = 0, t_start: float = 1.7e9,
+             binary: bool = False, spike_rate: float = 0.0) -> Session:
+    if snap is None:
+        snap = registry.snapshot()
+    rng = np.random.default_rng(seed)
+    lo = snap.xy.min(axis=0)
+    hi = snap.xy.max(axis=0)
+    n_msgs = int(duration / period)
+
+    records = []
+    truth = {}
+    for b in range(boards):
+        # в двоичном формате id платы - 6 байт, как machine.unique_id()
+        board_id = f"{b:012x}" if binary else f"sim_{b}"
+        ts = t_start + rng.uniform(0, period) + np.arange(n_msgs) * period
+        ts = ts + rng.uniform(-jitter, jitter, n_msgs)
+        xy = random_walk(rng, lo, hi, ts)
+        truth[board_id] = (ts, xy)
+
+        d = np.hypot(xy[:, None, 0] - snap.xy[None, :, 0], xy[:, None, 1] - snap.xy[None, :, 1])
+        rssi = distance_to_rssi(d, snap.rssi0, snap.n) + rng.normal(0, 1, d.shape) * snap.sigma
+        if spike_rate > 0:
+            spikes = rng.random(d.shape) < spike_rate
+            rssi[spikes] -= rng.uniform(*SPIKE_DB, int(spikes.sum()))
+        heard = d < MAX_RANGE
+        numbers = np.array([int(id_) if id_.isdigit() else 0 for id_ in snap.ids])
+        for i in range(n_msgs):
+            cols = np.flatnonzero(heard[i])
+            if binary:
+                payload = wire.encode(bytes.fromhex(board_id), i, float(ts[i]), numbers[cols], rssi[i, cols])
+            else:
+                beacons = [{"name": snap.names[j], "rssi": int(round(rssi[i, j]))} for j in cols]
+                payload = json.dumps({"ts": float(ts[i]), "beacons": beacons}).encode()
+            records.append(Record(float(ts[i]), wire.board_topic(board_id), payload))
+
+    records.sort(key=lambda r: r.ts)
+    return Session(records, truth)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--boards", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=600.0)
+    parser.add_argument("--period", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--binary", action="store_true")
+    parser.add_argument("--spikes", type=float, default=0.0)
+    args = parser.parse_args()
+
+    session = generate(args.boards, args.duration, args.period, seed=args.seed, binary=args.binary,
+                       spike_rate=args.spikes)
+    count = write_recording(args.path, session.records)
+    print(f"Записано сообщений: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Онлайн-калибровка параметров модели RSSI (RSSI0, N, SIGMA) для каждого маяка.
+
+Модель rssi = RSSI0 - 10 * N * log10(d) линейна по (RSSI0, N), поэтому
+для маяка достаточно копить суммы (w, Sx, Sy, Sxx, Sxy, Syy) по замерам
+с известной позицией - МНК пересчитывается из них за O(1).
+Источники замеров:
+  - записи сессий с опорными точками: python -m calibration session.rec waypoints.txt
+  - собственные треки (AKL_CALIBRATE=1): уверенные позиции EKF подаются в
+    фоновый поток через очередь, приём сообщений не ждёт подгонки.
+Результат пишется в beacon_registry.CALIBRATION_PATH, реестр подхватывает
+его новой версией снимка без перезапуска.
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+import ingest
+import metrics
+from beacon_registry import BeaconRegistry, BeaconSnapshot, registry
+
+AUTO_CALIBRATE = os.environ.get("AKL_CALIBRATE", "0") == "1"
+
+CALIB_QUEUE_SIZE = 10000
+# как часто (сек) пересчитывать и публиковать параметры
+PUBLISH_INTERVAL = 60.0
+# минимум (взвешенных) замеров для оценки маяка
+MIN_SAMPLES = 50.0
+# минимальное СКО -10*log10(d) (дБ), чтобы оценивать N; иначе только RSSI0
+MIN_SPREAD_DB = 1.5
+# вес замера умножается на FORGET с каждым новым замером маяка: параметры следят за дрейфом
+FORGET = 0.9995
+# ближе этого расстояния (м) модель не работает
+MIN_DISTANCE = 0.5
+# из треков берутся только позиции с дисперсией не больше (м^2)
+TRACK_MAX_VAR = 4.0
+
+RSSI0_RANGE = (-90.0, -30.0)
+N_RANGE = (1.5, 5.0)
+SIGMA_RANGE = (0.5, 15.0)
+
+SAMPLES_ADDED = metrics.counter("akl_calibration_samples_total", "Samples accepted by beacon calibration")
+PUBLISHED = metrics.counter("akl_calibration_published_total", "Calibration results written to disk")
+
+_STOP = object()
+
+
+class Calibrator():
+    """
+    Потоковый МНК по маякам. add()/add_arrays() - синхронно, submit() - через очередь
+    фонового потока, который раз в interval публикует результат в реестр.
+    """
+
+    def __init__(self, beacons: BeaconRegistry = registry, queue_size: int = CALIB_QUEUE_SIZE,
+                 interval: float = PUBLISH_INTERVAL):
+        self.registry = beacons
+        self.interval = interval
+        self.queue = ingest.BoundedQueue(queue_size, ingest.DROP_OLDEST)
+        self._rows: dict[str, int] = {}
+        self._names: list[str] = []
+        self._stats = np.zeros((0, 6))
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _row(self, name: str) -> int:
+        row = self._rows.get(name)
+        if row is None:
+            row = self._rows[name] = len(self._names)
+            self._names.append(name)
+            if row >= len(self._stats):
+                grown = np.zeros((max(8, 2 * len(self._stats)), 6))
+                grown[:len(self._stats)] = self._stats
+                self._stats = grown
+        return row
+
+    def add(self, rssi_dict: dict[str, float], xy, snap: Optional[BeaconSnapshot] = None) -> int:
+        """Замер в известной точке xy. Учитываются маяки этажа самого сильного маяка."""
+        if snap is None:
+            snap = self.registry.snapshot()
+        idx = snap.lookup(rssi_dict.keys())
+        known = idx >= 0
+        rssi = np.fromiter(rssi_dict.values(), dtype=np.float64, count=len(known))[known]
+        return self.add_arrays(snap, idx[known], rssi, xy)
+
+    def add_arrays(self, snap: BeaconSnapshot, idx: np.ndarray, rssi: np.ndarray, xy) -> int:
+        """add() по индексам маяков в снимке snap."""
+        if len(idx) == 0:
+            return 0
+        rssi = np.asarray(rssi, dtype=np.float64)
+        on_floor = snap.floor[idx] == snap.floor[idx[np.argmax(rssi)]]
+        idx, rssi = idx[on_floor], rssi[on_floor]
+
+        d = np.hypot(snap.xy[idx, 0] - xy[0], snap.xy[idx, 1] - xy[1])
+        x = -10.0 * np.log10(np.maximum(d, MIN_DISTANCE))
+        values = np.stack([np.ones_like(x), x, rssi, x * x, x * rssi, rssi * rssi], axis=-1)
+        with self._lock:
+            rows = np.array([self._row(snap.names[i]) for i in idx], dtype=np.intp)
+            self._stats[rows] *= FORGET
+            self._stats[rows] += values
+        SAMPLES_ADDED.inc()
+        return len(idx)
+
+    def fit(self, snap: Optional[BeaconSnapshot] = None) -> dict[str, dict[str, float]]:
+        """Параметры маяков, по которым набралось MIN_SAMPLES замеров."""
+        if snap is None:
+            snap = self.registry.snapshot()
+        with self._lock:
+            names = list(self._names)
+            stats = self._stats[:len(names)].copy()
+        if not names:
+            return {}
+        w, sx, sy, sxx, sxy, syy = stats.T
+        ok = w >= MIN_SAMPLES
+        w = np.where(ok, w, 1.0)
+        mx, my = sx / w, sy / w
+        vxx = sxx / w - mx * mx
+        vxy = sxy / w - mx * my
+        vyy = syy / w - my * my
+
+        cur = snap.lookup(names)
+        cur_n = np.where(cur >= 0, snap.n[cur], np.nan)
+        spread = vxx >= MIN_SPREAD_DB ** 2
+        n = np.where(spread, vxy / np.where(spread, vxx, 1.0), cur_n)
+        n = np.clip(n, *N_RANGE)
+        rssi0 = np.clip(my - n * mx, *RSSI0_RANGE)
+        res = np.maximum(vyy - 2.0 * n * vxy + n * n * vxx, 0.0)
+        sigma = np.clip(np.sqrt(res * w / np.maximum(w - 2.0, 1.0)), *SIGMA_RANGE)
+
+        out = {}
+        for i, name in enumerate(names):
+            if ok[i] and np.isfinite(n[i]):
+                out[name] = {"rssi0": round(float(rssi0[i]), 2), "n": round(float(n[i]), 3),
+                             "sigma": round(float(sigma[i]), 2)}
+        return out
+
+    def publish(self) -> int:
+        """Пишет подобранные параметры (поверх прежних) и перезагружает реестр."""
+        params = self.fit()
+        if not params:
+            return 0
+        merged = self.registry.calibration()
+        merged.update(params)
+        self.registry.write_calibration(merged)
+        PUBLISHED.inc()
+        return len(params)
+
+    def submit(self, snap: BeaconSnapshot, idx: np.ndarray, rssi: np.ndarray, xy):
+        """Не блокирует: при переполнении очереди выбрасывается самый старый замер."""
+        self.queue.put((snap, idx, rssi, xy))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="calibration", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        if self._thread is None:
+            return
+        self.queue.put_wait(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        next_publish = time.monotonic() + self.interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(next_publish - time.monotonic(), 0.0))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self.queue.task_done()
+                self.publish()
+                return
+            if item is not None:
+                try:
+                    self.add_arrays(*item)
+                except Exception as e:
+                    print("Ошибка калибровки по замеру:", e)
+                finally:
+                    self.queue.task_done()
+            if time.monotonic() >= next_publish:
+                next_publish = time.monotonic() + self.interval
+                try:
+                    self.publish()
+                except Exception as e:
+                    print("Ошибка публикации калибровки:", e)
+
+
+calibrator = Calibrator()
+
+
+def read_waypoints(path: str) -> tuple[np.ndarray, np.ndarray]:
+    """Файл "ts;x;y" (unix сек, метры) -> ts (n,), xy (n,2), отсортированные по времени."""
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().replace(",", ".").split(";")
+            if len(parts) < 3 or parts[0].startswith("#"):
+                continue
+            try:
+                rows.append([float(p) for p in parts[:3]])
+            except ValueError:
+                continue
+    data = np.array(sorted(rows)).reshape(-1, 3)
+    return data[:, 0], data[:, 1:3]
+
+
+def main():
+    import mqtt_server
+    from bench.recording import read_recording
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording")
+    parser.add_argument("waypoints")
+    parser.add_argument("--board", help="учитывать только эту плату")
+    parser.add_argument("--dry-run", action="store_true", help="только показать результат")
+    args = parser.parse_args()
+
+    wp_ts, wp_xy = read_waypoints(args.waypoints)
+    cal = Calibrator()
+    used = 0
+    for record in read_recording(args.recording):
+        try:
+            board_id, ts, idx, rssi, snap = mqtt_server.decode_message(
+                ingest.RawMessage(record.topic, record.payload, record.ts))
+        except Exception:
+            continue
+        if args.board and board_id != args.board or not wp_ts[0] <= ts <= wp_ts[-1]:
+            continue
+        xy = (np.interp(ts, wp_ts, wp_xy[:, 0]), np.interp(ts, wp_ts, wp_xy[:, 1]))
+        used += cal.add_arrays(snap, idx, rssi, xy) > 0
+
+    print(f"Использовано сообщений: {used}")
+    params = cal.fit()
+    for name, p in sorted(params.items()):
+        print(f"{name}: RSSI0={p['rssi0']:.1f} N={p['n']:.2f} SIGMA={p['sigma']:.1f}")
+    if not args.dry_run and params:
+        cal.publish()
+        print("Записано в", cal.registry.calibration_path)
+
+
+if __name__ == "__main__":
+    main()
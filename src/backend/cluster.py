@@ -0,0 +1,188 @@
+"""
+Многопроцессный приём сообщений.
+
+Из src/backend:
+    python -m cluster --workers 4             # платы делятся по хешу топика
+    python -m cluster --workers 4 --shared    # общая подписка $share/akl/...
+    AKL_INGEST=external uvicorn main:app      # API без своего MQTT, только читает базу
+
+Каждый воркер - отдельный процесс со своими решателями, трекерами и
+писателем; все пишут в одну базу SQLite (WAL, пачками).
+При делении по хешу воркер подписан только на свои корзины топиков
+(test/beacons/s<корзина>/<id>, см. wire.shard_bucket): брокер доставляет
+каждое сообщение одному воркеру, и фиксы одной платы идут по порядку
+через один трекер. Топики старых прошивок без корзины получает воркер 0.
+Общая подписка тоже доставляет сообщение один раз, но брокер должен
+закреплять топик за подписчиком (например, EMQX hash_topic), иначе
+трекер платы видит только часть её сообщений.
+
+Маршрут воркеры узнают из базы (незавершённый Route), id фиксов выдаёт
+база; процесс API подтягивает новые фиксы в живой буфер (tail_positions).
+Завершив маршрут, воркер дописывает уже принятые сообщения и отмечает
+это в IngestWorker.acked_route; API сжимает маршрут только после
+подтверждения всех живых воркеров (wait_for_workers).
+
+Масштабирование по числу воркеров меряет python -m bench.cluster
+(с --broker - через настоящий брокер).
+"""
+import argparse
+import multiprocessing as mp
+import os
+import threading
+import time
+from typing import Optional
+
+import analytics
+import calibration
+import live
+import wire
+from app_state import AppStates, GlobalState
+from data import db
+
+# AKL_INGEST=external - MQTT обслуживают процессы cluster, а не main.py
+EXTERNAL_INGEST = os.environ.get("AKL_INGEST", "local") == "external"
+
+SHARE_GROUP = "akl"
+# как часто (сек) воркер перечитывает текущий маршрут, а API - новые фиксы
+ROUTE_POLL_INTERVAL = 0.5
+TAIL_INTERVAL = 0.2
+# воркер, не обновлявший IngestWorker дольше WORKER_STALE (сек), считается остановленным
+WORKER_STALE = 10 * ROUTE_POLL_INTERVAL
+# сколько API ждёт подтверждений воркеров перед сжатием маршрута
+FINISH_TIMEOUT = 30.0
+
+
+def worker_name(index: int) -> str:
+    return f"akl-ingest-{index}"
+
+
+def watch_route(name: str, stop: Optional[threading.Event] = None, interval: float = ROUTE_POLL_INTERVAL):
+    """
+    Воркер: состояние записи и id маршрута берутся из базы, а не из API.
+    При смене маршрута принятые сообщения прежнего дописываются, затем
+    воркер подтверждает: маршруты до acked_route включительно он больше не пишет.
+    """
+    import mqtt_server
+
+    stop = stop or threading.Event()
+    state = mqtt_server.global_state
+    acked = 0
+    while not stop.is_set():
+        try:
+            active, last = db.get_route_status()
+            current = state.get_route_id()
+            if active != current:
+                if active is None:
+                    state.set_state(AppStates.WAITING)
+                    state.set_route_id(None)
+                else:
+                    state.set_route_id(active)
+                    state.set_state(AppStates.WRITE_WAY)
+                if current is not None:
+                    # пока дописывается прежний маршрут, воркер отмечается живым с прежним подтверждением
+                    marker = mqtt_server.pipeline.mark()
+                    while not marker.wait(interval):
+                        db.ack_worker(name, acked, mqtt_server.MESSAGES_RECEIVED.value)
+                    mqtt_server.position_writer.flush()
+            acked = last if active is None else active - 1
+            db.ack_worker(name, acked, mqtt_server.MESSAGES_RECEIVED.value)
+        except Exception as e:
+            print("Ошибка чтения маршрута:", e)
+        stop.wait(interval)
+
+
+def wait_for_workers(route_id: int, timeout: float = FINISH_TIMEOUT) -> bool:
+    """API: ждёт, пока все живые воркеры подтвердят, что дописали маршрут route_id."""
+    deadline = time.monotonic() + timeout
+    while True:
+        pending = db.get_pending_workers(route_id, time.time() - WORKER_STALE)
+        if not pending:
+            return True
+        if time.monotonic() > deadline:
+            print("Воркеры не подтвердили завершение маршрута:", ", ".join(pending))
+            return False
+        time.sleep(ROUTE_POLL_INTERVAL / 5)
+
+
+def run_worker(index: int, count: int, shared: bool = False):
+    import mqtt_server
+
+    if shared:
+        mqtt_server.SHARE_GROUP = SHARE_GROUP
+    else:
+        mqtt_server.SHARD = (index, count)
+    mqtt_server.LOCAL_IDS = False
+    # аналитику ведёт процесс API по строкам из базы (tail_positions)
+    analytics.ENABLED = False
+    # каждый воркер видит только свои платы: частичные подгонки разных
+    # процессов перезаписывали бы calibration.json друг друга
+    if calibration.AUTO_CALIBRATE and index == 0:
+        print("Автокалибровка в режиме cluster отключена (AKL_CALIBRATE работает при приёме в main.py)")
+    calibration.AUTO_CALIBRATE = False
+    threading.Thread(target=watch_route, args=(worker_name(index),), name="route-watch", daemon=True).start()
+    mqtt_server.mqtt_run(client_id=worker_name(index))
+
+
+def start_workers(count: int, shared: bool = False) -> list[mp.Process]:
+    # spawn: дочерний процесс сам открывает базу и не наследует потоки родителя
+    ctx = mp.get_context("spawn")
+    procs = [ctx.Process(target=run_worker, args=(i, count, shared), name=worker_name(i), daemon=True)
+             for i in range(count)]
+    for p in procs:
+        p.start()
+    return procs
+
+
+def tail_positions(stop: Optional[threading.Event] = None, interval: float = TAIL_INTERVAL):
+    """Процесс API: новые строки BoardPosition из базы -> живой буфер и подписчики SSE."""
+    stop = stop or threading.Event()
+    global_state = GlobalState()
+    # без API маршрут не может быть открыт: воркеры не должны писать в забытый маршрут
+    db.finish_open_routes()
+    last_id = db.get_max_position_id()
+    live.fixes.reset_ids(last_id + 1)
+    while not stop.is_set():
+        try:
+            rows = db.tail_positions(last_id)
+            if rows:
+                live.fixes.extend(rows)
+                for row in rows:
+                    if row["ts"] is not None:
+                        analytics.accumulator.add(row["board"], row["ts"], row["x"], row["y"], row["floor"])
+                last_id = rows[-1]["id"]
+                global_state.save_last_updated()
+                continue
+            # после удаления последнего маршрута SQLite снова выдаёт освободившиеся id
+            max_id = db.get_max_position_id()
+            if max_id < last_id:
+                last_id = max_id
+                live.fixes.reset_ids(last_id + 1)
+        except Exception as e:
+            print("Ошибка чтения позиций:", e)
+        stop.wait(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shared", action="store_true", help="общая подписка вместо деления по хешу")
+    args = parser.parse_args()
+    if not args.shared and args.workers > wire.SHARD_BUCKETS:
+        parser.error(f"при делении по хешу воркеров не больше {wire.SHARD_BUCKETS}")
+
+    procs = start_workers(args.workers, args.shared)
+    print(f"Запущено воркеров: {len(procs)}")
+    try:
+        while all(p.is_alive() for p in procs):
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
+
+
+if __name__ == "__main__":
+    main()
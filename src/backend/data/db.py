@@ -1,38 +1,257 @@
 import os
-from sqlalchemy import Column, DateTime, Integer, String, create_engine, desc
-from sqlalchemy.orm import declarative_base, sessionmaker
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from sqlalchemy import (Column, DateTime, Float, ForeignKey, Integer, LargeBinary, String, create_engine,
+                        delete, desc, event, func, select, text, update)
+from sqlalchemy.orm import Session as OrmSession, declarative_base, sessionmaker
 from datetime import datetime
 
 Base = declarative_base()
 
 
+class Route(Base):
+    __tablename__ = "Route"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    started_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+    # сколько раз точки переносились в RouteTrack (0 - не сжат)
+    compacted = Column(Integer, default=0)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "compacted": bool(self.compacted),
+        }
+
+
 class BoardPosition(Base):
     __tablename__ = "BoardPosition"
     # нужен первичный ключ
     id = Column(Integer, primary_key=True, autoincrement=True)
-    time = Column(DateTime, default=datetime.now())
-    x = Column(Integer)
-    y = Column(Integer)
+    route_id = Column(Integer, ForeignKey("Route.id"), index=True)
+    board_id = Column(String, index=True)
+    time = Column(DateTime, default=datetime.now, index=True)
+    x = Column(Float)
+    y = Column(Float)
+    # этаж фикса (для аналитики по этажам)
+    floor = Column(Integer, nullable=True)
 
     def to_dict(self) -> dict:
         res = {
             # "date": datetime.strftime(self.time, r"%Y:%m:%d %H:%M"),
+            "id" : self.id,
+            "board" : self.board_id,
             "x" : self.x,
             "y" : self.y
         }
         return res
 
 
+class RouteTrack(Base):
+    """
+    Сжатый трек одной платы в завершённом маршруте:
+    x, y, t - байты массивов float32 (t - секунды от t0).
+    encoding "delta" - хранятся разности соседних значений.
+    ids - id исходных строк BoardPosition, разности int32 (курсор клиента).
+    """
+    __tablename__ = "RouteTrack"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    route_id = Column(Integer, ForeignKey("Route.id"), index=True)
+    board_id = Column(String)
+    count = Column(Integer)
+    encoding = Column(String, default="raw")
+    t0 = Column(Float)
+    x = Column(LargeBinary)
+    y = Column(LargeBinary)
+    t = Column(LargeBinary)
+    ids = Column(LargeBinary, nullable=True)
+
+
+class IngestWorker(Base):
+    """
+    Воркер приёма cluster: acked_route - все маршруты с id <= acked_route он
+    больше не пишет (буферы сброшены); seen_at - последнее обновление (unix сек),
+    received - принято сообщений от брокера.
+    """
+    __tablename__ = "IngestWorker"
+    name = Column(String, primary_key=True)
+    acked_route = Column(Integer, default=0)
+    seen_at = Column(Float)
+    received = Column(Integer, default=0)
+
+
 CUR_DIR = os.path.dirname(os.path.realpath(__file__))
-DB_PATH = os.path.join(CUR_DIR, "data.db")
+# AKL_DB_PATH - другой файл базы (бенчмарки пишут во временный, см. bench.scratch_db)
+DB_PATH = os.environ.get("AKL_DB_PATH") or os.path.join(CUR_DIR, "data.db")
+
+# пул соединений: каждый поток берёт своё соединение на время одной операции
+POOL_SIZE = 8
+MAX_OVERFLOW = 8
+# сколько (сек) ждать снятия блокировки записи
+BUSY_TIMEOUT = 30
+
+# при изменении схемы база пересоздаётся, если нет перехода в MIGRATIONS
+SCHEMA_VERSION = 4
+# переходы без потери данных: версия -> SQL перехода на следующую
+MIGRATIONS = {
+    2: ["ALTER TABLE RouteTrack ADD COLUMN ids BLOB"],
+    3: ["ALTER TABLE BoardPosition ADD COLUMN floor INTEGER"],
+}
+
+
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    # WAL: читатели не блокируют писателя; NORMAL - fsync только на checkpoint
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def open_engine(path: str):
+    """Движок SQLite для файла path со схемой текущей версии."""
+    eng = create_engine(
+        f"sqlite:///{path}",
+        echo=False,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_pre_ping=True,
+        connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT},
+    )
+    event.listen(eng, "connect", _set_sqlite_pragma)
+    with eng.begin() as conn:
+        version = conn.execute(text("PRAGMA user_version")).scalar()
+        while version in MIGRATIONS and version < SCHEMA_VERSION:
+            for sql in MIGRATIONS[version]:
+                conn.execute(text(sql))
+            version += 1
+            conn.execute(text(f"PRAGMA user_version = {version}"))
+        if version != SCHEMA_VERSION:
+            Base.metadata.drop_all(conn)
+            conn.execute(text("DROP TABLE IF EXISTS BoardPosition"))
+            conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+        Base.metadata.create_all(conn)
+    return eng
+
+
+engine = open_engine(DB_PATH)
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def use_database(path: str):
+    """
+    Переключает модуль на файл path. Писатель позиций держит свой движок:
+    его переключают отдельно (PositionWriter.engine).
+    """
+    global engine, DB_PATH
+    old = engine
+    DB_PATH = path
+    engine = open_engine(path)
+    Session.configure(bind=engine)
+    old.dispose()
+
+
+@contextmanager
+def session_scope() -> Iterator[OrmSession]:
+    """Отдельная сессия на единицу работы: commit при успехе, rollback при ошибке."""
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def get_last_pos() -> Optional[BoardPosition]:
+    with session_scope() as session:
+        return session.scalars(select(BoardPosition).order_by(desc(BoardPosition.time)).limit(1)).first()
+
+
+def get_max_position_id() -> int:
+    with session_scope() as session:
+        return session.scalar(select(func.max(BoardPosition.id))) or 0
+
+
+def tail_positions(after_id: int, limit: int = 5000) -> list[dict]:
+    """Новые строки всех маршрутов в формате живого буфера (см. cluster.tail_positions)."""
+    with session_scope() as session:
+        rows = session.execute(
+            select(BoardPosition.id, BoardPosition.board_id, BoardPosition.time, BoardPosition.x, BoardPosition.y,
+                   BoardPosition.floor)
+            .where(BoardPosition.id > after_id).order_by(BoardPosition.id).limit(limit)).all()
+        return [{"id": r.id, "board": r.board_id, "ts": r.time.timestamp() if r.time else None, "x": r.x, "y": r.y,
+                 "floor": r.floor} for r in rows]
+
+
+def finish_open_routes() -> None:
+    with session_scope() as session:
+        session.execute(update(Route).where(Route.finished_at.is_(None)).values(finished_at=datetime.now()))
+
+
+def finish_route(route_id: int) -> None:
+    with session_scope() as session:
+        session.execute(update(Route).where(Route.id == route_id, Route.finished_at.is_(None))
+                        .values(finished_at=datetime.now()))
+
+
+def get_active_route_id() -> Optional[int]:
+    """Незавершённый маршрут, в который сейчас пишутся точки (воркеры приёма читают его из базы)."""
+    with session_scope() as session:
+        return session.scalar(select(func.max(Route.id)).where(Route.finished_at.is_(None)))
+
+
+def get_route_status() -> tuple[Optional[int], int]:
+    """Незавершённый маршрут и id последнего маршрута (0 - маршрутов нет) одним чтением."""
+    with session_scope() as session:
+        active = session.scalar(select(func.max(Route.id)).where(Route.finished_at.is_(None)))
+        return active, session.scalar(select(func.max(Route.id))) or 0
+
+
+def ack_worker(name: str, acked_route: int, received: int) -> None:
+    with session_scope() as session:
+        session.merge(IngestWorker(name=name, acked_route=acked_route, seen_at=time.time(), received=received))
+
+
+def get_pending_workers(route_id: int, alive_since: float) -> list[str]:
+    """Живые воркеры (seen_at >= alive_since), ещё не подтвердившие маршрут route_id."""
+    with session_scope() as session:
+        return list(session.scalars(select(IngestWorker.name).where(
+            IngestWorker.seen_at >= alive_since, IngestWorker.acked_route < route_id)).all())
+
+
+def get_workers() -> list[dict]:
+    with session_scope() as session:
+        return [{"name": w.name, "acked_route": w.acked_route, "seen_at": w.seen_at, "received": w.received}
+                for w in session.scalars(select(IngestWorker).order_by(IngestWorker.name)).all()]
+
+
+def create_route() -> int:
+    # одновременно записывается только один маршрут
+    finish_open_routes()
+    with session_scope() as session:
+        route = Route()
+        session.add(route)
+        session.flush()
+        return route.id
+
+
+def get_routes() -> list[dict]:
+    with session_scope() as session:
+        return [r.to_dict() for r in session.scalars(select(Route).order_by(Route.id)).all()]
 
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False)
-Base.metadata.drop_all(engine) 
-Base.metadata.create_all(engine)
 
-Session = sessionmaker(bind=engine)
-session = Session()
+def get_last_route_id() -> Optional[int]:
+    with session_scope() as session:
+        return session.scalar(select(func.max(Route.id)))
 
 
-def get_last_pos():
-    session.query(BoardPosition).order_by(desc(BoardPosition.time)).first()
+def delete_route(route_id: int) -> None:
+    with session_scope() as session:
+        session.execute(delete(BoardPosition).where(BoardPosition.route_id == route_id))
+        session.execute(delete(RouteTrack).where(RouteTrack.route_id == route_id))
+        session.execute(delete(Route).where(Route.id == route_id))
@@ -0,0 +1,184 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import delete, func, select
+
+from data import db
+
+RAW = "raw"
+DELTA = "delta"
+
+
+@dataclass
+class Track:
+    """
+    Трек одной платы: t - секунды от t0, все массивы float32.
+    ids - id исходных строк BoardPosition (None у треков, сжатых без них).
+    """
+    board_id: str
+    t0: float
+    x: np.ndarray
+    y: np.ndarray
+    t: np.ndarray
+    ids: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def to_dict(self) -> dict:
+        return {
+            "t0": self.t0,
+            "x": self.x.tolist(),
+            "y": self.y.tolist(),
+            "t": self.t.tolist(),
+        }
+
+
+def _encode(values: np.ndarray, encoding: str) -> bytes:
+    values = values.astype(np.float32)
+    if encoding == DELTA:
+        values = np.diff(values, prepend=np.float32(0))
+    return values.tobytes()
+
+
+def _decode(blob: bytes, encoding: str) -> np.ndarray:
+    values = np.frombuffer(blob, dtype=np.float32)
+    if encoding == DELTA:
+        values = np.cumsum(values, dtype=np.float64).astype(np.float32)
+    return values
+
+
+def _encode_ids(ids: np.ndarray) -> bytes:
+    # id одной платы возрастают: хранятся разности int32
+    return np.diff(ids, prepend=0).astype(np.int32).tobytes()
+
+
+def _decode_ids(blob: bytes) -> np.ndarray:
+    return np.cumsum(np.frombuffer(blob, dtype=np.int32), dtype=np.int64)
+
+
+def track_from_row(row: db.RouteTrack) -> Track:
+    return Track(row.board_id, row.t0,
+                 _decode(row.x, row.encoding), _decode(row.y, row.encoding), _decode(row.t, row.encoding),
+                 _decode_ids(row.ids) if row.ids is not None else None)
+
+
+def _tracks_from_positions(rows) -> dict[str, Track]:
+    """rows: (id, board_id, time, x, y), упорядоченные по id."""
+    by_board: dict[str, list] = {}
+    for pos_id, board_id, time, x, y in rows:
+        by_board.setdefault(board_id, []).append((time.timestamp(), x, y, pos_id))
+    tracks = {}
+    for board_id, items in by_board.items():
+        arr = np.array(items, dtype=np.float64)
+        t0 = float(arr[:, 0].min())
+        tracks[board_id] = Track(board_id, t0, arr[:, 1].astype(np.float32),
+                                 arr[:, 2].astype(np.float32), (arr[:, 0] - t0).astype(np.float32),
+                                 np.array([item[3] for item in items], dtype=np.int64))
+    return tracks
+
+
+def _merge(a: Track, b: Track) -> Track:
+    t0 = min(a.t0, b.t0)
+    t = np.concatenate([a.t + np.float32(a.t0 - t0), b.t + np.float32(b.t0 - t0)])
+    ids = np.concatenate([a.ids, b.ids]) if a.ids is not None and b.ids is not None else None
+    return Track(a.board_id, t0, np.concatenate([a.x, b.x]), np.concatenate([a.y, b.y]), t, ids)
+
+
+def compact_route(route_id: int, encoding: str = RAW) -> int:
+    """
+    Переносит точки маршрута из BoardPosition в столбцовые RouteTrack
+    (по одной записи на плату) и удаляет исходные строки.
+    Повторный вызов дописывает точки, пришедшие после предыдущего сжатия.
+    Возвращает число перенесённых точек.
+    """
+    with db.session_scope() as session:
+        rows = session.execute(
+            select(db.BoardPosition.id, db.BoardPosition.board_id, db.BoardPosition.time,
+                   db.BoardPosition.x, db.BoardPosition.y)
+            .where(db.BoardPosition.route_id == route_id)
+            .order_by(db.BoardPosition.id)
+        ).all()
+        tracks = _tracks_from_positions(rows)
+
+        existing = session.scalars(select(db.RouteTrack).where(db.RouteTrack.route_id == route_id)).all()
+        for row in existing:
+            old = track_from_row(row)
+            tracks[old.board_id] = _merge(old, tracks[old.board_id]) if old.board_id in tracks else old
+            session.delete(row)
+
+        for track in tracks.values():
+            session.add(db.RouteTrack(
+                route_id=route_id, board_id=track.board_id, count=len(track), encoding=encoding, t0=track.t0,
+                x=_encode(track.x, encoding), y=_encode(track.y, encoding), t=_encode(track.t, encoding),
+                ids=_encode_ids(track.ids) if track.ids is not None else None,
+            ))
+        session.execute(delete(db.BoardPosition).where(db.BoardPosition.route_id == route_id))
+
+        route = session.get(db.Route, route_id)
+        if route is not None:
+            route.compacted = (route.compacted or 0) + 1
+            if route.finished_at is None:
+                route.finished_at = datetime.now()
+        return len(rows)
+
+
+def load_route(route_id: int) -> dict[str, Track]:
+    """
+    Все треки маршрута по платам. Сжатые треки читаются через
+    np.frombuffer без копирования; ещё не сжатые точки досчитываются из BoardPosition.
+    """
+    return load_route_since(route_id)[0]
+
+
+def load_route_since(route_id: int, after_id: Optional[int] = None) -> tuple[dict[str, Track], int, int]:
+    """
+    Дочитывание маршрута: без after_id - все треки (как load_route),
+    иначе только точки BoardPosition с id > after_id.
+    Возвращает треки, id последней прочитанной точки (after_id или 0,
+    если новых нет) и число сжатий маршрута (см. compact_route).
+    """
+    with db.session_scope() as session:
+        tracks = {}
+        if after_id is None:
+            tracks = {row.board_id: track_from_row(row) for row in
+                      session.scalars(select(db.RouteTrack).where(db.RouteTrack.route_id == route_id)).all()}
+        rows = session.execute(
+            select(db.BoardPosition.id, db.BoardPosition.board_id, db.BoardPosition.time,
+                   db.BoardPosition.x, db.BoardPosition.y)
+            .where(db.BoardPosition.route_id == route_id, db.BoardPosition.id > (after_id or 0))
+            .order_by(db.BoardPosition.id)
+        ).all()
+        compacted = session.scalar(select(db.Route.compacted).where(db.Route.id == route_id)) or 0
+    for board_id, track in _tracks_from_positions(rows).items():
+        tracks[board_id] = _merge(tracks[board_id], track) if board_id in tracks else track
+    return tracks, rows[-1].id if rows else after_id or 0, compacted
+
+
+def positions_after(after_id: int, route_id: Optional[int] = None) -> list[dict]:
+    """
+    Точки маршрута с id > after_id в формате BoardPosition.to_dict, по
+    возрастанию id; route_id=None - последний маршрут. Точки сжатого
+    маршрута берутся из RouteTrack по сохранённым id, поэтому курсор
+    клиента работает и после завершения маршрута.
+    """
+    with db.session_scope() as session:
+        if route_id is None:
+            route_id = session.scalar(select(func.max(db.Route.id)))
+            if route_id is None:
+                return []
+        items = [p.to_dict() for p in session.scalars(
+            select(db.BoardPosition)
+            .where(db.BoardPosition.route_id == route_id, db.BoardPosition.id > after_id)).all()]
+        compacted = session.scalars(select(db.RouteTrack).where(db.RouteTrack.route_id == route_id)).all()
+    for row in compacted:
+        track = track_from_row(row)
+        if track.ids is None:
+            continue
+        sel = np.flatnonzero(track.ids > after_id)
+        items.extend({"id": int(i), "board": track.board_id, "x": float(x), "y": float(y)}
+                     for i, x, y in zip(track.ids[sel].tolist(), track.x[sel].tolist(), track.y[sel].tolist()))
+    items.sort(key=lambda item: item["id"])
+    return items
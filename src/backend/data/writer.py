@@ -0,0 +1,128 @@
+import atexit
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import insert
+
+import metrics
+from data import db
+
+# сброс буфера: по числу строк или по времени (мс) с первой несохранённой строки
+FLUSH_ROWS = 500
+FLUSH_MS = 200
+
+COMMIT_TIME = metrics.histogram("akl_db_commit_seconds", "Position batch insert and commit duration")
+ROWS_WRITTEN = metrics.counter("akl_db_rows_written_total", "BoardPosition rows written")
+
+
+class PositionWriter():
+    """
+    Буферизует строки BoardPosition и пишет их пачкой
+    (один executemany и один commit), когда набралось flush_rows
+    строк или прошло flush_ms миллисекунд.
+    """
+
+    def __init__(self, engine=db.engine, flush_rows: int = FLUSH_ROWS, flush_ms: int = FLUSH_MS):
+        self.engine = engine
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_ms / 1000.0
+        self._buf: list[dict] = []
+        self._first_ts: Optional[float] = None
+        self._cond = threading.Condition()
+        self._closed = False
+        # пачек, которые сейчас пишутся (фоновым потоком или flush)
+        self._writing = 0
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="position-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, row: dict):
+        with self._cond:
+            if not self._buf:
+                self._first_ts = time.monotonic()
+            self._buf.append(row)
+            if len(self._buf) >= self.flush_rows:
+                self._cond.notify()
+
+    def _take(self) -> list[dict]:
+        rows = self._buf
+        self._buf = []
+        self._first_ts = None
+        self._writing += 1
+        return rows
+
+    def _done(self):
+        with self._cond:
+            self._writing -= 1
+            self._cond.notify_all()
+
+    def _write(self, rows: list[dict]):
+        if not rows:
+            return
+        with metrics.timer(COMMIT_TIME):
+            with self.engine.begin() as conn:
+                conn.execute(insert(db.BoardPosition), rows)
+        ROWS_WRITTEN.inc(len(rows))
+        self.flushes += 1
+        self.rows_written += len(rows)
+
+    def flush(self):
+        """
+        Пишет буфер и дожидается пачек, уже взятых фоновым потоком:
+        после возврата все добавленные ранее строки в базе.
+        """
+        with self._cond:
+            rows = self._take()
+        try:
+            self._write(rows)
+        finally:
+            self._done()
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._buf) >= self.flush_rows:
+                        break
+                    if self._buf:
+                        left = self._first_ts + self.flush_interval - time.monotonic()
+                        if left <= 0:
+                            break
+                        self._cond.wait(left)
+                    else:
+                        self._cond.wait()
+                closed = self._closed
+                rows = self._take()
+            try:
+                self._write(rows)
+            except Exception as e:
+                print("Ошибка записи позиций:", e)
+            finally:
+                self._done()
+            if closed:
+                return
+
+    def close(self):
+        """Сбрасывает остаток буфера и останавливает поток."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+writer = PositionWriter()
+atexit.register(writer.close)
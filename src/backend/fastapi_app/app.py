@@ -1,14 +1,23 @@
-import csv
-import re
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse
+import asyncio
+import json
+from fastapi import FastAPI, UploadFile, File, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import pathlib
 
 from app_state import GlobalState, AppStates
-from data import db
+import analytics
+import cluster
+from beacon_registry import registry
+from data import db, route_store
+import live
+import metrics
+import mqtt_server
+import route_lod
+from navigation import navigator
 import time
-from typing import List
+from typing import List, Optional
 import random
 
 start_time = time.time()
@@ -18,7 +27,6 @@ app = FastAPI()
 positions: List[dict] = []
 
 static_path = pathlib.Path(__file__).parent / "static"
-data_path = pathlib.Path(__file__).parent.parent / "data" / "beacons.txt"
 
 app.mount("/static", StaticFiles(directory=static_path), name="static")
 global_state = GlobalState()
@@ -32,23 +40,74 @@ async def root():
 
 @app.post("/api/delete_last_way")
 async def delete_route():
-    db.session.query(db.BoardPosition).delete()
+    route_id = await run_in_threadpool(db.get_last_route_id)
+    if route_id is not None:
+        if route_id == global_state.get_route_id():
+            global_state.set_state(AppStates.WAITING)
+            global_state.set_route_id(None)
+        await run_in_threadpool(db.delete_route, route_id)
+        route_lod.cache.forget(route_id)
+    live.fixes.clear()
     return {}
 
 
 @app.post("/api/start_way")
 async def start_route():
+    route_id = await run_in_threadpool(db.create_route)
+    live.fixes.clear()
+    global_state.set_route_id(route_id)
     global_state.set_state(AppStates.WRITE_WAY)
-    db.session.query(db.BoardPosition).delete()
-    print("Start route")
-    return {}
+    print("Start route", route_id)
+    return {"cursor": live.fixes.last_id, "route_id": route_id}
+
+
+def finish_and_compact(route_id: int):
+    db.finish_route(route_id)
+    if cluster.EXTERNAL_INGEST:
+        # воркеры приёма замечают завершение маршрута, дописывают его и подтверждают
+        cluster.wait_for_workers(route_id)
+    else:
+        # принятые до завершения сообщения помечены маршрутом - дописываем их до сжатия
+        mqtt_server.drain()
+    route_store.compact_route(route_id)
 
 
 @app.post("/api/finish_way")
 async def finish_route():
+    route_id = global_state.get_route_id()
     global_state.set_state(AppStates.WAITING)
-    print("Stoppp route")
-    return {}
+    global_state.set_route_id(None)
+    if route_id is not None:
+        await run_in_threadpool(finish_and_compact, route_id)
+    print("Stoppp route", route_id)
+    return {"route_id": route_id}
+
+
+@app.get("/api/routes")
+async def get_routes():
+    return {"routes": await run_in_threadpool(db.get_routes)}
+
+
+@app.get("/api/routes/{route_id}")
+async def get_route(route_id: int):
+    """Треки маршрута по платам: {"boards": {id: {"t0", "x", "y", "t"}}}."""
+    tracks = await run_in_threadpool(route_store.load_route, route_id)
+    return JSONResponse(content={"route_id": route_id,
+                                 "boards": {b: t.to_dict() for b, t in tracks.items()}})
+
+
+@app.get("/api/routes/{route_id}/simplified")
+async def get_route_simplified(route_id: int, tolerance: Optional[float] = None, points: Optional[int] = None,
+                               board: Optional[str] = None, x0: Optional[float] = None, y0: Optional[float] = None,
+                               x1: Optional[float] = None, y1: Optional[float] = None):
+    """
+    Упрощённые треки маршрута: допуск tolerance (м) или не меньше points
+    вершин на плату; x0, y0, x1, y1 - видимое окно карты.
+    Уровни детализации кэшируются и дописываются новыми точками (см. route_lod).
+    """
+    bbox = (x0, y0, x1, y1) if None not in (x0, y0, x1, y1) else None
+    res = await run_in_threadpool(route_lod.cache.query, route_id, tolerance, points, board, bbox)
+    return JSONResponse(content=res)
 
 @app.post("/api/upload_beacons")
 async def upload_beacons(file: UploadFile = File(...)):
@@ -59,23 +118,159 @@ async def upload_beacons(file: UploadFile = File(...)):
         return JSONResponse(content={"error": "Неверный формат файла"}, status_code=400)
 
     content = await file.read()
-    # сохраняем в beacons.txt
-    data_path.write_bytes(content)
+    # сохраняем в beacons.txt и сразу перезагружаем реестр маяков
+    await run_in_threadpool(registry.write, content)
+    return {"status": "ok", "message": f"Файл {file.filename} успешно загружен"}
+
+
+@app.post("/api/upload_venue")
+async def upload_venue(file: UploadFile = File(...)):
+    """
+    Перезаписывает граф помещения (venue.json) содержимым загруженного файла.
+    """
+    if not file.filename.endswith(".json"):
+        return JSONResponse(content={"error": "Неверный формат файла"}, status_code=400)
+
+    content = await file.read()
+    try:
+        await run_in_threadpool(navigator.write, content)
+    except ValueError as e:
+        return JSONResponse(content={"error": f"Ошибка в графе: {e}"}, status_code=400)
     return {"status": "ok", "message": f"Файл {file.filename} успешно загружен"}
 
 
+@app.get("/api/venue")
+async def get_venue():
+    graph = await run_in_threadpool(navigator.graph)
+    if graph is None:
+        return JSONResponse(content={"error": "Граф помещения не загружен"}, status_code=404)
+    return JSONResponse(content={**graph.to_dict(), "version": graph.version})
+
+
+@app.get("/api/navigate")
+async def navigate(board: str, to: str, x: Optional[float] = None, y: Optional[float] = None,
+                   floor: Optional[int] = None):
+    """
+    Путь платы board до точки интереса или узла to.
+    Позиция - x, y из запроса или последний фикс платы; повторные запросы
+    по мере движения укорачивают уже построенный путь (см. navigation).
+    """
+    graph = await run_in_threadpool(navigator.graph)
+    if graph is None:
+        return JSONResponse(content={"error": "Граф помещения не загружен"}, status_code=404)
+    dest = graph.resolve(to)
+    if dest is None:
+        return JSONResponse(content={"error": f"Неизвестная точка: {to}"}, status_code=404)
+    if x is None or y is None:
+        fix = live.fixes.last_fix(board)
+        if fix is None:
+            return JSONResponse(content={"error": "Нет позиции платы"}, status_code=404)
+        x, y = fix["x"], fix["y"]
+    route = await run_in_threadpool(navigator.route, board, (x, y), floor, dest, graph)
+    if route is None:
+        return JSONResponse(content={"error": "Путь не найден"}, status_code=404)
+    return JSONResponse(content={"board": board, "to": to, **route.to_dict()})
+
+
+@app.get("/api/analytics/heatmap")
+async def get_heatmap_meta():
+    """Сетки тепловой карты по этажам: начало, ячейка, число плиток, часовые корзины, зоны."""
+    snap = await run_in_threadpool(analytics.accumulator.snapshot)
+    return JSONResponse(content=snap.meta())
+
+
+@app.get("/api/analytics/heatmap/{tx}/{ty}")
+async def get_heatmap_tile(tx: int, ty: int, floor: Optional[int] = None, hours: Optional[int] = None):
+    """
+    Плитка тепловой карты этажа floor (по умолчанию нижнего) из последнего
+    снимка: секунды пребывания в ячейках (строки - y снизу вверх),
+    за всё время или за последние hours часов.
+    """
+    snap = await run_in_threadpool(analytics.accumulator.snapshot)
+    fs = snap.floor(floor)
+    tile = fs.tile(tx, ty, hours) if fs is not None else None
+    if tile is None:
+        return JSONResponse(content={"error": "Нет такой плитки"}, status_code=404)
+    ox, oy = fs.grid.origin
+    step, size = fs.grid.step, analytics.TILE_SIZE
+    return JSONResponse(content={"version": snap.version, "floor": fs.grid.floor,
+                                 "origin": [ox + tx * size * step, oy + ty * size * step],
+                                 "cell": step, "max": float(tile.max()) if tile.size else 0.0,
+                                 "cells": tile.round(1).tolist()})
+
+
+@app.get("/api/analytics/dwell")
+async def get_dwell(hours: Optional[int] = None):
+    """Время пребывания и число заходов по зонам (точкам интереса графа) всех этажей."""
+    snap = await run_in_threadpool(analytics.accumulator.snapshot)
+    return JSONResponse(content={"version": snap.version, "taken_at": snap.taken_at, "zones": snap.zone_stats(hours)})
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/check_board")
 async def check_payment():
     return {"res": global_state.is_board_turn_on()}
 
+async def positions_after(after_id: int) -> list[dict]:
+    positions = live.fixes.since(after_id)
+    if positions is None:
+        # курсор старше кольцевого буфера - дочитываем из базы вне цикла событий
+        positions = await run_in_threadpool(route_store.positions_after, after_id, global_state.get_route_id())
+    return positions
+
+
 @app.get("/api/get_positions")
-async def get_positions():
-    pos_objs = db.session.query(db.BoardPosition).all()
-    positions = [i.to_dict() for i in pos_objs]
-    print(f"POSITIONS RETURN = {len(positions)}")
-    res = {"positions" : positions}
+async def get_positions(after_id: int = 0):
+    """
+    Точки маршрута с id > after_id.
+    В ответе cursor - id последней точки, его передают в следующий запрос.
+    """
+    positions = await positions_after(after_id)
+    cursor = positions[-1]["id"] if positions else after_id
+    res = {"positions" : positions, "cursor": cursor}
     return JSONResponse(content=res)
 
+
+# интервал (сек) пустых комментариев, чтобы прокси не закрывали соединение
+STREAM_KEEPALIVE = 15.0
+
+
+@app.get("/api/positions/stream")
+async def stream_positions(after_id: int = 0, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events: каждый новый фикс отправляется сразу после решения.
+    При переподключении EventSource сам передаёт Last-Event-ID.
+    """
+    if last_event_id and last_event_id.isdigit():
+        after_id = max(after_id, int(last_event_id))
+
+    async def events():
+        q = live.fixes.subscribe()
+        try:
+            cursor = after_id
+            for item in await positions_after(cursor):
+                cursor = item["id"]
+                yield f"id: {cursor}\ndata: {json.dumps(item)}\n\n"
+            while True:
+                try:
+                    item = await asyncio.wait_for(q.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if item["id"] <= cursor:
+                    continue
+                cursor = item["id"]
+                yield f"id: {cursor}\ndata: {json.dumps(item)}\n\n"
+        finally:
+            live.fixes.unsubscribe(q)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
 @app.get("/api/get_positions_1")
 async def get_positions_1():
     global positions
@@ -94,29 +289,8 @@ async def get_positions_1():
 async def get_beacons():
     """
     Returns JSON: {"beacons": [{"id":"1","name":"beacon_1","x":3.0,"y":-2.4}, ...]}
-    Robust against header line and malformed rows.
-    """
-    beacons = []
-    if data_path.exists():
-        with open(data_path, "r", encoding="utf-8", newline="") as f:
-            reader = csv.reader(f, delimiter=";")
-            for row in reader:
-                if not row:
-                    continue
-                # skip header
-                first = row[0].strip().lower()
-                if first == "name" or first.startswith("#"):
-                    continue
-                if len(row) < 3:
-                    continue
-                name = row[0].strip()
-                xs = row[1].strip()
-                ys = row[2].strip()
-                try:
-                    x = float(xs); y = float(ys)
-                except Exception:
-                    continue
-                m = re.search(r"(\d+)$", name)
-                id_ = m.group(1) if m else name
-                beacons.append({"id": str(id_), "name": name, "x": x, "y": y})
-    return JSONResponse(content={"beacons": beacons})
\ No newline at end of file
+    Served from the in-memory beacon registry.
+    """
+    # snapshot() может перечитать beacons.txt - вне цикла событий
+    snap = await run_in_threadpool(registry.snapshot)
+    return JSONResponse(content={"beacons": snap.to_list(), "version": snap.version})
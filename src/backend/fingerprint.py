@@ -0,0 +1,262 @@
+"""
+Локализация по сетке отпечатков RSSI.
+
+Для каждого этажа заранее строится регулярная сетка ожидаемых RSSI маяков
+(по модели RSSI0/N из beacons.txt, либо по калибровочным замерам из
+FINGERPRINT_PATH). Маяк хранит RSSI только там, где он среди TOP_BEACONS
+самых сильных (см. FloorGrid); в остальных узлах он считается не сильнее
+слабейшего из них.
+Позиция - взвешенное среднее K_NEAREST узлов, ближайших к измерению
+в пространстве RSSI. Перебираются только узлы окна вокруг предсказанной
+позиции, а без неё - вокруг самого сильного услышанного маяка.
+"""
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import spatial_index
+from beacon_registry import CUR_DIR, BeaconSnapshot
+
+FINGERPRINT_PATH = os.path.join(CUR_DIR, "data", "fingerprint.npz")
+
+# шаг сетки (м) и запас вокруг маяков этажа
+GRID_STEP = 0.5
+GRID_MARGIN = 2.0
+# число ближайших узлов сетки для усреднения
+K_NEAREST = 16
+# сколько самых сильных маяков хранится в узле сетки
+TOP_BEACONS = 8
+# сетка строится плитками TILE x TILE узлов; маяки дальше GRID_RANGE (м) от плитки в ней не учитываются
+TILE = 32
+GRID_RANGE = 40.0
+
+
+@dataclass(frozen=True)
+class FloorGrid:
+    """
+    Ожидаемые RSSI этажа без плотного массива маяки x узлы: маяк хранит
+    плитку patches[r] на прямоугольнике boxes[r] = (y0, y1, x0, x1) - там,
+    где он среди TOP_BEACONS самых сильных. Вне плитки ожидание маяка -
+    weak, слабейший из TOP_BEACONS в узле.
+    """
+    origin: np.ndarray  # (2,) координаты узла [0, 0]
+    step: float
+    beacons: np.ndarray  # (k,) индексы маяков этажа в снимке реестра
+    boxes: np.ndarray  # (k, 4) int
+    patches: list[np.ndarray]  # (y1 - y0, x1 - x0) float32
+    weak: np.ndarray  # (ny, nx) float32
+
+    def window(self, center, radius: float) -> tuple[slice, slice]:
+        """Срез узлов сетки в квадрате вокруг center; пустой, если center вне сетки."""
+        ny, nx = self.weak.shape
+        lo = np.floor((np.asarray(center) - radius - self.origin) / self.step).astype(int)
+        hi = np.ceil((np.asarray(center) + radius - self.origin) / self.step).astype(int) + 1
+        return slice(max(lo[1], 0), min(hi[1], ny)), slice(max(lo[0], 0), min(hi[0], nx))
+
+    def expected(self, rows: np.ndarray, sy: slice, sx: slice) -> np.ndarray:
+        """Ожидаемый RSSI маяков rows (строки beacons) в узлах окна: (len(rows), высота, ширина)."""
+        out = np.empty((len(rows), sy.stop - sy.start, sx.stop - sx.start), dtype=np.float32)
+        out[:] = self.weak[sy, sx]
+        for i, row in enumerate(rows.tolist()):
+            y0, y1, x0, x1 = self.boxes[row].tolist()
+            oy0, oy1 = max(y0, sy.start), min(y1, sy.stop)
+            ox0, ox1 = max(x0, sx.start), min(x1, sx.stop)
+            if oy0 < oy1 and ox0 < ox1:
+                out[i, oy0 - sy.start:oy1 - sy.start, ox0 - sx.start:ox1 - sx.start] = \
+                    self.patches[row][oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0]
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        return self.weak.nbytes + sum(p.nbytes for p in self.patches)
+
+
+@dataclass(frozen=True)
+class Samples:
+    """Калибровочные замеры: позиция, этаж и RSSI по именам маяков (NaN - не слышен)."""
+    names: list[str]
+    xy: np.ndarray  # (S,2)
+    floor: np.ndarray  # (S,)
+    rssi: np.ndarray  # (S,len(names))
+
+
+def expected_rssi(d: np.ndarray, rssi0: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """Лог-дистанционная модель, обратная rssi_to_distance."""
+    return rssi0 - 10.0 * n * np.log10(np.maximum(d, 0.1))
+
+
+def save_samples(samples: Samples, path: str = FINGERPRINT_PATH):
+    np.savez_compressed(path, names=np.array(samples.names), xy=samples.xy,
+                        floor=samples.floor, rssi=samples.rssi)
+
+
+def load_samples(path: str = FINGERPRINT_PATH) -> Optional[Samples]:
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        return Samples([str(s) for s in f["names"]], f["xy"], f["floor"], f["rssi"])
+
+
+def _measured(fl: int, snap: BeaconSnapshot, samples: Samples, beacons: np.ndarray, origin: np.ndarray,
+              step: float, shape: tuple[int, int]) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """Замеры этажа, усреднённые по узлам сетки: строка маяка -> (узлы, RSSI)."""
+    on_floor = samples.floor == fl
+    if not on_floor.any():
+        return {}
+    ny, nx = shape
+    cell = np.rint((samples.xy[on_floor] - origin) / step).astype(int)
+    inside = (cell[:, 0] >= 0) & (cell[:, 0] < nx) & (cell[:, 1] >= 0) & (cell[:, 1] < ny)
+    flat = cell[inside, 1] * nx + cell[inside, 0]
+    values = samples.rssi[on_floor][inside]
+
+    col = {name: j for j, name in enumerate(samples.names)}
+    out = {}
+    for row, b in enumerate(beacons):
+        j = col.get(snap.names[b])
+        if j is None:
+            continue
+        v = values[:, j]
+        heard = ~np.isnan(v)
+        if not heard.any():
+            continue
+        cells, inverse = np.unique(flat[heard], return_inverse=True)
+        out[row] = (cells, np.bincount(inverse, v[heard]) / np.bincount(inverse))
+    return out
+
+
+def _model(snap: BeaconSnapshot, b: np.ndarray, gx: np.ndarray, gy: np.ndarray) -> np.ndarray:
+    """Модельный RSSI маяков b (индексы снимка) в узлах gy x gx: (len(b), len(gy), len(gx))."""
+    d = np.hypot(gx[None, None, :] - snap.xy[b, 0][:, None, None], gy[None, :, None] - snap.xy[b, 1][:, None, None])
+    return expected_rssi(d, snap.rssi0[b][:, None, None], snap.n[b][:, None, None])
+
+
+def _override(rssi: np.ndarray, m: tuple[np.ndarray, np.ndarray], nx: int, y0: int, x0: int):
+    """Замеры одного маяка (узлы, RSSI) поверх модели rssi на прямоугольнике с углом (y0, x0)."""
+    my, mx = np.divmod(m[0], nx)
+    h, w = rssi.shape
+    inside = (my >= y0) & (my < y0 + h) & (mx >= x0) & (mx < x0 + w)
+    rssi[my[inside] - y0, mx[inside] - x0] = m[1][inside]
+
+
+def build_grid(snap: BeaconSnapshot, samples: Optional[Samples] = None,
+               step: float = GRID_STEP) -> dict[int, FloorGrid]:
+    """
+    Сетки этажей. Сначала плитками TILE x TILE (маяки ближе GRID_RANGE
+    к плитке) находятся TOP_BEACONS самых сильных в каждом узле: отсюда
+    weak и прямоугольник каждого маяка. Затем маяку строится плитка RSSI
+    только на его прямоугольнике; замеры заменяют модельные значения.
+    """
+    grids = {}
+    for fl in np.unique(snap.floor).tolist():
+        beacons = np.flatnonzero(snap.floor == fl)
+        bxy = snap.xy[beacons]
+        lo = bxy.min(axis=0) - GRID_MARGIN
+        hi = bxy.max(axis=0) + GRID_MARGIN
+        nx, ny = (np.ceil((hi - lo) / step).astype(int) + 1).tolist()
+        gx = lo[0] + np.arange(nx) * step
+        gy = lo[1] + np.arange(ny) * step
+        measured = _measured(fl, snap, samples, beacons, lo, step, (ny, nx)) if samples is not None else {}
+
+        weak = np.empty((ny, nx), dtype=np.float32)
+        # прямоугольник маяка (y0, y1, x0, x1); пустой, пока маяк нигде не в top
+        boxes = np.tile(np.array([ny, 0, nx, 0]), (len(beacons), 1))
+        for ty in range(0, ny, TILE):
+            for tx in range(0, nx, TILE):
+                ty1, tx1 = min(ty + TILE, ny), min(tx + TILE, nx)
+                # расстояние маяков до прямоугольника плитки
+                dx = np.maximum(np.maximum(gx[tx] - bxy[:, 0], bxy[:, 0] - gx[tx1 - 1]), 0.0)
+                dy = np.maximum(np.maximum(gy[ty] - bxy[:, 1], bxy[:, 1] - gy[ty1 - 1]), 0.0)
+                rows = np.flatnonzero(np.hypot(dx, dy) <= GRID_RANGE)
+                if len(rows) < TOP_BEACONS:
+                    rows = np.arange(len(beacons))
+                rssi = _model(snap, beacons[rows], gx[tx:tx1], gy[ty:ty1])
+                for i, row in enumerate(rows.tolist()):
+                    if row in measured:
+                        _override(rssi[i], measured[row], nx, ty, tx)
+
+                k = min(TOP_BEACONS, len(rows))
+                best = np.argpartition(-rssi, k - 1, axis=0)[:k]
+                weak[ty:ty1, tx:tx1] = np.take_along_axis(rssi, best, axis=0).min(axis=0)
+                in_top = np.zeros(rssi.shape, dtype=bool)
+                np.put_along_axis(in_top, best, True, axis=0)
+                for i in np.flatnonzero(in_top.any(axis=(1, 2))).tolist():
+                    ys = np.flatnonzero(in_top[i].any(axis=1))
+                    xs = np.flatnonzero(in_top[i].any(axis=0))
+                    box = boxes[rows[i]]
+                    box[:] = (min(box[0], ty + ys[0]), max(box[1], ty + ys[-1] + 1),
+                              min(box[2], tx + xs[0]), max(box[3], tx + xs[-1] + 1))
+
+        patches = []
+        for row, (y0, y1, x0, x1) in enumerate(boxes.tolist()):
+            if y0 >= y1:
+                boxes[row] = 0
+                patches.append(np.empty((0, 0), dtype=np.float32))
+                continue
+            patch = _model(snap, beacons[row:row + 1], gx[x0:x1], gy[y0:y1])[0]
+            if row in measured:
+                _override(patch, measured[row], nx, y0, x0)
+            patches.append(patch.astype(np.float32))
+        grids[fl] = FloorGrid(lo, step, beacons, boxes, patches, weak)
+    return grids
+
+
+_cache_lock = threading.Lock()
+_cache: Optional[tuple[int, dict[int, FloorGrid]]] = None
+
+
+def get_grid(snap: BeaconSnapshot) -> dict[int, FloorGrid]:
+    """Сетка строится один раз на версию реестра."""
+    global _cache
+    cached = _cache
+    if cached is not None and cached[0] == snap.version:
+        return cached[1]
+    with _cache_lock:
+        if _cache is None or _cache[0] != snap.version:
+            _cache = (snap.version, build_grid(snap, load_samples()))
+        return _cache[1]
+
+
+def match(snap: BeaconSnapshot, idx: np.ndarray, rssi: np.ndarray,
+          near=None) -> tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    idx - индексы услышанных маяков в снимке, rssi - их измерения.
+    near - предсказанная позиция платы: поиск ограничивается окном
+    spatial_index.SEARCH_RADIUS вокруг неё, без near - таким же окном
+    вокруг самого сильного услышанного маяка.
+    Возвращает позицию (2,) и ковариацию (2x2) или (None, None).
+    """
+    fl = int(snap.floor[idx[np.argmax(rssi)]])
+    grid = get_grid(snap).get(fl)
+    if grid is None:
+        return None, None
+    on_floor = snap.floor[idx] == fl
+    if on_floor.sum() < 3:
+        return None, None
+    rows = np.searchsorted(grid.beacons, idx[on_floor])
+    obs = rssi[on_floor].astype(np.float32)
+
+    sy, sx = slice(0, 0), slice(0, 0)
+    if near is not None:
+        sy, sx = grid.window(near, spatial_index.SEARCH_RADIUS)
+    if sy.start >= sy.stop or sx.start >= sx.stop:
+        # первая позиция платы: окно вокруг самого сильного услышанного маяка, а не вся сетка
+        sy, sx = grid.window(snap.xy[idx[on_floor][np.argmax(obs)]], spatial_index.SEARCH_RADIUS)
+    diff = grid.expected(rows, sy, sx) - obs[:, None, None]
+    cost = np.einsum("ijk,ijk->jk", diff, diff)
+    w_cells = cost.shape[1]
+    cost = cost.ravel()
+
+    k = min(K_NEAREST, cost.size)
+    nn = np.argpartition(cost, k - 1)[:k]
+    iy, ix = np.divmod(nn, w_cells)
+    pts = grid.origin + grid.step * np.stack([ix + sx.start, iy + sy.start], axis=-1)
+
+    w = 1.0 / (np.sqrt(cost[nn]) + 1e-3)
+    w /= w.sum()
+    xy = w @ pts
+    d = pts - xy
+    cov = (d * w[:, None]).T @ d + np.eye(2) * grid.step ** 2
+    return xy, cov
@@ -0,0 +1,348 @@
+"""
+Ограничение позиций планом этажа.
+
+План берётся из ключа "plan" графа помещения (см. navigation):
+
+    "plan": {"step": 0.25,
+             "floors": {"0": {"outline": [[x, y], ...],
+                              "walls": [[[x, y], [x, y], ...], ...],
+                              "wall_width": 0.2}}}
+
+outline - контур здания (проходимо внутри), walls - ломаные стен.
+Этаж растеризуется один раз в сетку проходимости (uint8) и
+преобразование расстояний: для каждой ячейки - ближайшая проходимая
+ячейка (int32) и расстояние до неё (float32, м). Сетки кэшируются в
+FLOOR_MAP_PATH по хешу плана и пересчитываются только при его изменении.
+
+project() переносит точку в стене или снаружи в ближайшую проходимую
+ячейку за O(1); crosses() проверяет, пересекает ли отрезок стену.
+Обе функции работают с массивами точек, поэтому годятся и для пакетного пути.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import metrics
+from beacon_registry import CUR_DIR
+from navigation import VenueGraph, navigator
+
+FLOOR_MAP_PATH = os.path.join(CUR_DIR, "data", "floor_map.npz")
+
+# AKL_MAP_CONSTRAINT=0 - позиции не ограничиваются планом
+ENABLED = os.environ.get("AKL_MAP_CONSTRAINT", "1") == "1"
+
+GRID_STEP = 0.25
+GRID_MARGIN = 1.0
+WALL_WIDTH = 0.2
+# точек проверки на отрезок движения (шаг - ячейка, стены не тоньше 1.5 ячейки)
+MAX_SEGMENT_SAMPLES = 64
+# после стольких отклонённых подряд движений через стену трекер не удерживается:
+# плата действительно оказалась по другую сторону
+MAX_WALL_HOLDS = 5
+
+PROJECTED = metrics.counter("akl_map_projected_total", "Fixes moved out of walls onto the walkable area")
+
+
+@dataclass(frozen=True)
+class FloorMap:
+    origin: np.ndarray  # (2,) центр ячейки [0, 0]
+    step: float
+    walkable: np.ndarray  # (ny, nx) uint8
+    nearest: np.ndarray  # (ny, nx) int32 плоский индекс ближайшей проходимой ячейки, -1 - нет
+    dist: np.ndarray  # (ny, nx) float32 расстояние до неё (м)
+
+    def __post_init__(self):
+        # копия сетки в типах Python для проверок по одной точке
+        ny, nx = self.walkable.shape
+        object.__setattr__(self, "_flat", (float(self.origin[0]), float(self.origin[1]), float(self.step),
+                                           nx, ny, self.walkable.tobytes()))
+
+    def cells(self, xy: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Плоские индексы ячеек точек (..., 2) и признак попадания внутрь сетки."""
+        ny, nx = self.walkable.shape
+        c = np.rint((xy - self.origin) / self.step).astype(np.intp)
+        inside = (c[..., 0] >= 0) & (c[..., 0] < nx) & (c[..., 1] >= 0) & (c[..., 1] < ny)
+        ix = np.clip(c[..., 0], 0, nx - 1)
+        iy = np.clip(c[..., 1], 0, ny - 1)
+        return iy * nx + ix, inside
+
+    def is_walkable(self, xy: np.ndarray) -> np.ndarray:
+        flat, inside = self.cells(xy)
+        return inside & (self.walkable.ravel()[flat] > 0)
+
+    def project(self, xy: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Точки (n,2) в проходимой области; второй результат - какие точки перенесены."""
+        flat, inside = self.cells(xy)
+        moved = ~(inside & (self.walkable.ravel()[flat] > 0))
+        target = self.nearest.ravel()[flat]
+        moved &= target >= 0
+        if not moved.any():
+            return xy, moved
+        nx = self.walkable.shape[1]
+        iy, ix = np.divmod(target[moved], nx)
+        out = np.array(xy, dtype=np.float64)
+        out[moved] = self.origin + self.step * np.stack([ix, iy], axis=-1)
+        return out, moved
+
+    def crosses(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """
+        Пересекают ли отрезки a -> b (n,2) стену или контур.
+        Отрезки, начинающиеся вне проходимой области, не проверяются.
+        """
+        length = np.hypot(*(b - a).T)
+        k = int(np.clip(np.ceil(length.max(initial=0.0) / self.step) + 1, 2, MAX_SEGMENT_SAMPLES))
+        t = np.linspace(0.0, 1.0, k)
+        pts = a[:, None, :] + t[None, :, None] * (b - a)[:, None, :]
+        ok = self.is_walkable(pts)
+        return ok[:, 0] & ~ok.all(axis=1)
+
+    # варианты для одной точки без создания массивов (путь одного сообщения)
+
+    def _walkable_at(self, x: float, y: float) -> bool:
+        ox, oy, step, nx, ny, cells = self._flat
+        ix = round((x - ox) / step)
+        iy = round((y - oy) / step)
+        return 0 <= ix < nx and 0 <= iy < ny and cells[iy * nx + ix] > 0
+
+    def project_point(self, x: float, y: float) -> Optional[tuple[float, float]]:
+        """Ближайшая проходимая точка или None, если (x, y) уже проходима."""
+        if self._walkable_at(x, y):
+            return None
+        ny, nx = self.walkable.shape
+        ix = min(max(round((x - self.origin[0]) / self.step), 0), nx - 1)
+        iy = min(max(round((y - self.origin[1]) / self.step), 0), ny - 1)
+        target = int(self.nearest[iy, ix])
+        if target < 0:
+            return None
+        ty, tx = divmod(target, nx)
+        return float(self.origin[0] + tx * self.step), float(self.origin[1] + ty * self.step)
+
+    def crosses_segment(self, a, b) -> bool:
+        ox, oy, step, nx, ny, cells = self._flat
+        # индексы ячеек в непрерывных координатах, шаг проверки - одна ячейка
+        ax, ay = (a[0] - ox) / step, (a[1] - oy) / step
+        dx, dy = (b[0] - a[0]) / step, (b[1] - a[1]) / step
+        ix, iy = round(ax), round(ay)
+        if not (0 <= ix < nx and 0 <= iy < ny and cells[iy * nx + ix]):
+            return False
+        k = min(max(math.ceil(math.hypot(dx, dy)), 1), MAX_SEGMENT_SAMPLES - 1)
+        for i in range(1, k + 1):
+            ix, iy = round(ax + dx * i / k), round(ay + dy * i / k)
+            if not (0 <= ix < nx and 0 <= iy < ny and cells[iy * nx + ix]):
+                return True
+        return False
+
+
+def _shift(a: np.ndarray, dy: int, dx: int, fill) -> np.ndarray:
+    """out[y, x] = a[y + dy, x + dx], за границей - fill."""
+    out = np.full_like(a, fill)
+    ny, nx = a.shape
+    if abs(dy) >= ny or abs(dx) >= nx:
+        return out
+    out[max(-dy, 0):ny - max(dy, 0), max(-dx, 0):nx - max(dx, 0)] = \
+        a[max(dy, 0):ny - max(-dy, 0), max(dx, 0):nx - max(-dx, 0)]
+    return out
+
+
+def nearest_walkable(walkable: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Ближайшая проходимая ячейка для каждой ячейки (jump flooding, проходы
+    с шагом n/2, n/4, ..., 1 и ещё один с шагом 1) и расстояние до неё в ячейках.
+    """
+    ny, nx = walkable.shape
+    iy, ix = np.indices((ny, nx))
+    sy = np.where(walkable > 0, iy, -1)
+    sx = np.where(walkable > 0, ix, -1)
+    best = np.where(walkable > 0, 0, np.iinfo(np.int64).max).astype(np.int64)
+    k = 1 << max(int(max(ny, nx) - 1).bit_length() - 1, 0)
+    steps = []
+    while k >= 1:
+        steps.append(k)
+        k //= 2
+    for k in steps + [1]:
+        for dy in (-k, 0, k):
+            for dx in (-k, 0, k):
+                if dy == 0 and dx == 0:
+                    continue
+                cy = _shift(sy, dy, dx, -1)
+                cx = _shift(sx, dy, dx, -1)
+                d = (cy - iy) ** 2 + (cx - ix) ** 2
+                better = (cy >= 0) & (d < best)
+                sy = np.where(better, cy, sy)
+                sx = np.where(better, cx, sx)
+                best = np.where(better, d, best)
+    nearest = np.where(sy >= 0, sy * nx + sx, -1).astype(np.int32)
+    dist = np.where(sy >= 0, np.sqrt(best.astype(np.float64)), np.inf).astype(np.float32)
+    return nearest, dist
+
+
+def _inside_polygon(px: np.ndarray, py: np.ndarray, poly: np.ndarray) -> np.ndarray:
+    """Чёт-нечёт по лучу; цикл по рёбрам, каждое - по всей сетке сразу."""
+    inside = np.zeros(px.shape, dtype=bool)
+    x1, y1 = poly[-1]
+    for x2, y2 in poly:
+        if y1 != y2:
+            cond = (y1 > py) != (y2 > py)
+            xs = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= cond & (px < xs)
+        x1, y1 = x2, y2
+    return inside
+
+
+def _near_segment(px: np.ndarray, py: np.ndarray, a: np.ndarray, b: np.ndarray, r: float) -> np.ndarray:
+    d = b - a
+    l2 = float(d @ d)
+    t = np.zeros(px.shape) if l2 == 0 else np.clip(((px - a[0]) * d[0] + (py - a[1]) * d[1]) / l2, 0.0, 1.0)
+    return (px - a[0] - t * d[0]) ** 2 + (py - a[1] - t * d[1]) ** 2 <= r * r
+
+
+def rasterize(floor_plan: dict, step: float = GRID_STEP) -> Optional[FloorMap]:
+    outline = np.asarray(floor_plan.get("outline") or [], dtype=np.float64).reshape(-1, 2)
+    walls = [np.asarray(w, dtype=np.float64).reshape(-1, 2) for w in floor_plan.get("walls") or []]
+    points = [p for p in [outline] + walls if len(p)]
+    if not points:
+        return None
+    pts = np.concatenate(points)
+    lo = pts.min(axis=0) - GRID_MARGIN
+    hi = pts.max(axis=0) + GRID_MARGIN
+    nx, ny = (np.ceil((hi - lo) / step).astype(int) + 1).tolist()
+    py, px = np.indices((ny, nx), dtype=np.float64)
+    px = lo[0] + px * step
+    py = lo[1] + py * step
+
+    walkable = _inside_polygon(px, py, outline) if len(outline) >= 3 else np.ones((ny, nx), dtype=bool)
+    # стена не тоньше ячейки по диагонали, иначе отрезок проскакивает между ячейками
+    r = max(float(floor_plan.get("wall_width", WALL_WIDTH)) / 2, step * 0.75)
+    for wall in walls:
+        for a, b in zip(wall, wall[1:]):
+            walkable &= ~_near_segment(px, py, a, b, r)
+    walkable = walkable.astype(np.uint8)
+    nearest, dist = nearest_walkable(walkable)
+    return FloorMap(lo, step, walkable, nearest, dist * np.float32(step))
+
+
+def plan_key(plan: dict) -> str:
+    # параметры растеризации входят в ключ: их изменение тоже сбрасывает кэш
+    params = [plan, GRID_STEP, GRID_MARGIN, WALL_WIDTH]
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def build_maps(plan: dict) -> dict[int, FloorMap]:
+    step = float(plan.get("step", GRID_STEP))
+    maps = {}
+    for fl, floor_plan in (plan.get("floors") or {}).items():
+        m = rasterize(floor_plan, step)
+        if m is not None:
+            maps[int(fl)] = m
+    return maps
+
+
+def save_maps(maps: dict[int, FloorMap], key: str, path: str = FLOOR_MAP_PATH):
+    arrays = {"key": np.array(key)}
+    for fl, m in maps.items():
+        arrays[f"{fl}_origin"] = m.origin
+        arrays[f"{fl}_step"] = np.array(m.step)
+        arrays[f"{fl}_walkable"] = m.walkable
+        arrays[f"{fl}_nearest"] = m.nearest
+        arrays[f"{fl}_dist"] = m.dist
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def load_maps(key: str, path: str = FLOOR_MAP_PATH) -> Optional[dict[int, FloorMap]]:
+    """Сетки из кэша на диске; None, если кэша нет или он построен для другого плана."""
+    try:
+        with np.load(path) as f:
+            if str(f["key"]) != key:
+                return None
+            floors = {name.split("_", 1)[0] for name in f.files if name != "key"}
+            return {int(fl): FloorMap(f[f"{fl}_origin"], float(f[f"{fl}_step"]), f[f"{fl}_walkable"],
+                                      f[f"{fl}_nearest"], f[f"{fl}_dist"]) for fl in floors}
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+
+class FloorMaps():
+    """Сетки этажей; точки этажей без плана не меняются."""
+
+    def __init__(self, maps: dict[int, FloorMap]):
+        self.maps = maps
+
+    def __bool__(self) -> bool:
+        return bool(self.maps)
+
+    def project(self, floor: np.ndarray, xy: np.ndarray) -> np.ndarray:
+        """floor (n,), xy (n,2) -> xy в проходимой области."""
+        xy = np.asarray(xy, dtype=np.float64)
+        out = xy
+        for fl, m in self.maps.items():
+            sel = floor == fl
+            if not sel.any():
+                continue
+            res, moved = m.project(xy[sel])
+            if moved.any():
+                if out is xy:
+                    out = xy.copy()
+                out[sel] = res
+                PROJECTED.inc(int(moved.sum()))
+        return out
+
+    def crosses(self, floor: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """floor (n,), отрезки a -> b (n,2) -> пересекает ли отрезок стену."""
+        a = np.asarray(a, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        out = np.zeros(len(a), dtype=bool)
+        for fl, m in self.maps.items():
+            sel = floor == fl
+            if sel.any():
+                out[sel] = m.crosses(a[sel], b[sel])
+        return out
+
+    def project_point(self, floor: int, xy) -> tuple[float, float]:
+        m = self.maps.get(floor)
+        res = m.project_point(xy[0], xy[1]) if m is not None else None
+        if res is None:
+            return xy[0], xy[1]
+        PROJECTED.inc()
+        return res
+
+    def crosses_segment(self, floor: int, a, b) -> bool:
+        m = self.maps.get(floor)
+        return m is not None and m.crosses_segment(a, b)
+
+
+_cache_lock = threading.Lock()
+_cache: Optional[tuple[int, FloorMaps]] = None
+
+
+def get_maps(graph: Optional[VenueGraph] = None) -> FloorMaps:
+    """Сетки плана текущего графа помещения; строятся один раз на версию графа."""
+    global _cache
+    if graph is None:
+        graph = navigator.graph()
+    version = graph.version if graph is not None else 0
+    cached = _cache
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _cache_lock:
+        if _cache is None or _cache[0] != version:
+            plan = graph.plan if graph is not None else {}
+            maps = {}
+            if plan:
+                key = plan_key(plan)
+                maps = load_maps(key)
+                if maps is None:
+                    maps = build_maps(plan)
+                    try:
+                        save_maps(maps, key)
+                    except OSError as e:
+                        print("Не удалось сохранить сетку плана:", e)
+            _cache = (version, FloorMaps(maps))
+        return _cache[1]
@@ -0,0 +1,296 @@
+import queue
+import threading
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+# политика при переполнении очереди
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+INGEST_WORKERS = 2
+INGEST_QUEUE_SIZE = 10000
+WRITER_QUEUE_SIZE = 10000
+BACKPRESSURE = DROP_OLDEST
+# сколько (сек) ждать места в очереди при политике BLOCK, потом сообщение теряется
+BLOCK_TIMEOUT = 1.0
+# сколько сообщений воркер забирает из очереди за раз (см. IngestPipeline.prepare)
+SOLVE_BATCH = 64
+
+
+@dataclass
+class RawMessage:
+    topic: str
+    payload: bytes
+    received_ts: float
+    # маршрут на момент приёма: фикс попадает в него, даже если маршрут уже завершён
+    route_id: Optional[int] = None
+    # результат разбора из prepare, чтобы solve не разбирал сообщение повторно
+    decoded: Any = None
+
+
+@dataclass
+class Fix:
+    board_id: str
+    ts: float
+    x: float
+    y: float
+    route_id: Optional[int] = None
+    floor: Optional[int] = None
+
+
+class Counter():
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self._value += n
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class BoundedQueue():
+    """
+    Очередь с политикой переполнения:
+    DROP_OLDEST - выбросить самый старый элемент, BLOCK - ждать место.
+    Служебные элементы (put_wait: остановка, метки sync) не выбрасываются.
+    """
+
+    def __init__(self, maxsize: int, policy: str = BACKPRESSURE, block_timeout: float = BLOCK_TIMEOUT):
+        if policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"Неизвестная политика: {policy}")
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.maxsize = maxsize
+        # (элемент, служебный)
+        self._items: deque[tuple[Any, bool]] = deque()
+        self._unfinished = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self.dropped = Counter()
+
+    def _push(self, item, keep: bool = False):
+        self._items.append((item, keep))
+        self._unfinished += 1
+        self._not_empty.notify()
+
+    def _drop_oldest(self) -> bool:
+        for i, (_, keep) in enumerate(self._items):
+            if not keep:
+                del self._items[i]
+                self._unfinished -= 1
+                self.dropped.inc()
+                if self._unfinished <= 0:
+                    self._all_done.notify_all()
+                return True
+        return False
+
+    def put(self, item):
+        with self._lock:
+            if self.policy == BLOCK:
+                if not self._not_full.wait_for(lambda: len(self._items) < self.maxsize, self.block_timeout):
+                    self.dropped.inc()
+                    return
+            else:
+                while len(self._items) >= self.maxsize and self._drop_oldest():
+                    pass
+            self._push(item)
+
+    def put_wait(self, item):
+        """Служебный элемент: встаёт в конец без ожидания места и не выбрасывается."""
+        with self._lock:
+            self._push(item, keep=True)
+
+    def get(self, timeout: Optional[float] = None):
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._items, timeout):
+                raise queue.Empty
+            item, _ = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def task_done(self):
+        with self._lock:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._all_done.notify_all()
+
+    def join(self):
+        with self._lock:
+            self._all_done.wait_for(lambda: self._unfinished <= 0)
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+
+_STOP = object()
+
+
+class _Sync():
+    """Метка в очередях конвейера: проходит воркеры и писатель вслед за уже принятыми сообщениями."""
+
+    def __init__(self, parts: int):
+        self._left = parts
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+
+    def arrive(self):
+        with self._lock:
+            self._left -= 1
+            if self._left == 0:
+                self.done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+
+class IngestPipeline():
+    """
+    Конвейер приёма: callback MQTT -> очереди решателей -> писатель.
+
+    submit() только кладёт сырое сообщение в очередь и сразу возвращается.
+    Сообщения шардируются по ключу (id платы), чтобы фиксы одной платы
+    обрабатывались по порядку одним воркером.
+    solve(RawMessage) -> Optional[Fix] выполняется в пуле воркеров,
+    store(Fix) - в отдельном потоке писателя.
+    Воркер забирает до batch сообщений сразу; prepare(list[RawMessage])
+    вызывается на всю пачку перед решением (общий шаг предсказания).
+    """
+
+    def __init__(self, solve: Callable[[RawMessage], Optional[Fix]], store: Callable[[Fix], None],
+                 workers: int = INGEST_WORKERS, queue_size: int = INGEST_QUEUE_SIZE,
+                 writer_queue_size: int = WRITER_QUEUE_SIZE, policy: str = BACKPRESSURE,
+                 prepare: Optional[Callable[[list[RawMessage]], None]] = None, batch: int = SOLVE_BATCH):
+        self.solve = solve
+        self.store = store
+        self.prepare = prepare
+        self.batch = batch
+        self.queues = [BoundedQueue(queue_size, policy) for _ in range(workers)]
+        self.writer_queue = BoundedQueue(writer_queue_size, policy)
+        self.received = Counter()
+        self.solved = Counter()
+        self.written = Counter()
+        self.failed = Counter()
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        if self._threads:
+            return
+        for i, q in enumerate(self.queues):
+            t = threading.Thread(target=self._work, args=(q,), name=f"ingest-worker-{i}", daemon=True)
+            self._threads.append(t)
+        self._threads.append(threading.Thread(target=self._write, name="ingest-writer", daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Дожидается обработки уже принятых сообщений и останавливает потоки."""
+        if not self._threads:
+            return
+        for q in self.queues:
+            q.put_wait(_STOP)
+        for t in self._threads[:-1]:
+            t.join(timeout)
+        self.writer_queue.put_wait(_STOP)
+        self._threads[-1].join(timeout)
+        self._threads = []
+
+    def submit(self, msg: RawMessage, key: str = ""):
+        self.received.inc()
+        q = self.queues[zlib.crc32(key.encode()) % len(self.queues)]
+        q.put(msg)
+
+    def _take(self, q: BoundedQueue) -> list:
+        """Первый элемент с ожиданием и сколько ещё есть в очереди, до batch."""
+        items = [q.get()]
+        while len(items) < self.batch and items[-1] is not _STOP:
+            try:
+                items.append(q.get(timeout=0))
+            except queue.Empty:
+                break
+        return items
+
+    def _work(self, q: BoundedQueue):
+        while True:
+            items = self._take(q)
+            if self.prepare is not None:
+                try:
+                    self.prepare([m for m in items if isinstance(m, RawMessage)])
+                except Exception as e:
+                    print("Ошибка подготовки пачки:", e)
+            for msg in items:
+                try:
+                    if msg is _STOP:
+                        return
+                    if isinstance(msg, _Sync):
+                        self.writer_queue.put_wait(msg)
+                        continue
+                    fix = self.solve(msg)
+                    if fix is not None:
+                        self.solved.inc()
+                        self.writer_queue.put(fix)
+                except Exception as e:
+                    self.failed.inc()
+                    print("Ошибка обработки:", e)
+                finally:
+                    q.task_done()
+
+    def _write(self):
+        q = self.writer_queue
+        while True:
+            fix = q.get()
+            try:
+                if fix is _STOP:
+                    return
+                if isinstance(fix, _Sync):
+                    fix.arrive()
+                    continue
+                self.store(fix)
+                self.written.inc()
+            except Exception as e:
+                self.failed.inc()
+                print("Ошибка записи:", e)
+            finally:
+                q.task_done()
+
+    def mark(self) -> _Sync:
+        """
+        Ставит метку за всеми уже принятыми сообщениями; метка готова (wait),
+        когда они записаны (store). Новые сообщения ей не мешают.
+        """
+        marker = _Sync(len(self.queues))
+        if not self._threads:
+            marker.done.set()
+            return marker
+        for q in self.queues:
+            q.put_wait(marker)
+        return marker
+
+    def sync(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт записи всех сообщений, принятых до вызова (см. mark)."""
+        return self.mark().wait(timeout)
+
+    def join(self):
+        """Ждёт, пока все очереди опустеют."""
+        for q in self.queues:
+            q.join()
+        self.writer_queue.join()
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received.value,
+            "solved": self.solved.value,
+            "written": self.written.value,
+            "failed": self.failed.value,
+            "queue_depth": sum(q.qsize() for q in self.queues),
+            "writer_queue_depth": self.writer_queue.qsize(),
+            "dropped": sum(q.dropped.value for q in self.queues),
+            "writer_dropped": self.writer_queue.dropped.value,
+        }
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from bisect import bisect_right
+from collections import deque
+from itertools import islice
+from typing import Optional
+
+# сколько последних фиксов держать в памяти
+BUFFER_SIZE = 20000
+# очередь одного подписчика; медленный клиент теряет самые новые точки
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+class FixBuffer():
+    """
+    Кольцевой буфер последних фиксов.
+    Каждый фикс получает возрастающий id (он же первичный ключ BoardPosition),
+    по которому клиенты запрашивают только новые точки.
+    Подписчики (asyncio.Queue) получают фиксы сразу после решения.
+    """
+
+    def __init__(self, maxlen: int = BUFFER_SIZE):
+        self._items: deque[dict] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._next_id = 1
+        # id, начиная с которого буфер полон (всё более раннее удалено)
+        self._start_id = 1
+        self._subscribers: dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+        # последний фикс каждой платы; не сбрасывается вместе с маршрутом
+        self._last: dict[str, dict] = {}
+
+    @property
+    def last_id(self) -> int:
+        return self._next_id - 1
+
+    def reset_ids(self, next_id: int):
+        with self._lock:
+            self._items.clear()
+            self._next_id = next_id
+            self._start_id = next_id
+
+    def clear(self):
+        self.reset_ids(self._next_id)
+
+    def append(self, board_id: str, ts: float, x: float, y: float) -> int:
+        with self._lock:
+            fix_id = self._next_id
+            item = {"id": fix_id, "board": board_id, "ts": ts, "x": x, "y": y}
+            self._push(item)
+            subscribers = list(self._subscribers.items())
+        self._notify(subscribers, (item,))
+        return fix_id
+
+    def extend(self, items: list[dict]):
+        """
+        Фиксы с уже выданными id (строки из базы, см. cluster.tail_positions).
+        id должны возрастать; пропуски допустимы.
+        """
+        if not items:
+            return
+        with self._lock:
+            for item in items:
+                self._push(item)
+            subscribers = list(self._subscribers.items())
+        self._notify(subscribers, items)
+
+    def _push(self, item: dict):
+        if len(self._items) == self._items.maxlen:
+            self._start_id = self._items[0]["id"] + 1
+        self._items.append(item)
+        self._next_id = item["id"] + 1
+        self._last[item["board"]] = item
+
+    def _notify(self, subscribers, items):
+        for q, loop in subscribers:
+            try:
+                for item in items:
+                    loop.call_soon_threadsafe(_offer, q, item)
+            except RuntimeError:
+                # цикл событий клиента уже закрыт
+                self.unsubscribe(q)
+
+    def since(self, after_id: int) -> Optional[list[dict]]:
+        """
+        Фиксы с id > after_id. None, если часть из них уже вытеснена
+        из буфера и нужно читать из базы.
+        """
+        with self._lock:
+            if after_id + 1 < self._start_id:
+                return None
+            if not self._items or after_id >= self._items[-1]["id"]:
+                return []
+            start = bisect_right(self._items, after_id, key=_item_id)
+            return list(islice(self._items, start, None))
+
+    def last_fix(self, board_id: str) -> Optional[dict]:
+        return self._last.get(board_id)
+
+    def subscribe(self) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[q] = asyncio.get_running_loop()
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(q, None)
+
+
+def _item_id(item: dict) -> int:
+    return item["id"]
+
+
+def _offer(q: asyncio.Queue, item: dict):
+    try:
+        q.put_nowait(item)
+    except asyncio.QueueFull:
+        pass
+
+
+fixes = FixBuffer()
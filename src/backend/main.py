@@ -1,7 +1,14 @@
 from threading import Thread
 
+import analytics
 from fastapi_app.app import app
+import cluster
 import mqtt_server
 
-mqtt_thread = Thread(target=mqtt_server.mqtt_run, daemon=True)
-mqtt_thread.start()
+if cluster.EXTERNAL_INGEST:
+    # MQTT обслуживают процессы python -m cluster, здесь только чтение базы
+    ingest_thread = Thread(target=cluster.tail_positions, daemon=True)
+else:
+    ingest_thread = Thread(target=mqtt_server.mqtt_run, daemon=True)
+ingest_thread.start()
+analytics.accumulator.start()
@@ -0,0 +1,149 @@
+"""
+Лёгкие метрики горячего пути в формате Prometheus.
+
+AKL_METRICS=0 в окружении отключает сбор: counter()/histogram()
+возвращают заглушки, а timer() - общий пустой контекстный менеджер.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable
+
+ENABLED = os.environ.get("AKL_METRICS", "1") != "0"
+
+# границы (сек) для гистограмм времени: от 5 мкс до 1 с
+TIME_BUCKETS = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1, 0.25, 1.0)
+
+
+class Counter():
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self.value += n
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+class Gauge():
+    """Значение читается функцией в момент выдачи /metrics."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.fn()}"]
+
+
+class Histogram():
+    def __init__(self, name: str, help: str, buckets: tuple = TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        acc = 0
+        for bound, c in zip(self.buckets, counts):
+            acc += c
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {acc}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class _Timer():
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist: Histogram):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0)
+        return False
+
+
+class _Noop():
+    """Заглушка для отключённых метрик: все методы ничего не делают."""
+    value = 0
+    count = 0
+
+    def inc(self, n: int = 1):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+    def render(self) -> list[str]:
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+_metrics: dict[str, object] = {}
+_lock = threading.Lock()
+
+
+def _register(metric):
+    with _lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name: str, help: str) -> Counter:
+    return _register(Counter(name, help)) if ENABLED else _NOOP
+
+
+def histogram(name: str, help: str, buckets: tuple = TIME_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, buckets)) if ENABLED else _NOOP
+
+
+def gauge(name: str, help: str, fn: Callable[[], float]) -> Gauge:
+    return _register(Gauge(name, help, fn)) if ENABLED else _NOOP
+
+
+def timer(hist: Histogram):
+    """with timer(h): ... - записывает длительность блока в гистограмму."""
+    if hist is _NOOP:
+        return _NOOP
+    return _Timer(hist)
+
+
+def render() -> str:
+    with _lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
@@ -1,93 +1,246 @@
+import atexit
 import json
+import numpy as np
 import paho.mqtt.client as mqtt
-from typing import Any
-from datetime import datetime, timedelta
-import math
-
+from typing import Any, Optional
+from datetime import datetime
+import time
+
+import analytics
+import calibration
+import ingest
+import live
+import metrics
 import rssi_position
+import trackers
+import wire
 from app_state import GlobalState, AppStates
+from beacon_registry import BeaconSnapshot, registry
 from data import db
-
-large = timedelta(days=1)
-
-
-class LastPoints():
-    def __init__(self):
-        self.last_saved = None
-
-    def get_last_saved_delta(self):
-        if self.last_saved == None:
-            return large
-        return datetime.now() - self.last_saved
-
-    def get_last_point():
-        db_pos = db.get_last_pos()
-        pos = rssi_position.Position(db_pos.x, db_pos.y)
-        return pos
-
+from data.writer import writer as position_writer
 
 BROKER = "localhost"
 PORT = 1883
-TOPIC = "test/beacons"
+TOPIC = wire.TOPIC
+# платы публикуют в test/beacons/s<корзина>/<board_id> (см. wire.board_topic);
+# старые прошивки - в test/beacons/<board_id>, совсем старые - в test/beacons без id
+BOARD_TOPIC = TOPIC + "/+"
+SHARD_TOPIC = TOPIC + "/s{}/+"
+
+# многопроцессный приём (см. cluster): доля плат этого процесса (номер, число воркеров);
+# воркер подписывается только на корзины wire.SHARD_BUCKETS с номером i, i + N, ...
+SHARD: Optional[tuple[int, int]] = None
+# группа общей подписки $share/<группа>/...; None - обычная подписка
+SHARE_GROUP: Optional[str] = None
+# True - id фиксов выдаёт живой буфер этого процесса, False - автоинкремент базы
+LOCAL_IDS = True
 
 global_state = GlobalState()
-last_points = LastPoints()
+
+MESSAGES_RECEIVED = metrics.counter("akl_messages_received_total", "MQTT messages received")
+MESSAGES_WAITING = metrics.counter("akl_messages_waiting_dropped_total", "Messages ignored while no route is recorded")
+MESSAGES_FEW_BEACONS = metrics.counter("akl_messages_few_beacons_total", "Messages with fewer than 3 beacons")
+MESSAGES_PARSE_FAILED = metrics.counter("akl_messages_parse_failed_total", "Messages that failed to decode")
+MESSAGES_NO_FIX = metrics.counter("akl_messages_no_fix_total", "Messages solved without a position estimate for the board")
+DECODE_TIME = metrics.histogram("akl_json_decode_seconds", "Payload decode duration (JSON or binary)")
+
+
+def topic_filters() -> list[str]:
+    """
+    Подписки процесса. Воркер с SHARD получает от брокера только свои
+    корзины, поэтому одна плата всегда у одного воркера, а трафик не
+    умножается на число воркеров; топики без корзины - у воркера 0.
+    """
+    legacy = [TOPIC, BOARD_TOPIC]
+    if SHARD is None:
+        topics = legacy + [SHARD_TOPIC.format("+")]
+        if SHARE_GROUP:
+            topics = [f"$share/{SHARE_GROUP}/{t}" for t in topics]
+        return topics
+    index, count = SHARD
+    topics = [SHARD_TOPIC.format(k) for k in range(index, wire.SHARD_BUCKETS, count)]
+    return legacy + topics if index == 0 else topics
 
 
 def on_connect(client: mqtt.Client, userdata: Any, flags: dict, rc: int) -> None:
     print("Подключено к брокеру с кодом:", rc)
-    client.subscribe(TOPIC)
+    client.subscribe([(t, 0) for t in topic_filters()])
 
 
-def json_data_to_station_rssi(data) -> list[rssi_position.StationRssi]:
-    res = []
-    for i in data:
-        try:
-            station_rssi = rssi_position.StationRssi(i["name"], i["rssi"])
-            res.append(station_rssi)
-        except:
-            pass
-    return res
+def owns_topic(topic: str) -> bool:
+    """Доставит ли брокер топик этому процессу по подпискам topic_filters()."""
+    if SHARD is None:
+        return True
+    index, count = SHARD
+    bucket = wire.topic_bucket(topic)
+    return index == 0 if bucket is None else bucket % count == index
+
+
+def board_id_from_topic(topic: str) -> str:
+    prefix = TOPIC + "/"
+    if topic.startswith(prefix) and len(topic) > len(prefix):
+        # test/beacons/s<корзина>/<id> или test/beacons/<id>
+        return topic.rsplit("/", 1)[1]
+    return trackers.DEFAULT_BOARD_ID
+
+
+def parse_payload(data, board_id: str, ts: float) -> tuple[str, float, list]:
+    """
+    Список [{"name":..., "rssi":...}] или
+    {"board": id, "ts": unix_sec, "beacons": [...]} -
+    id и время из сообщения важнее топика и времени приёма.
+    """
+    if isinstance(data, dict):
+        board_id = str(data.get("board", board_id))
+        ts = float(data.get("ts", ts))
+        data = data.get("beacons", [])
+    return board_id, ts, data
+
+
+def json_beacons(data) -> tuple[list[str], list[float]]:
+    """[{"name":..., "rssi":...}] -> имена и RSSI; записи без нужных полей пропускаются."""
+    names, values = [], []
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        name, rssi = item.get("name"), item.get("rssi")
+        if isinstance(name, str) and isinstance(rssi, (int, float)):
+            names.append(name)
+            values.append(rssi)
+    return names, values
+
+
+def decode_message(msg: ingest.RawMessage) -> tuple[str, float, np.ndarray, np.ndarray, BeaconSnapshot]:
+    """
+    Сообщение платы -> (board_id, ts, индексы маяков в снимке реестра, rssi, снимок).
+    Двоичный формат (wire) разбирается np.frombuffer, JSON - для старых прошивок.
+    Неизвестные маяки отбрасываются.
+    """
+    snap = registry.snapshot()
+    if wire.is_binary(msg.payload):
+        packet = wire.decode(msg.payload)
+        board_id, ts = packet.board_id, packet.ts or msg.received_ts
+        idx = wire.lookup(snap, packet.beacons)
+        rssi = packet.rssi
+    else:
+        data = json.loads(msg.payload)
+        board_id, ts, data = parse_payload(data, board_id_from_topic(msg.topic), msg.received_ts)
+        names, values = json_beacons(data)
+        idx = snap.lookup(names)
+        rssi = np.array(values, dtype=np.float64)
+    known = idx >= 0
+    return board_id, ts, idx[known], rssi[known].astype(np.float64), snap
 
 
 def print_station(station: rssi_position.StationRssi):
     print(f"{station.name} = {station.rssi}")
 
 
-def is_valid_pos(pos: rssi_position.Position):
-    m_in_sec = 43
-    last = last_points.get_last_point()
-    if not last:
-        return True
-    last_time = last_points.get_last_saved_delta()
-    dist = math.sqrt((pos.x - last.x) ** 2 + (pos.y - last.y) ** 2)
+def prepare_batch(msgs: list[ingest.RawMessage]) -> None:
+    """
+    Пачка сообщений воркера: разбор, затем один шаг предсказания трекеров
+    на все платы пачки, каждая к времени своего первого сообщения.
+    """
+    first: dict[str, float] = {}
+    for msg in msgs:
+        try:
+            with metrics.timer(DECODE_TIME):
+                msg.decoded = decode_message(msg)
+        except Exception:
+            # ошибку посчитает solve_message при повторном разборе
+            continue
+        board_id, ts, idx = msg.decoded[:3]
+        if len(idx) >= 3:
+            first.setdefault(board_id, ts)
+    rssi_position.predict_ahead(list(first), list(first.values()))
+
+
+def solve_message(msg: ingest.RawMessage) -> Optional[ingest.Fix]:
+    try:
+        if msg.decoded is not None:
+            board_id, ts, idx, rssi, snap = msg.decoded
+        else:
+            with metrics.timer(DECODE_TIME):
+                board_id, ts, idx, rssi, snap = decode_message(msg)
+    except Exception as e:
+        MESSAGES_PARSE_FAILED.inc()
+        print("Ошибка обработки:", e)
+        return None
 
-    time_delta = (datetime.now() - last_time).total_seconds()
-    max_dist = m_in_sec * time_delta
+    if len(idx) < 3:
+        MESSAGES_FEW_BEACONS.inc()
+        return None
+    xy = rssi_position.locate_heard(idx, rssi, snap, board_id, ts)
+    if xy is None:
+        # у платы ещё нет оценки (фильтр частиц не инициализирован)
+        MESSAGES_NO_FIX.inc()
+        return None
+    return ingest.Fix(board_id, ts, xy[0], xy[1], msg.route_id, rssi_position.heard_floor(idx, rssi, snap))
 
-    return dist <= max_dist
+
+def store_fix(fix: ingest.Fix) -> None:
+    row = {"route_id": fix.route_id, "board_id": fix.board_id, "floor": fix.floor,
+           "x": fix.x, "y": fix.y, "time": datetime.fromtimestamp(fix.ts)}
+    if LOCAL_IDS:
+        # id выдаёт буфер живых фиксов, чтобы курсор клиента совпадал с ключом в базе
+        row["id"] = live.fixes.append(fix.board_id, fix.ts, fix.x, fix.y)
+    position_writer.add(row)
+    analytics.accumulator.add(fix.board_id, fix.ts, fix.x, fix.y, fix.floor)
+
+
+pipeline = ingest.IngestPipeline(solve_message, store_fix, prepare=prepare_batch)
+
+metrics.gauge("akl_ingest_queue_depth", "Messages waiting for a solver", lambda: pipeline.stats()["queue_depth"])
+metrics.gauge("akl_ingest_writer_queue_depth", "Fixes waiting for the writer",
+              lambda: pipeline.stats()["writer_queue_depth"])
+metrics.gauge("akl_ingest_dropped", "Messages dropped by backpressure",
+              lambda: pipeline.stats()["dropped"] + pipeline.stats()["writer_dropped"])
+metrics.gauge("akl_ingest_failed", "Messages failed in the pipeline", lambda: pipeline.stats()["failed"])
+
+
+def shutdown() -> None:
+    pipeline.stop(timeout=5.0)
+    position_writer.close()
+    calibration.calibrator.stop(timeout=5.0)
+    analytics.accumulator.stop(timeout=5.0)
+
+
+atexit.register(shutdown)
+
+
+def drain() -> None:
+    """
+    Дожидается решения и записи в базу всех сообщений, принятых до вызова
+    (завершение маршрута); новые сообщения могут продолжать поступать.
+    """
+    pipeline.sync()
+    position_writer.flush()
 
 
 def on_board_message(client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> None:
+    # в потоке paho только ставим сообщение в очередь, решение и запись - в конвейере
+    received_ts = time.time()
+    MESSAGES_RECEIVED.inc()
     global_state.save_last_updated()
+    route_id = global_state.get_route_id()
     if global_state.get_state() == AppStates.WAITING:
+        MESSAGES_WAITING.inc()
         return
-    try:
-        payload_str: str = msg.payload.decode()
-        data = json.loads(payload_str)
-        stations = json_data_to_station_rssi(data)
-    except Exception as e:
-        print("Ошибка обработки:", e)
-        return
+    pipeline.submit(ingest.RawMessage(msg.topic, msg.payload, received_ts, route_id), key=msg.topic)
+
 
-    pos = rssi_position.get_board_pos(stations)
-    db_pos = db.BoardPosition(x=pos.x, y=pos.y)
-    db.session.add(db_pos)
-    db.session.commit()
+def start_ingest() -> None:
+    # продолжаем нумерацию фиксов после уже сохранённых в базе
+    live.fixes.reset_ids(db.get_max_position_id() + 1)
+    position_writer.start()
+    pipeline.start()
+    if calibration.AUTO_CALIBRATE:
+        calibration.calibrator.start()
 
 
-def mqtt_run() -> None:
-    client: mqtt.Client = mqtt.Client()
+def mqtt_run(client_id: str = "") -> None:
+    start_ingest()
+    client: mqtt.Client = mqtt.Client(client_id=client_id)
     client.on_connect = on_connect
     client.on_message = on_board_message
     client.connect(BROKER, PORT, 60)
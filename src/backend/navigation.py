@@ -0,0 +1,403 @@
+"""
+Навигация по графу помещения.
+
+Граф (data/venue.json) - узлы коридоров и рёбра между ними в той же
+системе координат, что beacons.txt:
+
+    {"nodes": [{"id": "n1", "x": 0.0, "y": 1.5, "floor": 0, "poi": "Аудитория 101"}, ...],
+     "edges": [["n1", "n2"], ["n2", "n3", 7.5], ...],
+     "plan": {...}}   # контуры и стены этажей, см. floor_map
+
+Вес ребра - длина (м), по умолчанию евклидова; рёбра двусторонние.
+Позиция платы привязывается к ближайшему узлу этажа через сетку
+spatial_index.GridIndex. Путь до точки интереса (poi) берётся из дерева
+кратчайших путей, построенного один раз на версию графа; до остальных
+узлов - A* с LRU-кэшем. У каждой платы хранится текущий путь: пока новые
+фиксы ложатся на него (с допуском OFF_PATH_DISTANCE), путь только
+укорачивается, без нового поиска.
+"""
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+import metrics
+from beacon_registry import CUR_DIR, MTIME_CHECK_INTERVAL
+from spatial_index import GridIndex
+from trackers import MAX_TRACKERS, TRACKER_TTL
+
+VENUE_PATH = os.path.join(CUR_DIR, "data", "venue.json")
+
+# число путей между произвольными узлами в LRU-кэше
+PATH_CACHE_SIZE = 4096
+# радиус поиска ближайшего узла (м); дальше - перебор всех узлов этажа
+SNAP_RADIUS = 10.0
+GRID_CELL = 5.0
+# фикс не дальше этого (м) от узла текущего пути не вызывает перестроения
+OFF_PATH_DISTANCE = 2.5
+# строить деревья путей до всех poi сразу при загрузке графа
+PRECOMPUTE_POIS = True
+
+PATH_CACHE_HITS = metrics.counter("akl_nav_path_cache_hits_total", "Shortest paths served from the LRU cache")
+PATH_SEARCHES = metrics.counter("akl_nav_astar_searches_total", "A* searches run")
+REPLANS = metrics.counter("akl_nav_replans_total", "Routes re-planned because the board left its path")
+ROUTE_TIME = metrics.histogram("akl_nav_route_seconds", "Route query duration")
+
+
+@dataclass(frozen=True)
+class VenueGraph:
+    """
+    Неизменяемый граф. Координаты - массивы для привязки,
+    смежность - списки Python для поиска.
+    """
+    version: int
+    ids: tuple[str, ...]
+    index: dict[str, int]
+    xy: np.ndarray
+    floor: np.ndarray
+    points: tuple[tuple[float, float], ...]
+    neighbors: tuple[tuple[int, ...], ...]
+    costs: tuple[tuple[float, ...], ...]
+    pois: dict[str, int]
+    grid: GridIndex
+    # план этажей для floor_map
+    plan: dict = field(default_factory=dict)
+    mtime: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def resolve(self, name: str) -> Optional[int]:
+        """Узел по имени poi или id узла."""
+        node = self.pois.get(name)
+        return node if node is not None else self.index.get(name)
+
+    def snap(self, xy, floor: Optional[int] = None) -> Optional[int]:
+        """Ближайший узел этажа floor (или любого этажа) к точке xy."""
+        if not len(self):
+            return None
+        cand = self.grid.query_radius(xy, SNAP_RADIUS, floor)
+        if not len(cand):
+            cand = np.arange(len(self)) if floor is None else np.flatnonzero(self.floor == floor)
+            if not len(cand):
+                return None
+        d = np.hypot(self.xy[cand, 0] - xy[0], self.xy[cand, 1] - xy[1])
+        return int(cand[np.argmin(d)])
+
+    def edge_cost(self, a: int, b: int) -> float:
+        return self.costs[a][self.neighbors[a].index(b)]
+
+    def node_dict(self, node: int) -> dict:
+        return {"id": self.ids[node], "x": float(self.xy[node, 0]), "y": float(self.xy[node, 1]),
+                "floor": int(self.floor[node])}
+
+    def to_dict(self) -> dict:
+        poi_names = {node: name for name, node in self.pois.items()}
+        nodes = []
+        for i in range(len(self)):
+            node = self.node_dict(i)
+            if i in poi_names:
+                node["poi"] = poi_names[i]
+            nodes.append(node)
+        edges = [[self.ids[a], self.ids[b]] for a in range(len(self)) for b in self.neighbors[a] if a < b]
+        return {"nodes": nodes, "edges": edges}
+
+
+def parse_venue(content: bytes) -> dict:
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError("Граф помещения должен быть объектом {nodes, edges}")
+    return data
+
+
+def build_graph(data: dict, version: int, mtime=None) -> VenueGraph:
+    ids, index, coords, floors, pois = [], {}, [], [], {}
+    for node in data.get("nodes", []):
+        try:
+            node_id = str(node["id"])
+            x, y = float(node["x"]), float(node["y"])
+            fl = int(node.get("floor", 0))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if node_id in index:
+            continue
+        index[node_id] = len(ids)
+        ids.append(node_id)
+        coords.append((x, y))
+        floors.append(fl)
+        if node.get("poi"):
+            pois[str(node["poi"])] = index[node_id]
+    xy = np.array(coords, dtype=np.float64).reshape(-1, 2)
+    floor = np.array(floors, dtype=np.int32)
+
+    adj: list[dict[int, float]] = [{} for _ in ids]
+    for edge in data.get("edges", []):
+        if not isinstance(edge, (list, tuple)) or len(edge) < 2:
+            continue
+        a, b = index.get(str(edge[0])), index.get(str(edge[1]))
+        if a is None or b is None or a == b:
+            continue
+        length = float(np.hypot(*(xy[a] - xy[b])))
+        try:
+            # вес не меньше расстояния по плану, иначе эвристика A* переоценивает
+            w = max(float(edge[2]), length) if len(edge) > 2 else length
+        except (TypeError, ValueError):
+            continue
+        adj[a][b] = adj[b][a] = min(w, adj[a].get(b, w))
+
+    for arr in (xy, floor):
+        arr.setflags(write=False)
+    return VenueGraph(
+        version=version,
+        ids=tuple(ids),
+        index=index,
+        xy=xy,
+        floor=floor,
+        points=tuple(map(tuple, xy.tolist())),
+        neighbors=tuple(tuple(a) for a in adj),
+        costs=tuple(tuple(a.values()) for a in adj),
+        pois=pois,
+        grid=GridIndex(xy, floor, GRID_CELL),
+        plan=data.get("plan") or {},
+        mtime=mtime,
+    )
+
+
+def astar(graph: VenueGraph, src: int, dst: int) -> Optional[tuple[list[int], float]]:
+    """Кратчайший путь src -> dst (узлы, длина) или None, если узлы не связаны."""
+    xy = graph.points
+    tx, ty = xy[dst]
+    best = {src: 0.0}
+    came: dict[int, int] = {}
+    heap = [(0.0, 0.0, src)]
+    while heap:
+        _, g, node = heapq.heappop(heap)
+        if node == dst:
+            path = [node]
+            while node in came:
+                node = came[node]
+                path.append(node)
+            return path[::-1], g
+        if g > best[node]:
+            continue
+        for nb, w in zip(graph.neighbors[node], graph.costs[node]):
+            cost = g + w
+            if cost < best.get(nb, float("inf")):
+                best[nb] = cost
+                came[nb] = node
+                x, y = xy[nb]
+                heapq.heappush(heap, (cost + ((x - tx) ** 2 + (y - ty) ** 2) ** 0.5, cost, nb))
+    return None
+
+
+def path_tree(graph: VenueGraph, root: int) -> tuple[list[float], list[int]]:
+    """
+    Дейкстра от root: dist и next - следующий узел на пути к root
+    (-1 у root и недостижимых). Рёбра двусторонние, поэтому одно дерево
+    даёт пути к root от всех узлов сразу.
+    """
+    n = len(graph)
+    dist = [math.inf] * n
+    nxt = [-1] * n
+    dist[root] = 0.0
+    heap = [(0.0, root)]
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > dist[node]:
+            continue
+        for nb, w in zip(graph.neighbors[node], graph.costs[node]):
+            cost = d + w
+            if cost < dist[nb]:
+                dist[nb] = cost
+                nxt[nb] = node
+                heapq.heappush(heap, (cost, nb))
+    return dist, nxt
+
+
+@dataclass
+class Session:
+    """Текущий путь платы: узлы, их позиции в пути и остаток длины от каждого узла."""
+    version: int
+    dest: int
+    path: list[int]
+    order: dict[int, int]
+    remaining: list[float]
+    xy: np.ndarray
+    last_seen: float = 0.0
+
+
+@dataclass(frozen=True)
+class Route:
+    graph: VenueGraph
+    path: list[int]
+    length: float
+    replanned: bool
+
+    def to_dict(self) -> dict:
+        return {"length": round(self.length, 2), "replanned": self.replanned,
+                "path": [self.graph.node_dict(n) for n in self.path]}
+
+
+class Navigator():
+    """
+    Граф перечитывается при изменении mtime VENUE_PATH (как BeaconRegistry).
+    Пути до poi - из деревьев path_tree, остальные - A* с LRU-кэшем.
+    """
+
+    def __init__(self, path: str = VENUE_PATH, check_interval: float = MTIME_CHECK_INTERVAL,
+                 cache_size: int = PATH_CACHE_SIZE, max_sessions: int = MAX_TRACKERS,
+                 session_ttl: float = TRACKER_TTL):
+        self.path = path
+        self.check_interval = check_interval
+        self.cache_size = cache_size
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self._lock = threading.RLock()
+        self._version = 0
+        self._last_check = 0.0
+        self._graph: Optional[VenueGraph] = None
+        self._trees: dict[int, tuple[list[float], list[int]]] = {}
+        self._paths: OrderedDict[tuple[int, int], tuple[list[int], float]] = OrderedDict()
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload(self) -> Optional[VenueGraph]:
+        with self._lock:
+            mtime = self._mtime(self.path)
+            graph = None
+            if mtime is not None:
+                try:
+                    with open(self.path, "rb") as f:
+                        graph = build_graph(parse_venue(f.read()), self._version + 1, mtime)
+                except ValueError as e:
+                    # битый файл - остаётся прежний граф
+                    print("Ошибка чтения графа помещения:", e)
+                    self._last_check = time.monotonic()
+                    return self._graph
+            self._version += 1
+            self._graph = graph
+            self._trees = {}
+            self._paths.clear()
+            self._last_check = time.monotonic()
+            if self._graph is not None and PRECOMPUTE_POIS:
+                for node in set(self._graph.pois.values()):
+                    self._trees[node] = path_tree(self._graph, node)
+            return self._graph
+
+    def graph(self) -> Optional[VenueGraph]:
+        """Текущий граф; None, если файла графа нет."""
+        now = time.monotonic()
+        if self._version and now - self._last_check < self.check_interval:
+            return self._graph
+        with self._lock:
+            mtime = self._graph.mtime if self._graph is not None else None
+            if self._version == 0 or self._mtime(self.path) != mtime:
+                return self.reload()
+            self._last_check = now
+            return self._graph
+
+    def write(self, content: bytes) -> Optional[VenueGraph]:
+        """Проверяет и сохраняет новый граф, затем перезагружает его."""
+        build_graph(parse_venue(content), 0)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, self.path)
+        return self.reload()
+
+    def shortest_path(self, graph: VenueGraph, src: int, dst: int) -> Optional[tuple[list[int], float]]:
+        with self._lock:
+            tree = self._trees.get(dst) if graph.version == self._version else None
+            if tree is not None:
+                dist, nxt = tree
+                if dist[src] == math.inf:
+                    return None
+                path = [src]
+                while path[-1] != dst:
+                    path.append(nxt[path[-1]])
+                return path, dist[src]
+            key = (src, dst)
+            cached = self._paths.get(key) if graph.version == self._version else None
+            if cached is not None:
+                self._paths.move_to_end(key)
+                PATH_CACHE_HITS.inc()
+                return cached
+        PATH_SEARCHES.inc()
+        res = astar(graph, src, dst)
+        if res is not None:
+            with self._lock:
+                if graph.version == self._version:
+                    self._paths[key] = res
+                    if len(self._paths) > self.cache_size:
+                        self._paths.popitem(last=False)
+        return res
+
+    def route(self, board_id: str, xy, floor: Optional[int], dest: int,
+              graph: Optional[VenueGraph] = None) -> Optional[Route]:
+        """
+        Путь платы из точки xy до узла dest. Если фикс привязывается к узлу
+        текущего пути платы, путь только укорачивается; иначе строится заново.
+        """
+        with metrics.timer(ROUTE_TIME):
+            graph = graph or self.graph()
+            if graph is None:
+                return None
+            node = graph.snap(xy, floor)
+            if node is None:
+                return None
+            now = time.monotonic()
+            with self._lock:
+                session = self._sessions.get(board_id)
+                if session is not None and session.version == graph.version and session.dest == dest:
+                    i = session.order.get(node)
+                    if i is None:
+                        d2 = ((session.xy - np.asarray(xy, dtype=np.float64)) ** 2).sum(axis=1)
+                        j = int(np.argmin(d2))
+                        if d2[j] <= OFF_PATH_DISTANCE ** 2:
+                            i = j
+                    if i is not None:
+                        session.last_seen = now
+                        self._sessions.move_to_end(board_id)
+                        return Route(graph, session.path[i:], session.remaining[i], False)
+                    REPLANS.inc()
+
+            res = self.shortest_path(graph, node, dest)
+            if res is None:
+                return None
+            path, length = res
+            remaining = [length]
+            for a, b in zip(path, path[1:]):
+                remaining.append(max(remaining[-1] - graph.edge_cost(a, b), 0.0))
+            with self._lock:
+                self._sessions[board_id] = Session(graph.version, dest, path, {n: i for i, n in enumerate(path)},
+                                                   remaining, graph.xy[path], now)
+                self._sessions.move_to_end(board_id)
+                self._evict(now)
+            return Route(graph, path, length, True)
+
+    def _evict(self, now: float):
+        while self._sessions:
+            board_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session.last_seen <= self.session_ttl:
+                break
+            del self._sessions[board_id]
+
+    def forget(self, board_id: str):
+        with self._lock:
+            self._sessions.pop(board_id, None)
+
+
+navigator = Navigator()
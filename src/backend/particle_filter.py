@@ -0,0 +1,208 @@
+"""
+Фильтр частиц вместо решателя и EKF (AKL_ENGINE=particle).
+
+Вес частицы считается прямо по сырым RSSI через лог-дистанционную
+модель маяков (RSSI0, N, SIGMA из снимка реестра), без трилатерации,
+поэтому неоднозначные положения держатся несколькими группами частиц.
+Ошибка RSSI - t-распределение с STUDENT_NU степенями свободы: выбросы
+многолучёвости не обнуляют веса.
+
+Частицы всех плат лежат в заранее выделенных массивах (платы x
+MAX_PARTICLES x 4: x, y, vx, vy); у платы используются первые count
+частиц. Число частиц подстраивается по эффективному размеру выборки
+(ESS): при вырождении растёт до MAX_PARTICLES, при уверенной оценке
+уменьшается до MIN_PARTICLES. Распространение, веса и систематический
+пересэмплинг векторизованы.
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+import floor_map
+import metrics
+from beacon_registry import BeaconSnapshot
+from trackers import MAX_DT, MAX_TRACKERS, TRACKER_TTL, SlotAllocator
+
+# платы с частицами одновременно - столько же, сколько трекеров EKF.
+# Массивы выделяются np.zeros: ОС отдаёт страницы при первой записи, поэтому
+# память растёт с числом активных плат (около 150 КБ на плату с INIT_PARTICLES)
+# и не больше MAX_BOARDS * MAX_PARTICLES * 24 байт (~100 МБ при 1024 платах).
+MAX_BOARDS = MAX_TRACKERS
+MIN_PARTICLES = 512
+MAX_PARTICLES = 4096
+INIT_PARTICLES = 2048
+# пересэмплинг при ESS < RESAMPLE_ESS * count; число частиц растёт при
+# ESS < GROW_ESS * count и уменьшается при ESS > SHRINK_ESS * count
+RESAMPLE_ESS = 0.5
+GROW_ESS = 0.05
+SHRINK_ESS = 0.3
+
+# шум движения: ускорение (м/с^2) и дрожание позиции (м/sqrt(с)); предел скорости (м/с)
+ACCEL_SIGMA = 1.0
+POS_SIGMA = 0.3
+MAX_SPEED = 2.5
+# разброс частиц после пересэмплинга (м)
+ROUGHEN = 0.05
+STUDENT_NU = 4.0
+# частицы инициализации - в прямоугольнике услышанных маяков с запасом (м)
+INIT_MARGIN = 5.0
+# средний логарифм правдоподобия на маяк у лучшей частицы ниже этого - плата потеряна
+LOST_LOGLIK = -8.0
+
+PARTICLES = metrics.histogram("akl_particles_per_board", "Particles used for a board after an update",
+                              buckets=(512, 1024, 2048, 4096))
+REINITS = metrics.counter("akl_particle_reinit_total", "Particle clouds re-initialised (new, lost or floor change)")
+
+
+class ParticlePool():
+    """
+    Облака частиц по платам: particles (K, MAX_PARTICLES, 4) float32,
+    weights (K, MAX_PARTICLES) float64; слоты плат - trackers.SlotAllocator.
+    """
+
+    def __init__(self, capacity: int = MAX_BOARDS, max_particles: int = MAX_PARTICLES,
+                 ttl: float = TRACKER_TTL, seed: Optional[int] = None):
+        self.capacity = capacity
+        self.max_particles = max_particles
+        self.ttl = ttl
+        self.particles = np.zeros((capacity, max_particles, 4), dtype=np.float32)
+        self.weights = np.zeros((capacity, max_particles))
+        self.count = np.zeros(capacity, dtype=np.int32)
+        self.floor = np.zeros(capacity, dtype=np.int32)
+        self.last_ts = np.full(capacity, np.nan)
+        self.mean = np.zeros((capacity, 2))
+        self.cov = np.zeros((capacity, 2, 2))
+        self.rng = np.random.default_rng(seed)
+        self._slots = SlotAllocator(capacity, ttl, self._reset)
+        self._lock = self._slots.lock
+
+    def __contains__(self, board_id: str) -> bool:
+        return board_id in self._slots
+
+    def _reset(self, slot: int):
+        self.count[slot] = 0
+        self.last_ts[slot] = np.nan
+
+    def slot(self, board_id: str, now: Optional[float] = None) -> int:
+        return self._slots.slot(board_id, now)
+
+    def _init(self, slot: int, snap: BeaconSnapshot, idx: np.ndarray, fl: int):
+        n = min(INIT_PARTICLES, self.max_particles)
+        lo = snap.xy[idx].min(axis=0) - INIT_MARGIN
+        hi = snap.xy[idx].max(axis=0) + INIT_MARGIN
+        p = self.particles[slot, :n]
+        p[:, :2] = self.rng.uniform(lo, hi, (n, 2))
+        p[:, 2:] = 0.0
+        self.weights[slot, :n] = 1.0 / n
+        self.count[slot] = n
+        self.floor[slot] = fl
+        REINITS.inc()
+
+    def _propagate(self, p: np.ndarray, dt: float):
+        if dt <= 0.0:
+            return
+        noise = self.rng.standard_normal((len(p), 4), dtype=np.float32)
+        p[:, 2:] += noise[:, 2:] * np.float32(ACCEL_SIGMA * dt)
+        speed = np.hypot(p[:, 2], p[:, 3])
+        fast = speed > MAX_SPEED
+        if fast.any():
+            p[fast, 2:] *= (MAX_SPEED / speed[fast])[:, None]
+        p[:, :2] += p[:, 2:] * np.float32(dt) + noise[:, :2] * np.float32(POS_SIGMA * math.sqrt(dt))
+
+    def _log_likelihood(self, p: np.ndarray, snap: BeaconSnapshot, idx: np.ndarray, rssi: np.ndarray) -> np.ndarray:
+        bxy = snap.xy[idx].astype(np.float32)
+        dx = p[:, None, 0] - bxy[None, :, 0]
+        dy = p[:, None, 1] - bxy[None, :, 1]
+        d2 = np.maximum(dx * dx + dy * dy, np.float32(0.25))
+        # 10 * log10(d) = 5 * log10(d^2)
+        pred = snap.rssi0[idx].astype(np.float32) - (5.0 * snap.n[idx]).astype(np.float32) * np.log10(d2)
+        r = (rssi.astype(np.float32) - pred) / snap.sigma[idx].astype(np.float32)
+        return -0.5 * (STUDENT_NU + 1.0) * np.log1p(r * r / np.float32(STUDENT_NU)).sum(axis=1, dtype=np.float64)
+
+    def _resample(self, slot: int, n: int, w: np.ndarray, new_n: int):
+        """Систематический пересэмплинг n частиц в new_n (тот же срез массива)."""
+        cum = np.cumsum(w)
+        cum[-1] = 1.0
+        pick = np.searchsorted(cum, (self.rng.random() + np.arange(new_n)) / new_n)
+        src = self.particles[slot, :n][pick]
+        src[:, :2] += self.rng.standard_normal((new_n, 2), dtype=np.float32) * np.float32(ROUGHEN)
+        self.particles[slot, :new_n] = src
+        self.weights[slot, :new_n] = 1.0 / new_n
+        self.count[slot] = new_n
+
+    def step(self, board_id: str, ts: float, idx: np.ndarray, rssi: np.ndarray,
+             snap: BeaconSnapshot) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        """
+        Предсказание до ts и обновление по измерению. Возвращает оценку
+        позиции (2,) и ковариацию (2x2) или None, если маяков меньше трёх.
+        """
+        if len(idx) < 3:
+            return None
+        rssi = np.asarray(rssi, dtype=np.float64)
+        fl = int(snap.floor[idx[np.argmax(rssi)]])
+        on_floor = snap.floor[idx] == fl
+        idx, rssi = idx[on_floor], rssi[on_floor]
+        if len(idx) < 3:
+            return None
+        maps = floor_map.get_maps() if floor_map.ENABLED else None
+        with self._lock:
+            slot = self.slot(board_id)
+            last = self.last_ts[slot]
+            dt = 0.0 if np.isnan(last) else ts - last
+            if self.count[slot] == 0 or self.floor[slot] != fl or dt > MAX_DT:
+                self._init(slot, snap, idx, fl)
+                dt = 0.0
+            self.last_ts[slot] = ts if np.isnan(last) else max(last, ts)
+            n = int(self.count[slot])
+            p = self.particles[slot, :n]
+            self._propagate(p, max(dt, 0.0))
+
+            loglik = self._log_likelihood(p, snap, idx, rssi)
+            if loglik.max() < LOST_LOGLIK * len(idx):
+                self._init(slot, snap, idx, fl)
+                n = int(self.count[slot])
+                p = self.particles[slot, :n]
+                loglik = self._log_likelihood(p, snap, idx, rssi)
+            logw = np.log(np.maximum(self.weights[slot, :n], 1e-300)) + loglik
+            if maps:
+                inside = maps.maps.get(fl)
+                if inside is not None:
+                    walk = inside.is_walkable(p[:, :2])
+                    if walk.any():
+                        logw[~walk] = -np.inf
+            w = np.exp(logw - logw.max())
+            w /= w.sum()
+            self.weights[slot, :n] = w
+
+            xy = w @ p[:, :2].astype(np.float64)
+            d = p[:, :2] - xy
+            cov = (d * w[:, None]).T @ d
+            self.mean[slot] = xy
+            self.cov[slot] = cov
+
+            ess = 1.0 / float(w @ w)
+            new_n = n
+            if ess < GROW_ESS * n:
+                new_n = min(2 * n, self.max_particles)
+            elif ess > SHRINK_ESS * n:
+                new_n = max(n // 2, MIN_PARTICLES)
+            if ess < RESAMPLE_ESS * n or new_n != n:
+                self._resample(slot, n, w, new_n)
+            PARTICLES.observe(self.count[slot])
+            return xy, cov
+
+    def get_state(self, board_id: str) -> Optional[tuple[float, float]]:
+        slot = self._slots.get(board_id)
+        if slot is None or self.count[slot] == 0:
+            return None
+        return float(self.mean[slot, 0]), float(self.mean[slot, 1])
+
+    def get_position_var(self, board_id: str) -> Optional[float]:
+        slot = self._slots.get(board_id)
+        if slot is None or self.count[slot] == 0:
+            return None
+        return float(self.cov[slot, 0, 0] + self.cov[slot, 1, 1])
+
+
+pool = ParticlePool()
@@ -0,0 +1,243 @@
+"""
+Упрощённая геометрия маршрутов для карты (уровни детализации).
+
+Трек платы упрощается Дугласом-Пекером по лестнице допусков
+LOD_BASE * 2^k; запрошенный допуск округляется вниз до ступени, число
+точек - до самой грубой ступени, где точек не меньше запрошенного.
+Уровни считаются при первом запросе и хранятся вместе с треком.
+
+Трек только дописывается, поэтому при обновлении уровня вершины до
+предпоследней сохранённой не меняются: Дуглас-Пекер заново проходит
+лишь хвост от неё до новой последней точки. Погрешность каждого отрезка
+по-прежнему не больше допуска. Новые точки маршрута дочитываются из
+базы по id (см. route_store.load_route_since) и после сжатия: точки
+с опозданием доходят в BoardPosition уже после завершения маршрута.
+Чтение из базы идёт под блокировкой маршрута, а не всего кэша.
+"""
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+import metrics
+from data import route_store
+
+# самый мелкий допуск (м) и число ступеней: 0.05 м ... ~100 м
+LOD_BASE = 0.05
+LOD_LEVELS = 12
+# сколько маршрутов держать в памяти
+MAX_ROUTES = 16
+# начальная ёмкость массивов трека
+INITIAL_CAPACITY = 256
+
+QUERY_TIME = metrics.histogram("akl_route_lod_seconds", "Simplified route query duration (refresh and simplify)")
+
+
+def douglas_peucker(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Маска сохраняемых точек полилинии. Все отрезки одного уровня рекурсии
+    обрабатываются вместе, поэтому число проходов NumPy - глубина рекурсии.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    starts, ends = np.array([0]), np.array([n - 1])
+    while len(starts):
+        lengths = ends - starts - 1
+        sel = lengths > 0
+        starts, ends, lengths = starts[sel], ends[sel], lengths[sel]
+        if not len(starts):
+            break
+        seg = np.repeat(np.arange(len(starts)), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        pts = starts[seg] + 1 + np.arange(len(seg)) - offsets[seg]
+        # расстояние до отрезка (а не до прямой): на петлях прямая обманывает
+        ax, ay = x[starts][seg], y[starts][seg]
+        dx, dy = x[ends][seg] - ax, y[ends][seg] - ay
+        px, py = x[pts] - ax, y[pts] - ay
+        len2 = dx * dx + dy * dy
+        u = np.clip((px * dx + py * dy) / np.where(len2 > 0, len2, 1.0), 0.0, 1.0)
+        ex, ey = px - u * dx, py - u * dy
+        d = ex * ex + ey * ey
+        dmax = np.maximum.reduceat(d, offsets)
+        split = dmax > tolerance * tolerance
+        if not split.any():
+            break
+        # первая точка отрезка с максимальным отклонением
+        hit = np.flatnonzero(d == dmax[seg])
+        segs, first = np.unique(seg[hit], return_index=True)
+        pick = pts[hit[first]]
+        sel = split[segs]
+        pick, segs = pick[sel], segs[sel]
+        keep[pick] = True
+        starts = np.concatenate([starts[segs], pick])
+        ends = np.concatenate([pick, ends[segs]])
+    return keep
+
+
+def level_tolerance(level: int) -> float:
+    return LOD_BASE * 2.0 ** level
+
+
+def tolerance_level(tolerance: float) -> int:
+    """Ступень с наибольшим допуском, не превышающим tolerance; -1 - без упрощения."""
+    if tolerance < LOD_BASE:
+        return -1
+    return min(int(np.floor(np.log2(tolerance / LOD_BASE) + 1e-9)), LOD_LEVELS - 1)
+
+
+class TrackLod():
+    """
+    Трек одной платы (x, y, t - абсолютные секунды) в растущих массивах
+    и индексы его вершин на каждой ступени допуска.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.x = np.empty(INITIAL_CAPACITY)
+        self.y = np.empty(INITIAL_CAPACITY)
+        self.t = np.empty(INITIAL_CAPACITY)
+        # ступень -> (индексы вершин, число точек трека на момент расчёта)
+        self.levels: dict[int, tuple[np.ndarray, int]] = {}
+
+    def __len__(self) -> int:
+        return self.n
+
+    def extend(self, x: np.ndarray, y: np.ndarray, t: np.ndarray):
+        add = len(x)
+        if self.n + add > len(self.x):
+            cap = max(2 * len(self.x), self.n + add)
+            for name in ("x", "y", "t"):
+                arr = np.empty(cap)
+                arr[:self.n] = getattr(self, name)[:self.n]
+                setattr(self, name, arr)
+        self.x[self.n:self.n + add] = x
+        self.y[self.n:self.n + add] = y
+        self.t[self.n:self.n + add] = t
+        self.n += add
+
+    def indices(self, level: int) -> np.ndarray:
+        """Вершины трека на ступени level (-1 - все точки); дописанный хвост упрощается заново."""
+        if level < 0:
+            return np.arange(self.n)
+        kept, upto = self.levels.get(level, (np.empty(0, dtype=np.int64), 0))
+        if upto == self.n:
+            return kept
+        # последняя вершина была концом трека - с предпоследней всё пересчитывается
+        anchor, base = 0, kept[:0]
+        if len(kept) >= 2:
+            anchor, base = int(kept[-2]), kept[:-2]
+        mask = douglas_peucker(self.x[anchor:self.n], self.y[anchor:self.n], level_tolerance(level))
+        kept = np.concatenate([base, anchor + np.flatnonzero(mask)])
+        self.levels[level] = (kept, self.n)
+        return kept
+
+    def level_for_points(self, points: int) -> int:
+        """Самая грубая ступень, где вершин не меньше points."""
+        if points >= self.n:
+            return -1
+        for level in range(LOD_LEVELS - 1, -1, -1):
+            if len(self.indices(level)) >= points:
+                return level
+        return -1
+
+    def simplify(self, level: int, bbox: Optional[tuple[float, float, float, float]] = None) -> dict:
+        """
+        Вершины ступени в формате route_store.Track.to_dict. С bbox
+        (x0, y0, x1, y1) - только вершины внутри окна и их соседи, чтобы
+        отрезки через край окна рисовались.
+        """
+        idx = self.indices(level)
+        if bbox is not None and len(idx):
+            x0, y0, x1, y1 = bbox
+            x, y = self.x[idx], self.y[idx]
+            inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+            near = inside.copy()
+            near[1:] |= inside[:-1]
+            near[:-1] |= inside[1:]
+            idx = idx[near]
+        t0 = float(self.t[0]) if self.n else 0.0
+        return {
+            "t0": t0,
+            "x": self.x[idx].tolist(),
+            "y": self.y[idx].tolist(),
+            "t": (self.t[idx] - t0).tolist(),
+            "total": self.n,
+        }
+
+
+class RouteLod():
+    """Треки маршрута по платам и курсор дочитывания из базы (None - ещё не читался)."""
+
+    def __init__(self, route_id: int):
+        self.route_id = route_id
+        self.tracks: dict[str, TrackLod] = {}
+        self.cursor: Optional[int] = None
+        self.compacted = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        tracks, cursor, compacted = route_store.load_route_since(self.route_id, self.cursor)
+        if compacted != self.compacted and self.cursor is not None:
+            # точки, которых ещё не было в кэше, могли уйти в RouteTrack - читаем маршрут целиком
+            self.tracks = {}
+            tracks, cursor, compacted = route_store.load_route_since(self.route_id)
+        for board_id, track in tracks.items():
+            lod = self.tracks.get(board_id)
+            if lod is None:
+                lod = self.tracks[board_id] = TrackLod()
+            lod.extend(track.x, track.y, track.t.astype(np.float64) + track.t0)
+        self.cursor = cursor
+        self.compacted = compacted
+
+
+class RouteLodCache():
+    """LRU маршрутов с упрощёнными треками; _lock защищает только сам LRU."""
+
+    def __init__(self, max_routes: int = MAX_ROUTES):
+        self.max_routes = max_routes
+        self._routes: OrderedDict[int, RouteLod] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def query(self, route_id: int, tolerance: Optional[float] = None, points: Optional[int] = None,
+              board_id: Optional[str] = None,
+              bbox: Optional[tuple[float, float, float, float]] = None) -> dict:
+        """
+        Упрощённые треки маршрута: {"boards": {id: {"t0", "x", "y", "t",
+        "total", "tolerance"}}}. Задаётся tolerance (м) или points (вершин
+        на плату); без обоих - все точки.
+        """
+        with metrics.timer(QUERY_TIME):
+            with self._lock:
+                route = self._routes.get(route_id)
+                if route is None:
+                    route = self._routes[route_id] = RouteLod(route_id)
+                    while len(self._routes) > self.max_routes:
+                        self._routes.popitem(last=False)
+                else:
+                    self._routes.move_to_end(route_id)
+            with route.lock:
+                route.refresh()
+                boards = {}
+                for b, lod in route.tracks.items():
+                    if board_id is not None and b != board_id:
+                        continue
+                    if points is not None:
+                        level = lod.level_for_points(points)
+                    elif tolerance is not None:
+                        level = tolerance_level(tolerance)
+                    else:
+                        level = -1
+                    boards[b] = {**lod.simplify(level, bbox),
+                                 "tolerance": level_tolerance(level) if level >= 0 else 0.0}
+        return {"route_id": route_id, "boards": boards}
+
+    def forget(self, route_id: int):
+        with self._lock:
+            self._routes.pop(route_id, None)
+
+
+cache = RouteLodCache()
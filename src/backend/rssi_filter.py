@@ -0,0 +1,209 @@
+"""
+Предварительная фильтрация измерений перед решателем.
+
+RSSI каждого маяка каждой платы сглаживается: медиана последних
+MEDIAN_WINDOW замеров убирает одиночные провалы (многолучёвость), затем
+скалярный фильтр Калмана (случайное блуждание) усредняет шум. Скачки
+больше JUMP_SIGMA стандартных отклонений отбрасываются, пока не повторятся
+MAX_REJECTS раз подряд - тогда фильтр перезапускается с нового уровня.
+
+Решённые позиции проходят проверку скорости: фикс дальше MAX_SPEED * dt +
+GATE_SLACK от последнего принятого фикса платы не попадает в трекер.
+Последний фикс хранится в памяти, а не читается из базы.
+
+Состояния - массивы (платы x небольшая таблица услышанных платой маяков),
+слоты плат выдаёт trackers.SlotAllocator.
+"""
+import os
+from typing import Optional
+
+import numpy as np
+
+import metrics
+from beacon_registry import BeaconSnapshot
+from trackers import MAX_TRACKERS, TRACKER_TTL, SlotAllocator
+
+# AKL_PREFILTER=0 - решатель получает сырые RSSI, позиции не проверяются
+ENABLED = os.environ.get("AKL_PREFILTER", "1") == "1"
+
+# медиана по окну из стольких замеров; при сообщениях раз в ~2 с медиана
+# запаздывает сильнее, чем помогает, - 3 имеет смысл при непрерывном скане (5 Гц)
+MEDIAN_WINDOW = 1
+# рост дисперсии уровня RSSI (дБ^2 в секунду) при движении платы
+Q_RSSI = 8.0
+# замер, отличающийся от оценки больше чем на JUMP_SIGMA * СКО, считается скачком
+JUMP_SIGMA = 3.0
+MAX_REJECTS = 3
+# маяк, не слышный дольше (сек), начинает фильтр заново
+STALE_AFTER = 10.0
+
+# максимальная скорость платы (м/с) и допуск на погрешность решения (м)
+MAX_SPEED = 3.0
+GATE_SLACK = 8.0
+# после стольких отброшенных подряд фиксов плата считается переместившейся
+MAX_GATE_REJECTS = 5
+
+# маяков в таблице одной платы (не больше, чем плата передаёт в сообщении);
+# при нехватке места вытесняется маяк, который плата дольше всех не слышала
+BEACONS_PER_BOARD = 64
+
+# поля FilterPool.state
+VALUE, VAR, TS, REJECTS = range(4)
+# дисперсия оценки при (пере)запуске фильтра: первый замер берётся как есть
+RESTART_VAR = 1e6
+
+RSSI_JUMPS = metrics.counter("akl_rssi_jumps_rejected_total", "RSSI samples rejected as jumps by the prefilter")
+FIXES_GATED = metrics.counter("akl_fixes_gated_total", "Solved positions rejected by the velocity gate")
+
+
+class FilterPool():
+    """
+    Состояние фильтров по платам. У каждой платы таблица из
+    BEACONS_PER_BOARD строк: keys (K, M) - индекс маяка в снимке реестра
+    (-1 - свободно), state (K, M, 4), окно медианы (K, M, MEDIAN_WINDOW).
+    Память не зависит от числа маяков в реестре; при смене состава маяков
+    индексы в keys переносятся по именам.
+    """
+
+    def __init__(self, capacity: int = MAX_TRACKERS, ttl: float = TRACKER_TTL,
+                 beacons_per_board: int = BEACONS_PER_BOARD):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.names: tuple[str, ...] = ()
+        self.version = -1
+        m = beacons_per_board
+        self.keys = np.full((capacity, m), -1, dtype=np.int32)
+        # поля state: оценка RSSI, её дисперсия, время последнего замера, скачков подряд
+        self.state = np.zeros((capacity, m, 4))
+        self.window = np.zeros((capacity, m, MEDIAN_WINDOW))
+        self.head = np.zeros((capacity, m), dtype=np.int32)
+        self.fix_xy = np.zeros((capacity, 2))
+        self.fix_ts = np.full(capacity, np.nan)
+        self.fix_rejects = np.zeros(capacity, dtype=np.int32)
+        self._slots = SlotAllocator(capacity, ttl, self._reset)
+        self._lock = self._slots.lock
+
+    def _sync(self, snap: BeaconSnapshot):
+        """Индексы маяков под снимок; пересчёт только при смене их состава."""
+        if snap.version == self.version:
+            return
+        if snap.names != self.names:
+            new_index = {name: i for i, name in enumerate(snap.names)}
+            # последний элемент -1: свободные строки (keys == -1) остаются свободными
+            remap = np.array([new_index.get(name, -1) for name in self.names] + [-1], dtype=np.int32)
+            self.keys = remap[self.keys]
+            self.names = snap.names
+        self.version = snap.version
+
+    def _reset(self, slot: int):
+        self.keys[slot] = -1
+        self.fix_ts[slot] = np.nan
+        self.fix_rejects[slot] = 0
+
+    def slot(self, board_id: str, now: Optional[float] = None) -> int:
+        return self._slots.slot(board_id, now)
+
+    def _columns(self, slot: int, idx: np.ndarray) -> np.ndarray:
+        """Строки таблицы платы для маяков idx (-1 - места не хватило); новым строкам - пустое состояние."""
+        keys = self.keys[slot]
+        hit = keys[None, :] == idx[:, None]
+        cols = np.where(hit.any(axis=1), hit.argmax(axis=1), -1)
+        miss = np.flatnonzero(cols < 0)
+        if len(miss):
+            used = np.zeros(len(keys), dtype=bool)
+            used[cols[cols >= 0]] = True
+            # сначала свободные, затем давно не слышанные
+            age = np.where(keys < 0, -np.inf, np.nan_to_num(self.state[slot, :, TS], nan=-np.inf))
+            order = np.argsort(age, kind="stable")
+            take = order[~used[order]][:len(miss)]
+            miss = miss[:len(take)]
+            keys[take] = idx[miss]
+            self.state[slot, take] = (0.0, 0.0, np.nan, 0.0)
+            cols[miss] = take
+        return cols
+
+    def _median(self, slot: int, cols: np.ndarray, rssi: np.ndarray, fresh: np.ndarray) -> np.ndarray:
+        window = self.window[slot, cols]
+        head = self.head[slot, cols]
+        window[fresh] = rssi[fresh, None]
+        window[np.arange(len(cols)), head] = rssi
+        self.window[slot, cols] = window
+        self.head[slot, cols] = (head + 1) % MEDIAN_WINDOW
+        return np.median(window, axis=1)
+
+    def smooth(self, board_id: str, ts: float, idx: np.ndarray, rssi: np.ndarray,
+               snap: BeaconSnapshot) -> np.ndarray:
+        """
+        Сглаженные RSSI для услышанных маяков idx (тот же порядок).
+        Маяки сверх BEACONS_PER_BOARD в одном сообщении проходят без сглаживания.
+        """
+        rssi = np.asarray(rssi, dtype=np.float64)
+        if len(idx) == 0:
+            return rssi
+        with self._lock:
+            self._sync(snap)
+            slot = self.slot(board_id)
+            cols = self._columns(slot, np.asarray(idx))
+            ok = cols >= 0
+            out = rssi.copy()
+            cols, z_raw, beacons = cols[ok], rssi[ok], np.asarray(idx)[ok]
+            st = self.state[slot, cols]
+            value, var, last, rejects = st.T
+            dt = ts - last
+            # новый или давно молчавший маяк - фильтр начинается с замера
+            fresh = ~(dt <= STALE_AFTER)
+            z = self._median(slot, cols, z_raw, fresh) if MEDIAN_WINDOW > 1 else z_raw
+
+            r = snap.sigma[beacons] ** 2
+            value = np.where(fresh, z, value)
+            var = np.where(fresh, r, var + Q_RSSI * np.maximum(dt, 0.0))
+            innov = z - value
+            s = var + r
+            jump = innov * innov > JUMP_SIGMA ** 2 * s
+            rejects = (rejects + 1) * jump
+            # скачок повторился MAX_REJECTS раз - уровень действительно сменился
+            restart = rejects >= MAX_REJECTS
+            var = np.where(restart, RESTART_VAR, var)
+            k = np.where(jump & ~restart, 0.0, var / (var + r))
+            st[:, VALUE] = value + k * innov
+            st[:, VAR] = (1.0 - k) * var
+            st[:, TS] = np.fmax(last, ts)
+            st[:, REJECTS] = rejects * ~restart
+            self.state[slot, cols] = st
+            out[ok] = st[:, VALUE]
+        n_jumps = int(jump.sum() - restart.sum())
+        if n_jumps:
+            RSSI_JUMPS.inc(n_jumps)
+        return out
+
+    def accept_fix(self, board_id: str, ts: float, x: float, y: float) -> bool:
+        """
+        Проверка скорости относительно последнего принятого фикса платы.
+        Принятый фикс запоминается; после MAX_GATE_REJECTS отказов подряд
+        фикс принимается безусловно.
+        """
+        with self._lock:
+            slot = self.slot(board_id)
+            last_ts = self.fix_ts[slot]
+            if not np.isnan(last_ts):
+                dt = max(ts - last_ts, 0.0)
+                max_dist = MAX_SPEED * dt + GATE_SLACK
+                dx, dy = x - self.fix_xy[slot, 0], y - self.fix_xy[slot, 1]
+                if dx * dx + dy * dy > max_dist * max_dist and self.fix_rejects[slot] < MAX_GATE_REJECTS:
+                    self.fix_rejects[slot] += 1
+                    FIXES_GATED.inc()
+                    return False
+            self.fix_xy[slot] = (x, y)
+            self.fix_ts[slot] = ts if np.isnan(last_ts) else max(ts, last_ts)
+            self.fix_rejects[slot] = 0
+            return True
+
+    def get_last_fix(self, board_id: str) -> Optional[tuple[float, float, float]]:
+        """(ts, x, y) последнего принятого фикса платы или None."""
+        slot = self._slots.get(board_id)
+        if slot is None or np.isnan(self.fix_ts[slot]):
+            return None
+        return float(self.fix_ts[slot]), float(self.fix_xy[slot, 0]), float(self.fix_xy[slot, 1])
+
+
+pool = FilterPool()
@@ -1,16 +1,48 @@
-import os
-import csv
 import math
+import os
+import time
 from dataclasses import dataclass
 from typing import Optional, List
 
 import numpy as np
 
-CUR_DIR = os.path.dirname(os.path.realpath(__file__))
-STATIONS_PATH = os.path.join(CUR_DIR, "data", "beacons.txt")
+import calibration
+import fingerprint
+import floor_map
+import metrics
+import particle_filter
+import rssi_filter
+import spatial_index
+import trackers
+from beacon_registry import registry, BeaconSnapshot
 
 ln10 = np.log(10)
 
+GN_MAX_ITER = 10
+GN_TOL = 1e-3
+# при старте от предсказания трекера итерации останавливаются, когда шаг
+# меньше этой доли собственной погрешности решения sqrt(trace(cov))
+GN_WARM_REL_TOL = 0.5
+# нормальная матрица с det < GN_MIN_REL_DET * trace^2 (число обусловленности
+# больше ~4 / GN_MIN_REL_DET) считается вырожденной: маяки почти на одной прямой
+# или решение ушло далеко от них. Ковариация такого решения - GN_DEGENERATE_VAR * I (м^2)
+GN_MIN_REL_DET = 1e-10
+GN_DEGENERATE_VAR = 1e6
+
+# движок локализации, выбирается при развёртывании: AKL_ENGINE=wls|fingerprint|particle
+# (particle - фильтр частиц по сырым RSSI вместо решателя и EKF, см. particle_filter)
+WLS = "wls"
+FINGERPRINT = "fingerprint"
+PARTICLE = "particle"
+ENGINE = os.environ.get("AKL_ENGINE", WLS)
+
+SOLVE_TIME = metrics.histogram("akl_robust_wls_seconds", "position solve duration (robust_wls or fingerprint)")
+PREDICT_TIME = metrics.histogram("akl_ekf_predict_seconds", "EKF predict duration")
+UPDATE_TIME = metrics.histogram("akl_ekf_update_seconds", "EKF update duration")
+WALL_HOLDS = metrics.counter("akl_map_wall_crossings_total", "Tracker moves rejected for crossing a wall")
+GN_ITERATIONS = metrics.histogram("akl_gauss_newton_iterations", "Gauss-Newton iterations per fix",
+                                  buckets=tuple(range(1, GN_MAX_ITER + 1)))
+
 
 @dataclass
 class Position:
@@ -22,31 +54,10 @@ class StationRssi:
     name: str
     rssi: float
 
-RSSI0 = {}
-N = {}
-SIGMA_RSSI = {}
-BEACONS = {}
-
-
-def check_stations_path() -> bool:
-    return os.path.exists(STATIONS_PATH)
 
 def load_stations() -> dict[str, Position]:
-    stations: dict[str, Position] = {}
-    if not check_stations_path():
-        return stations
-    with open(STATIONS_PATH, newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=";")
-        for row in reader:
-            name = row["Name"]
-            x = float(row["X"])
-            y = float(row["Y"])
-            stations[name] = Position(x, y)
-            BEACONS[name] = (x, y)
-            RSSI0[name] = -59
-            N[name] = 2.0
-            SIGMA_RSSI[name] = 3.0
-    return stations
+    snap = registry.snapshot()
+    return {name: Position(float(x), float(y)) for name, (x, y) in zip(snap.names, snap.xy.tolist())}
 
 def rssi_to_distance(rssi: float, rssi0: float, n: float) -> float:
     return 10 ** ((rssi0 - rssi) / (10.0 * n))
@@ -55,125 +66,380 @@ def var_distance_from_rssi(d: float, n: float, sigma_rssi: float) -> float:
     fac = (d * ln10 / (10.0 * n))
     return (fac ** 2) * (sigma_rssi ** 2)
 
-def robust_wls(rssi_dict: dict[str, float]) -> tuple[Optional[Position], Optional[np.ndarray]]:
-    stations_pos = load_stations()
-    beacons = []
-    dists = []
-    vars_ = []
-
-    for b, rssi in rssi_dict.items():
-        if b not in BEACONS:
-            continue
-        d = rssi_to_distance(rssi, RSSI0[b], N[b])
-        var_d = var_distance_from_rssi(d, N[b], SIGMA_RSSI[b])
-        beacons.append(BEACONS[b])
-        dists.append(d)
-        vars_.append(var_d)
-
-    beacons = np.array(beacons)
-    dists = np.array(dists)
-    vars_ = np.array(vars_)
-
-    if len(beacons) < 3:
-        return None, None
+def gauss_newton(beacons: np.ndarray, dists: np.ndarray, vars_: np.ndarray, x0: np.ndarray,
+                 max_iter: int = GN_MAX_ITER, tol: float = GN_TOL,
+                 rel_tol: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Робастный (Huber) Гаусс-Ньютон для трилатерации.
+    beacons (k,2), dists (k,), vars_ (k,) -> позиция (2,), ковариация (2x2).
+    Нормальные уравнения 2x2 решаются в замкнутой форме.
+    Останов: шаг < tol или шаг < rel_tol * sqrt(trace(cov)), а также
+    вырожденная матрица (см. GN_MIN_REL_DET) - тогда ковариация GN_DEGENERATE_VAR * I.
+    """
+    rel_tol2 = rel_tol * rel_tol
+    bx = beacons[:, 0]
+    by = beacons[:, 1]
+    w0 = 1.0 / vars_
+    x = float(x0[0])
+    y = float(x0[1])
+    h11 = h12 = h22 = det = 0.0
+
+    it = 0
+    for it in range(1, max_iter + 1):
+        ex = x - bx
+        ey = y - by
+        r = np.hypot(ex, ey)
+        np.maximum(r, 1e-6, out=r)
+        ax = ex / r
+        ay = ey / r
+        res = dists - r
+
+        sigma = res.std()
+        c = 1.5 * (sigma if sigma > 1e-3 else 1.0)
+        w = w0 * np.minimum(1.0, c / np.maximum(np.abs(res), 1e-12))
+
+        wax = w * ax
+        way = w * ay
+        h11 = float(wax @ ax)
+        h12 = float(wax @ ay)
+        h22 = float(way @ ay)
+        g1 = float(wax @ res)
+        g2 = float(way @ res)
+
+        det = h11 * h22 - h12 * h12
+        if not det > GN_MIN_REL_DET * (h11 + h22) ** 2 or not math.isfinite(det):
+            break
+        dx = (h22 * g1 - h12 * g2) / det
+        dy = (h11 * g2 - h12 * g1) / det
+        x += dx
+        y += dy
+
+        step2 = dx * dx + dy * dy
+        if step2 < tol * tol or step2 * det < rel_tol2 * (h11 + h22):
+            break
 
-    idx_sort = np.argsort(dists)
-    sel_idx = list(idx_sort[:3])
-    if len(idx_sort) > 3:
-        sel_idx.append(idx_sort[-1])
+    GN_ITERATIONS.observe(it)
+    xy = np.array([x, y])
+    if not det > GN_MIN_REL_DET * (h11 + h22) ** 2 or not math.isfinite(det):
+        return xy, np.eye(2) * GN_DEGENERATE_VAR
+    cov = np.array([[h22, -h12], [-h12, h11]]) / det
+    return xy, cov
+
+def heard_arrays(rssi_dict: dict[str, float], snap: BeaconSnapshot) -> tuple[np.ndarray, np.ndarray]:
+    """{имя: rssi} -> индексы известных маяков в снимке и их RSSI."""
+    idx = snap.lookup(rssi_dict.keys())
+    known = idx >= 0
+    rssi = np.fromiter(rssi_dict.values(), dtype=np.float64, count=len(known))[known]
+    return idx[known], rssi
+
+def robust_wls(rssi_dict: dict[str, float], snap: Optional[BeaconSnapshot] = None,
+               near=None) -> tuple[Optional[Position], Optional[np.ndarray]]:
+    if snap is None:
+        snap = registry.snapshot()
+    return solve_wls(*heard_arrays(rssi_dict, snap), snap, near)
+
+def solve_wls(idx: np.ndarray, rssi: np.ndarray, snap: BeaconSnapshot,
+              near=None) -> tuple[Optional[Position], Optional[np.ndarray]]:
+    """
+    idx - индексы услышанных маяков в снимке, rssi - их измерения.
+    near - последняя известная (предсказанная) позиция платы; если задана,
+    маяки выбираются через пространственный индекс вокруг неё, а Гаусс-Ньютон
+    стартует из неё (с остановом по GN_WARM_REL_TOL) вместо центра выбранных маяков.
+    """
+    if len(idx) < 3:
+        return None, None
+    rssi = np.asarray(rssi, dtype=np.float64)
+
+    beacons = snap.xy[idx]
+    dists = rssi_to_distance(rssi, snap.rssi0[idx], snap.n[idx])
+    vars_ = var_distance_from_rssi(dists, snap.n[idx], snap.sigma[idx])
+
+    if near is not None:
+        sel_idx = spatial_index.select_candidates(snap, idx, dists, vars_, near)
+        if sel_idx is None:
+            return None, None
+    else:
+        on_floor = np.flatnonzero(spatial_index.same_floor(snap, idx, dists))
+        if len(on_floor) < 3:
+            return None, None
+        idx_sort = on_floor[np.argsort(dists[on_floor])]
+        sel_idx = list(idx_sort[:3])
+        if len(idx_sort) > 3:
+            sel_idx.append(idx_sort[-1])
 
     beacons = beacons[sel_idx]
     dists = dists[sel_idx]
     vars_ = vars_[sel_idx]
 
-    x = np.mean(beacons[:, 0])
-    y = np.mean(beacons[:, 1])
-
-    for _ in range(10):
-        A = []
-        b_vec = []
-        for (bx, by), di in zip(beacons, dists):
-            r_est = math.hypot(x - bx, y - by)
-            if r_est < 1e-6:
-                r_est = 1e-6
-            A.append([(x - bx) / r_est, (y - by) / r_est])
-            b_vec.append(di - r_est)
-
-        A = np.array(A)
-        b_vec = np.array(b_vec)
-
-        w = 1.0 / vars_
-        sigma = np.std(b_vec) if np.std(b_vec) > 1e-3 else 1.0
-        c = 1.5 * sigma
-        for i in range(len(b_vec)):
-            if abs(b_vec[i]) > c:
-                w[i] *= c / abs(b_vec[i])
-
-        W = np.diag(w)
-        AtW = A.T @ W
-        H = AtW @ A
-        g = AtW @ b_vec
-
-        try:
-            dx = np.linalg.solve(H, g)
-        except np.linalg.LinAlgError:
-            break
-
-        x += dx[0]
-        y += dx[1]
-
-        if np.linalg.norm(dx) < 1e-3:
+    if near is not None:
+        xy, cov = gauss_newton(beacons, dists, vars_, np.asarray(near, dtype=np.float64),
+                               rel_tol=GN_WARM_REL_TOL)
+    else:
+        xy, cov = gauss_newton(beacons, dists, vars_, beacons.mean(axis=0))
+    return Position(float(xy[0]), float(xy[1])), cov
+
+def fingerprint_locate(rssi_dict: dict[str, float], snap: Optional[BeaconSnapshot] = None,
+                       near=None) -> tuple[Optional[Position], Optional[np.ndarray]]:
+    """То же, что robust_wls, но по сетке отпечатков (см. fingerprint)."""
+    if snap is None:
+        snap = registry.snapshot()
+    return solve_fingerprint(*heard_arrays(rssi_dict, snap), snap, near)
+
+def solve_fingerprint(idx: np.ndarray, rssi: np.ndarray, snap: BeaconSnapshot,
+                      near=None) -> tuple[Optional[Position], Optional[np.ndarray]]:
+    if len(idx) < 3:
+        return None, None
+    xy, cov = fingerprint.match(snap, idx, np.asarray(rssi, dtype=np.float64), near)
+    if xy is None:
+        return None, None
+    return Position(float(xy[0]), float(xy[1])), cov
+
+# решатели по массивам (idx, rssi, snap, near)
+ENGINES = {WLS: solve_wls, FINGERPRINT: solve_fingerprint}
+ALL_ENGINES = sorted([*ENGINES, PARTICLE])
+
+def rssi_matrix(snapshots: List[dict[str, float]], snap: Optional[BeaconSnapshot] = None) -> np.ndarray:
+    """
+    Собирает матрицу RSSI (N x K) в порядке маяков снимка реестра.
+    Неуслышанные и неизвестные маяки -> NaN.
+    """
+    if snap is None:
+        snap = registry.snapshot()
+    out = np.full((len(snapshots), len(snap)), np.nan)
+    index = snap.index
+    for row, rssi_dict in zip(out, snapshots):
+        for name, rssi in rssi_dict.items():
+            j = index.get(name)
+            if j is not None:
+                row[j] = rssi
+    return out
+
+
+def gauss_newton_batch(beacons: np.ndarray, dists: np.ndarray, vars_: np.ndarray, mask: np.ndarray,
+                       x0: np.ndarray, max_iter: int = GN_MAX_ITER,
+                       tol: float = GN_TOL) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Пакетный вариант gauss_newton.
+    beacons (N,m,2), dists/vars_/mask (N,m), x0 (N,2) -> позиции (N,2), ковариации (N,2,2).
+    Пустые слоты помечаются mask=False. Каждая строка останавливается независимо;
+    для строк с вырожденной матрицей ковариация GN_DEGENERATE_VAR * I, как в gauss_newton,
+    для строк с менее чем тремя маяками - NaN.
+    """
+    bx = beacons[..., 0]
+    by = beacons[..., 1]
+    maskf = mask.astype(np.float64)
+    cnt = np.maximum(maskf.sum(axis=1), 1.0)
+    w0 = np.where(mask, 1.0 / np.where(mask, vars_, 1.0), 0.0)
+    dists = np.where(mask, dists, 0.0)
+
+    x = x0[:, 0].copy()
+    y = x0[:, 1].copy()
+    h11 = np.zeros(len(x))
+    h12 = np.zeros(len(x))
+    h22 = np.zeros(len(x))
+    det = np.zeros(len(x))
+    active = mask.sum(axis=1) >= 3
+
+    for _ in range(max_iter):
+        if not active.any():
             break
-
-    cov = np.linalg.inv(H)
-    return Position(x, y), cov
-
-class EKF:
-    def __init__(self, dt: float = 0.1):
-        self.dt = dt
-        self.x = np.zeros((4, 1))
-        self.P = np.eye(4) * 100.0
-        self.Q = np.diag([0.1, 0.1, 1.0, 1.0])
-        self.H = np.array([[1, 0, 0, 0],
-                           [0, 1, 0, 0]])
-        self.R = np.eye(2) * 2.0
-
-    def predict(self):
-        dt = self.dt
-        F = np.array([
-            [1, 0, dt, 0],
-            [0, 1, 0, dt],
-            [0, 0, 1, 0],
-            [0, 0, 0, 1]
-        ])
-        self.x = F @ self.x
-        self.P = F @ self.P @ F.T + self.Q
-
-    def update(self, z: np.ndarray, R: np.ndarray = None):
-        if R is not None:
-            self.R = R
-        y = z.reshape(2, 1) - self.H @ self.x
-        S = self.H @ self.P @ self.H.T + self.R
-        K = self.P @ self.H.T @ np.linalg.inv(S)
-        self.x = self.x + K @ y
-        self.P = (np.eye(4) - K @ self.H) @ self.P
-
-    def get_state(self) -> tuple[float, float]:
-        return float(self.x[0, 0]), float(self.x[1, 0])
-
-ekf = EKF(dt=0.1)
-
-def locate_from_rssi(rssi_dict: dict[str, float]) -> tuple[float, float]:
-    ekf.predict()
-    pos, cov = robust_wls(rssi_dict)
+        ex = x[:, None] - bx
+        ey = y[:, None] - by
+        r = np.hypot(ex, ey)
+        np.maximum(r, 1e-6, out=r)
+        ax = ex / r
+        ay = ey / r
+        res = (dists - r) * maskf
+
+        mean = res.sum(axis=1) / cnt
+        sigma = np.sqrt((((res - mean[:, None]) * maskf) ** 2).sum(axis=1) / cnt)
+        c = 1.5 * np.where(sigma > 1e-3, sigma, 1.0)
+        w = w0 * np.minimum(1.0, c[:, None] / np.maximum(np.abs(res), 1e-12))
+
+        wax = w * ax
+        way = w * ay
+        n11 = (wax * ax).sum(axis=1)
+        n12 = (wax * ay).sum(axis=1)
+        n22 = (way * ay).sum(axis=1)
+        g1 = (wax * res).sum(axis=1)
+        g2 = (way * res).sum(axis=1)
+        ndet = n11 * n22 - n12 * n12
+
+        h11 = np.where(active, n11, h11)
+        h12 = np.where(active, n12, h12)
+        h22 = np.where(active, n22, h22)
+        det = np.where(active, ndet, det)
+
+        ok = active & (ndet > GN_MIN_REL_DET * (n11 + n22) ** 2) & np.isfinite(ndet)
+        safe = np.where(ok, ndet, 1.0)
+        dx = np.where(ok, (n22 * g1 - n12 * g2) / safe, 0.0)
+        dy = np.where(ok, (n11 * g2 - n12 * g1) / safe, 0.0)
+        x += dx
+        y += dy
+
+        active = ok & (np.hypot(dx, dy) >= tol)
+
+    solved = mask.sum(axis=1) >= 3
+    good = solved & (det > GN_MIN_REL_DET * (h11 + h22) ** 2) & np.isfinite(det)
+    safe = np.where(good, det, 1.0)
+    cov = np.stack([np.stack([h22, -h12], axis=-1),
+                    np.stack([-h12, h11], axis=-1)], axis=-2) / safe[:, None, None]
+    cov[solved & ~good] = np.eye(2) * GN_DEGENERATE_VAR
+    cov[~solved] = np.nan
+
+    xy = np.stack([x, y], axis=-1)
+    xy[~solved] = np.nan
+    return xy, cov
+
+
+def robust_wls_batch(rssi: np.ndarray,
+                     snap: Optional[BeaconSnapshot] = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    robust_wls для N снимков сразу.
+    rssi (N x K) в порядке маяков снимка (см. rssi_matrix), NaN - маяк не слышен.
+    Возвращает позиции (N,2) и ковариации (N,2,2); NaN, если маяков меньше трёх.
+    Как и solve_wls, план этажа не учитывает: позиции переносятся отдельным
+    шагом constrain_to_map(fix_floors(rssi, snap), xy).
+    """
+    if snap is None:
+        snap = registry.snapshot()
+    rssi = np.atleast_2d(np.asarray(rssi, dtype=np.float64))
+    heard = ~np.isnan(rssi)
+    count = heard.sum(axis=1)
+
+    dists = rssi_to_distance(rssi, snap.rssi0, snap.n)
+    vars_ = var_distance_from_rssi(dists, snap.n, snap.sigma)
+
+    # только маяки этажа самого близкого маяка
+    closest = np.argmin(np.where(heard, dists, np.inf), axis=1)
+    heard &= snap.floor[None, :] == snap.floor[closest][:, None]
+    count = heard.sum(axis=1)
+
+    # 3 ближайших + самый дальний, как в robust_wls
+    nearest = np.argsort(np.where(heard, dists, np.inf), axis=1)[:, :3]
+    farthest = np.argmax(np.where(heard, dists, -np.inf), axis=1)
+    sel = np.concatenate([nearest, farthest[:, None]], axis=1)
+    mask = np.take_along_axis(heard, sel, axis=1)
+    mask[:, 3] &= count > 3
+
+    beacons = snap.xy[sel]
+    sel_dists = np.take_along_axis(dists, sel, axis=1)
+    sel_vars = np.take_along_axis(vars_, sel, axis=1)
+
+    maskf = mask[..., None].astype(np.float64)
+    x0 = (beacons * maskf).sum(axis=1) / np.maximum(maskf.sum(axis=1), 1.0)
+    return gauss_newton_batch(beacons, sel_dists, sel_vars, mask, x0)
+
+def fix_floors(rssi: np.ndarray, snap: BeaconSnapshot) -> np.ndarray:
+    """Этаж решения для строк матрицы RSSI (N x K): этаж самого сильного маяка, как в locate_heard."""
+    rssi = np.atleast_2d(np.asarray(rssi, dtype=np.float64))
+    return snap.floor[np.argmax(np.where(np.isnan(rssi), -np.inf, rssi), axis=1)]
+
+def heard_floor(idx: np.ndarray, rssi: np.ndarray, snap: BeaconSnapshot) -> int:
+    """Этаж решения: этаж самого сильного услышанного маяка."""
+    return int(snap.floor[idx[np.argmax(rssi)]])
+
+def constrain_to_map(floor, xy):
+    """
+    Перенос решения в проходимую область плана этажа (см. floor_map).
+    Общий шаг после решателя для одиночного и пакетного пути:
+    floor - этаж и xy (x, y) или floor (N,) и xy (N,2); строки NaN не меняются.
+    """
+    maps = floor_map.get_maps() if floor_map.ENABLED else None
+    if not maps:
+        return xy
+    if np.ndim(floor) == 0:
+        return maps.project_point(int(floor), xy)
+    xy = np.array(xy, dtype=np.float64)
+    ok = ~np.isnan(xy[:, 0])
+    xy[ok] = maps.project(np.asarray(floor)[ok], xy[ok])
+    return xy
+
+def locate_from_rssi(rssi_dict: dict[str, float],
+                     board_id: str = trackers.DEFAULT_BOARD_ID,
+                     ts: Optional[float] = None) -> Optional[tuple[float, float]]:
+    snap = registry.snapshot()
+    return locate_heard(*heard_arrays(rssi_dict, snap), snap, board_id, ts)
+
+def locate_heard(idx: np.ndarray, rssi: np.ndarray, snap: BeaconSnapshot,
+                 board_id: str = trackers.DEFAULT_BOARD_ID,
+                 ts: Optional[float] = None) -> Optional[tuple[float, float]]:
+    """
+    locate_from_rssi по уже разобранным массивам (см. heard_arrays, wire).
+    None - у платы ещё нет оценки (фильтр частиц не получил трёх маяков одного этажа).
+    RSSI сглаживаются, а решение проверяется по скорости (см. rssi_filter).
+    Решение переносится в проходимую область плана, а движение трекера
+    через стену отклоняется (см. floor_map).
+    """
+    if ts is None:
+        ts = time.time()
+    if ENGINE == PARTICLE:
+        return locate_particles(idx, rssi, snap, board_id, ts)
+    had_track = board_id in trackers.pool
+    with metrics.timer(PREDICT_TIME):
+        trackers.pool.predict(board_id, ts)
+    prev = trackers.pool.get_prior(board_id) if had_track else None
+    near = trackers.pool.get_state(board_id) if had_track else None
+    solve_rssi = rssi
+    if rssi_filter.ENABLED:
+        solve_rssi = rssi_filter.pool.smooth(board_id, ts, idx, rssi, snap)
+    with metrics.timer(SOLVE_TIME):
+        pos, cov = ENGINES[ENGINE](idx, solve_rssi, snap, near)
+    if pos is not None and rssi_filter.ENABLED and not rssi_filter.pool.accept_fix(board_id, ts, pos.x, pos.y):
+        pos = None
     if pos is not None:
         R = cov if cov is not None else np.eye(2) * 5.0
-        ekf.update(np.array([pos.x, pos.y]), R=R)
-    return ekf.get_state()
-
-def get_board_pos(data: List[StationRssi]) -> Optional[Position]:
+        fl = heard_floor(idx, rssi, snap)
+        z = constrain_to_map(fl, (pos.x, pos.y))
+        maps = floor_map.get_maps() if floor_map.ENABLED else None
+        with metrics.timer(UPDATE_TIME):
+            trackers.pool.update(board_id, np.array(z), R)
+        if maps and prev is not None:
+            moved = trackers.pool.get_state(board_id)
+            if maps.crosses_segment(fl, prev, moved) and \
+                    trackers.pool.get_holds(board_id) < floor_map.MAX_WALL_HOLDS:
+                trackers.pool.hold(board_id, prev)
+                WALL_HOLDS.inc()
+            else:
+                trackers.pool.release(board_id)
+        if calibration.AUTO_CALIBRATE and trackers.pool.get_position_var(board_id) <= calibration.TRACK_MAX_VAR:
+            calibration.calibrator.submit(snap, idx, rssi, trackers.pool.get_state(board_id))
+    return trackers.pool.get_state(board_id)
+
+def predict_ahead(board_ids: list[str], ts: list[float]):
+    """
+    Шаг EKF сразу для плат из пачки сообщений воркера, каждая к времени
+    своего первого сообщения; locate_heard этот шаг не повторяет.
+    Новые платы пропускаются: предсказывать им нечего.
+    """
+    if ENGINE == PARTICLE:
+        return
+    tracked = [i for i, b in enumerate(board_ids) if b in trackers.pool]
+    if tracked:
+        with metrics.timer(PREDICT_TIME):
+            trackers.pool.predict_many([board_ids[i] for i in tracked], np.asarray(ts)[tracked])
+
+def locate_particles(idx: np.ndarray, rssi: np.ndarray, snap: BeaconSnapshot,
+                     board_id: str, ts: float) -> Optional[tuple[float, float]]:
+    """
+    locate_heard для AKL_ENGINE=particle: сырые RSSI сразу в фильтр частиц.
+    Без трёх маяков этажа фильтр не обновляется: возвращается прежняя
+    оценка платы или None, если её ещё нет.
+    """
+    with metrics.timer(SOLVE_TIME):
+        res = particle_filter.pool.step(board_id, ts, idx, rssi, snap)
+    if res is not None and calibration.AUTO_CALIBRATE and \
+            particle_filter.pool.get_position_var(board_id) <= calibration.TRACK_MAX_VAR:
+        calibration.calibrator.submit(snap, idx, rssi, particle_filter.pool.get_state(board_id))
+    return particle_filter.pool.get_state(board_id)
+
+def get_board_pos(data: List[StationRssi],
+                  board_id: str = trackers.DEFAULT_BOARD_ID,
+                  ts: Optional[float] = None) -> Optional[Position]:
     if len(data) < 3:
         return None
     rssi_dict = {s.name: s.rssi for s in data}
-    x, y = locate_from_rssi(rssi_dict)
-    return Position(x, y)
+    xy = locate_from_rssi(rssi_dict, board_id, ts)
+    if xy is None:
+        return None
+    return Position(*xy)
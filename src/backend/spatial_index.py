@@ -0,0 +1,140 @@
+import math
+import threading
+from functools import lru_cache
+from itertools import combinations
+from typing import Optional
+
+import numpy as np
+
+from beacon_registry import BeaconSnapshot
+
+# размер ячейки сетки (м)
+GRID_CELL = 10.0
+# радиус поиска маяков вокруг последней позиции платы (м)
+SEARCH_RADIUS = 30.0
+# допустимое расхождение расстояния по RSSI и геометрии: GATE_ABS + GATE_REL * d
+GATE_ABS = 10.0
+GATE_REL = 3.0
+# из скольких ближайших маяков выбирается подмножество для решения
+MAX_CANDIDATES = 5
+SUBSET_SIZE = 4
+
+
+class GridIndex():
+    """
+    Равномерная сетка по маякам, отдельно для каждого этажа.
+    Запрос по радиусу обходит только соседние ячейки,
+    поэтому его цена не зависит от общего числа маяков.
+    """
+
+    def __init__(self, xy: np.ndarray, floor: np.ndarray, cell: float = GRID_CELL):
+        self.xy = xy
+        self.floor = floor
+        self.cell = cell
+        cells: dict[tuple[int, int, int], list[int]] = {}
+        keys = np.floor(xy / cell).astype(np.int64)
+        for i, ((cx, cy), fl) in enumerate(zip(keys.tolist(), floor.tolist())):
+            cells.setdefault((fl, cx, cy), []).append(i)
+        self._cells = {k: np.array(v, dtype=np.intp) for k, v in cells.items()}
+
+    def query_radius(self, center, radius: float, floor: Optional[int] = None) -> np.ndarray:
+        cx, cy = float(center[0]), float(center[1])
+        r = int(math.ceil(radius / self.cell))
+        ix, iy = int(math.floor(cx / self.cell)), int(math.floor(cy / self.cell))
+        floors = [floor] if floor is not None else sorted(set(self.floor.tolist()))
+        parts = []
+        for fl in floors:
+            for gx in range(ix - r, ix + r + 1):
+                for gy in range(iy - r, iy + r + 1):
+                    cell = self._cells.get((fl, gx, gy))
+                    if cell is not None:
+                        parts.append(cell)
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        idx = np.concatenate(parts)
+        d = np.hypot(self.xy[idx, 0] - cx, self.xy[idx, 1] - cy)
+        return idx[d <= radius]
+
+
+_cache_lock = threading.Lock()
+_cache: Optional[tuple[int, GridIndex]] = None
+
+
+def get_index(snap: BeaconSnapshot) -> GridIndex:
+    """Индекс строится один раз на версию реестра."""
+    global _cache
+    cached = _cache
+    if cached is not None and cached[0] == snap.version:
+        return cached[1]
+    with _cache_lock:
+        if _cache is None or _cache[0] != snap.version:
+            _cache = (snap.version, GridIndex(snap.xy, snap.floor))
+        return _cache[1]
+
+
+@lru_cache(maxsize=32)
+def _combinations(m: int, k: int) -> np.ndarray:
+    return np.array(list(combinations(range(m), k)), dtype=np.intp)
+
+
+def same_floor(snap: BeaconSnapshot, idx: np.ndarray, dists: np.ndarray) -> np.ndarray:
+    """Маска маяков на этаже самого близкого (по RSSI) маяка."""
+    floors = snap.floor[idx]
+    return floors == floors[np.argmin(dists)]
+
+
+def best_subset(beacons: np.ndarray, vars_: np.ndarray, ref: np.ndarray, size: int = SUBSET_SIZE) -> np.ndarray:
+    """
+    Подмножество маяков с наименьшей ожидаемой дисперсией позиции
+    (взвешенный GDOP: trace((A^T W A)^-1)) относительно точки ref.
+    """
+    m = len(beacons)
+    size = min(size, m)
+    d = beacons - ref
+    r = np.maximum(np.hypot(d[:, 0], d[:, 1]), 1e-6)
+    ux = d[:, 0] / r
+    uy = d[:, 1] / r
+    w = 1.0 / vars_
+
+    combos = _combinations(m, size)
+    wc = w[combos]
+    uxc = ux[combos]
+    uyc = uy[combos]
+    h11 = (wc * uxc * uxc).sum(axis=1)
+    h12 = (wc * uxc * uyc).sum(axis=1)
+    h22 = (wc * uyc * uyc).sum(axis=1)
+    det = h11 * h22 - h12 * h12
+    dop = np.where(det > 1e-12, (h11 + h22) / np.where(det > 1e-12, det, 1.0), np.inf)
+    return combos[np.argmin(dop)]
+
+
+def select_candidates(snap: BeaconSnapshot, idx: np.ndarray, dists: np.ndarray, vars_: np.ndarray,
+                      near) -> Optional[np.ndarray]:
+    """
+    Выбор маяков для решения вокруг последней известной позиции near.
+    Отбрасывает маяки с другого этажа, вне SEARCH_RADIUS и те, чьё расстояние
+    по RSSI не согласуется с геометрией; из MAX_CANDIDATES ближайших
+    оставшихся берёт подмножество с наименьшим GDOP.
+    Возвращает локальные индексы (в idx) или None, если подходящих меньше трёх.
+    """
+    near = np.asarray(near, dtype=np.float64)
+    floors = snap.floor[idx]
+    floor = int(floors[np.argmin(dists)])
+    keep = floors == floor
+
+    # оба массива короткие (услышанные маяки и маяки в радиусе) - без массива размером с реестр
+    hits = get_index(snap).query_radius(near, SEARCH_RADIUS, floor)
+    in_area = keep & np.isin(idx, hits)
+    geo = np.hypot(snap.xy[idx, 0] - near[0], snap.xy[idx, 1] - near[1])
+    consistent = in_area & (np.abs(geo - dists) <= GATE_ABS + GATE_REL * dists)
+
+    for mask in (consistent, in_area, keep):
+        if mask.sum() >= 3:
+            break
+    else:
+        return None
+
+    local = np.flatnonzero(mask)
+    local = local[np.argsort(dists[local])[:MAX_CANDIDATES]]
+    subset = best_subset(snap.xy[idx[local]], vars_[local], near, SUBSET_SIZE)
+    return local[subset]
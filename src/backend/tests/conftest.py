@@ -0,0 +1,14 @@
+"""
+Тесты запускаются из src/backend:
+    python -m pytest -q tests
+
+База - временный файл (bench.scratch_db): data.db не трогается.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.scratch_db import use_scratch_db  # noqa: E402
+
+use_scratch_db()
@@ -0,0 +1,46 @@
+from live import FixBuffer
+
+
+def test_ids_increase():
+    buf = FixBuffer(10)
+    ids = [buf.append("a", float(i), i, i) for i in range(5)]
+    assert ids == [1, 2, 3, 4, 5]
+    assert buf.last_id == 5
+
+
+def test_since():
+    buf = FixBuffer(10)
+    for i in range(5):
+        buf.append("a" if i % 2 else "b", float(i), i, i)
+    assert [item["id"] for item in buf.since(0)] == [1, 2, 3, 4, 5]
+    assert [item["id"] for item in buf.since(3)] == [4, 5]
+    assert buf.since(5) == []
+    assert buf.last_fix("a")["id"] == 4
+
+
+def test_since_cursor_older_than_buffer():
+    buf = FixBuffer(3)
+    for i in range(5):
+        buf.append("a", float(i), i, i)
+    # 1 и 2 вытеснены: за ними нужно идти в базу
+    assert buf.since(0) is None
+    assert buf.since(1) is None
+    assert [item["id"] for item in buf.since(2)] == [3, 4, 5]
+
+
+def test_extend_with_gaps():
+    buf = FixBuffer(10)
+    buf.reset_ids(100)
+    buf.extend([{"id": i, "board": "a", "ts": 0.0, "x": 0.0, "y": 0.0} for i in (100, 103, 107)])
+    assert [item["id"] for item in buf.since(101)] == [103, 107]
+    assert buf.since(98) is None
+    assert buf.append("a", 1.0, 0.0, 0.0) == 108
+
+
+def test_clear_keeps_ids():
+    buf = FixBuffer(10)
+    buf.append("a", 0.0, 0.0, 0.0)
+    buf.clear()
+    assert buf.since(1) == []
+    assert buf.append("a", 1.0, 0.0, 0.0) == 2
+    assert buf.last_fix("a")["id"] == 2
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from data import db, route_store
+
+
+def add_positions(route_id: int, points):
+    """points: (board, ts, x, y) -> id новых строк BoardPosition."""
+    with db.session_scope() as session:
+        rows = [db.BoardPosition(route_id=route_id, board_id=board, time=datetime.fromtimestamp(ts), x=x, y=y)
+                for board, ts, x, y in points]
+        session.add_all(rows)
+        session.flush()
+        return [row.id for row in rows]
+
+
+def make_points(n: int, t0: float = 1.7e9):
+    return [("ab" if i % 3 else "cd", t0 + i * 0.5, i * 1.25, -i * 0.5) for i in range(n)]
+
+
+@pytest.mark.parametrize("encoding", [route_store.RAW, route_store.DELTA])
+def test_compact_round_trip(encoding):
+    route_id = db.create_route()
+    points = make_points(20)
+    add_positions(route_id, points)
+    before = {b: t.to_dict() for b, t in route_store.load_route(route_id).items()}
+    cursor = route_store.positions_after(0, route_id)
+
+    db.finish_route(route_id)
+    assert route_store.compact_route(route_id, encoding) == len(points)
+
+    after = route_store.load_route(route_id)
+    assert set(after) == set(before)
+    for board, track in after.items():
+        ref = before[board]
+        assert track.t0 == pytest.approx(ref["t0"])
+        np.testing.assert_allclose(track.x, ref["x"], atol=1e-4)
+        np.testing.assert_allclose(track.y, ref["y"], atol=1e-4)
+        np.testing.assert_allclose(track.t, ref["t"], atol=1e-4)
+    # курсор клиента работает и по сжатому маршруту
+    assert [p["id"] for p in route_store.positions_after(0, route_id)] == [p["id"] for p in cursor]
+    mid = cursor[len(cursor) // 2]["id"]
+    assert [p["id"] for p in route_store.positions_after(mid, route_id)] == [p["id"] for p in cursor if p["id"] > mid]
+
+
+def test_compact_twice_appends():
+    route_id = db.create_route()
+    first = add_positions(route_id, make_points(6))
+    route_store.compact_route(route_id)
+    # точки, пришедшие после первого сжатия
+    second = add_positions(route_id, make_points(4, t0=1.7e9 + 100))
+    assert route_store.compact_route(route_id) == 4
+
+    tracks = route_store.load_route(route_id)
+    assert sum(len(t) for t in tracks.values()) == 10
+    ids = np.sort(np.concatenate([t.ids for t in tracks.values()]))
+    np.testing.assert_array_equal(ids, sorted(first + second))
+    assert [p["id"] for p in route_store.positions_after(0, route_id)] == sorted(first + second)
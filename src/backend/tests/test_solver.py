@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import rssi_position
+from beacon_registry import registry
+
+
+def make_cases(n: int, seed: int = 0):
+    """Случайные снимки RSSI по лог-дистанционной модели: {имя: rssi}."""
+    snap = registry.snapshot()
+    rng = np.random.default_rng(seed)
+    lo = snap.xy.min(axis=0)
+    hi = snap.xy.max(axis=0)
+    cases = []
+    for _ in range(n):
+        k = int(rng.integers(3, min(8, len(snap)) + 1))
+        sel = rng.choice(len(snap), size=k, replace=False)
+        true = rng.uniform(lo, hi)
+        d = np.hypot(*(snap.xy[sel] - true).T)
+        rssi = snap.rssi0[sel] - 10 * snap.n[sel] * np.log10(np.maximum(d, 0.1))
+        rssi += rng.normal(0, snap.sigma[sel])
+        cases.append({snap.names[j]: float(r) for j, r in zip(sel, rssi)})
+    return cases
+
+
+def test_gauss_newton_batch_matches_single():
+    rng = np.random.default_rng(1)
+    n, m = 200, 4
+    beacons = rng.uniform(-20, 20, (n, m, 2))
+    true = rng.uniform(-15, 15, (n, 2))
+    dists = np.hypot(*(beacons - true[:, None, :]).transpose(2, 0, 1)) + rng.normal(0, 0.5, (n, m))
+    dists = np.abs(dists) + 0.1
+    vars_ = rng.uniform(0.2, 2.0, (n, m))
+    mask = np.ones((n, m), dtype=bool)
+    mask[::3, 3] = False
+    x0 = (beacons * mask[..., None]).sum(axis=1) / mask.sum(axis=1)[:, None]
+
+    xy, cov = rssi_position.gauss_newton_batch(beacons, dists, vars_, mask, x0)
+    for i in range(n):
+        sel = mask[i]
+        ref_xy, ref_cov = rssi_position.gauss_newton(beacons[i, sel], dists[i, sel], vars_[i, sel], x0[i])
+        np.testing.assert_allclose(xy[i], ref_xy, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(cov[i], ref_cov, rtol=1e-9, atol=1e-12)
+
+
+def test_gauss_newton_batch_too_few_beacons():
+    beacons = np.zeros((1, 4, 2))
+    mask = np.array([[True, True, False, False]])
+    xy, cov = rssi_position.gauss_newton_batch(beacons, np.ones((1, 4)), np.ones((1, 4)), mask, np.zeros((1, 2)))
+    assert np.isnan(xy).all()
+    assert np.isnan(cov).all()
+
+
+def test_robust_wls_batch_matches_single():
+    snap = registry.snapshot()
+    if len(snap) < 3:
+        pytest.skip("в beacons.txt меньше трёх маяков")
+    cases = make_cases(300)
+    xy, cov = rssi_position.robust_wls_batch(rssi_position.rssi_matrix(cases, snap), snap)
+    for i, rssi in enumerate(cases):
+        pos, ref_cov = rssi_position.robust_wls(rssi, snap)
+        if pos is None:
+            assert np.isnan(xy[i]).all()
+            continue
+        np.testing.assert_allclose(xy[i], [pos.x, pos.y], rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(cov[i], ref_cov, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,60 @@
+from trackers import SlotAllocator
+
+
+def make_allocator(capacity: int = 3, ttl: float = 10.0):
+    resets = []
+    releases = []
+    return SlotAllocator(capacity, ttl, resets.append, releases.append), resets, releases
+
+
+def test_slots_are_reused():
+    alloc, resets, _ = make_allocator()
+    a = alloc.slot("a", 0.0)
+    assert alloc.slot("a", 1.0) == a
+    assert resets == [a]
+    assert alloc.get("b") is None
+
+
+def test_lru_eviction_when_full():
+    alloc, _, releases = make_allocator()
+    slots = {b: alloc.slot(b, t) for t, b in enumerate("abc")}
+    # обращение к "a" делает самой давней "b"
+    alloc.slot("a", 3.0)
+    d = alloc.slot("d", 4.0)
+    assert "b" not in alloc
+    assert releases == [slots["b"]]
+    assert d == slots["b"]
+    assert len(alloc) == 3
+
+
+def test_idle_boards_evicted_before_lru():
+    alloc, _, releases = make_allocator(ttl=10.0)
+    alloc.slot("a", 0.0)
+    b = alloc.slot("b", 1.0)
+    alloc.slot("c", 2.0)
+    # "a" самая давняя, но "b" молчит дольше ttl - освобождается только она
+    alloc.slot("a", 11.5)
+    alloc.slot("d", 11.5)
+    assert "b" not in alloc
+    assert "a" in alloc and "c" in alloc
+    assert releases == [b]
+
+
+def test_evict_idle():
+    alloc, _, releases = make_allocator(ttl=5.0)
+    a = alloc.slot("a", 0.0)
+    alloc.slot("b", 4.0)
+    assert alloc.evict_idle(6.0) == 1
+    assert "a" not in alloc and "b" in alloc
+    assert releases == [a]
+    # освобождённый слот выдаётся снова
+    assert alloc.slot("c", 6.0) == a
+
+
+def test_release():
+    alloc, _, releases = make_allocator()
+    a = alloc.slot("a", 0.0)
+    alloc.release("a")
+    alloc.release("a")
+    assert releases == [a]
+    assert len(alloc) == 0
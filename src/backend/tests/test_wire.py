@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import wire
+
+
+def test_round_trip():
+    board = bytes.fromhex("a1b2c3d4e5f6")
+    beacons = np.array([1, 7, 300, 65535])
+    rssi = np.array([-40.4, -71.6, -128.0, -99.0])
+    packet = wire.decode(wire.encode(board, 42, 1700000000.123, beacons, rssi))
+    assert packet.board_id == "a1b2c3d4e5f6"
+    assert packet.seq == 42
+    assert packet.ts == pytest.approx(1700000000.123, abs=1e-6)
+    np.testing.assert_array_equal(packet.beacons, beacons)
+    np.testing.assert_array_equal(packet.rssi, [-40, -72, -128, -99])
+
+
+def test_round_trip_without_ts():
+    packet = wire.decode(wire.encode(bytes(6), 2 ** 32 + 5, None, [], []))
+    assert packet.ts is None
+    assert packet.seq == 5
+    assert len(packet.beacons) == 0
+
+
+def test_rssi_is_clipped():
+    packet = wire.decode(wire.encode(bytes(6), 0, 1.0, [1, 2], [-200, 50]))
+    np.testing.assert_array_equal(packet.rssi, [-128, 50])
+
+
+def test_decode_rejects_bad_payload():
+    payload = wire.encode(bytes(6), 1, 1.0, [1, 2], [-50, -60])
+    with pytest.raises(ValueError):
+        wire.decode(payload[:5])
+    with pytest.raises(ValueError):
+        wire.decode(payload[:-1])
+    with pytest.raises(ValueError):
+        wire.decode(bytes([wire.WIRE_VERSION + 1]) + payload[1:])
+
+
+def test_topic_bucket():
+    board_id = "a1b2c3d4e5f6"
+    assert wire.topic_bucket(wire.board_topic(board_id)) == wire.shard_bucket(board_id)
+    assert wire.topic_bucket(f"{wire.TOPIC}/{board_id}") is None
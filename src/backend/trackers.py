@@ -0,0 +1,280 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Optional
+
+import numpy as np
+
+DEFAULT_BOARD_ID = "default"
+
+# число одновременно отслеживаемых плат и время жизни трекера без сообщений (сек)
+MAX_TRACKERS = 1024
+TRACKER_TTL = 300.0
+
+# шум процесса на секунду; при dt=0.1 даёт прежнюю Q = diag(0.1, 0.1, 1, 1)
+Q_RATE = np.diag([1.0, 1.0, 10.0, 10.0])
+P0 = np.eye(4) * 100.0
+# больший разрыв между сообщениями считается потерей связи
+MAX_DT = 10.0
+
+
+@lru_cache(maxsize=256)
+def _motion_model(dt_ms: int) -> tuple[np.ndarray, np.ndarray]:
+    dt = dt_ms / 1000.0
+    F = np.array([
+        [1, 0, dt, 0],
+        [0, 1, 0, dt],
+        [0, 0, 1, 0],
+        [0, 0, 0, 1]
+    ], dtype=np.float64)
+    Q = Q_RATE * dt
+    F.setflags(write=False)
+    Q.setflags(write=False)
+    return F, Q
+
+
+def motion_model(dt: float) -> tuple[np.ndarray, np.ndarray]:
+    """F и Q для интервала dt (сек); кэшируется с точностью до мс."""
+    return _motion_model(int(round(min(max(dt, 0.0), MAX_DT) * 1000)))
+
+
+class SlotAllocator():
+    """
+    Строки массивов состояний по платам: плата -> слот в порядке LRU.
+    Слоты выдаются лениво; при заполнении сначала освобождаются платы,
+    молчащие дольше ttl, затем самая давняя. on_reset(slot) готовит строку
+    для новой платы, on_release(slot) вызывается при освобождении.
+    Общий для TrackerPool, rssi_filter.FilterPool и particle_filter.ParticlePool.
+    """
+
+    def __init__(self, capacity: int, ttl: float, on_reset: Callable[[int], None],
+                 on_release: Optional[Callable[[int], None]] = None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.on_reset = on_reset
+        self.on_release = on_release
+        # время последнего обращения (локальное)
+        self.last_seen = np.zeros(capacity)
+        self.lock = threading.RLock()
+        self._slots: OrderedDict[str, int] = OrderedDict()
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, board_id: str) -> bool:
+        return board_id in self._slots
+
+    def get(self, board_id: str) -> Optional[int]:
+        """Слот платы без обращения (не продлевает LRU и TTL)."""
+        return self._slots.get(board_id)
+
+    def release(self, board_id: str):
+        with self.lock:
+            slot = self._slots.pop(board_id, None)
+            if slot is None:
+                return
+            if self.on_release is not None:
+                self.on_release(slot)
+            self._free.append(slot)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            expired = [b for b, s in self._slots.items() if now - self.last_seen[s] > self.ttl]
+            for board_id in expired:
+                self.release(board_id)
+            return len(expired)
+
+    def slot(self, board_id: str, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            slot = self._slots.get(board_id)
+            if slot is not None:
+                self._slots.move_to_end(board_id)
+            else:
+                if not self._free:
+                    self.evict_idle(now)
+                if not self._free:
+                    # самая давно не обновлявшаяся плата
+                    self.release(next(iter(self._slots)))
+                slot = self._free.pop()
+                self._slots[board_id] = slot
+                self.on_reset(slot)
+            self.last_seen[slot] = now
+            return slot
+
+
+class TrackerPool():
+    """
+    Набор EKF (модель постоянной скорости) по одному на плату.
+    Состояния хранятся стопкой: x (K,4), P (K,4,4); строка = слот платы.
+    Трекеры создаются лениво, вытесняются по LRU при заполнении
+    и по TTL, если плата долго молчит (см. SlotAllocator).
+    """
+
+    def __init__(self, capacity: int = MAX_TRACKERS, ttl: float = TRACKER_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.x = np.zeros((capacity, 4))
+        self.P = np.zeros((capacity, 4, 4))
+        # время последнего измерения (из сообщения)
+        self.last_ts = np.full(capacity, np.nan)
+        # позиция до последнего предсказания и флаг "уже предсказано пачкой" (см. predict_many)
+        self.prior = np.zeros((capacity, 2))
+        self.ahead = np.zeros(capacity, dtype=bool)
+        # сколько раз подряд движение платы отклонялось (см. hold)
+        self.holds = np.zeros(capacity, dtype=np.int32)
+        self._slots = SlotAllocator(capacity, ttl, self._reset)
+        self._lock = self._slots.lock
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, board_id: str) -> bool:
+        return board_id in self._slots
+
+    def _reset(self, slot: int):
+        self.x[slot] = 0.0
+        self.P[slot] = P0
+        self.last_ts[slot] = np.nan
+        self.holds[slot] = 0
+        self.ahead[slot] = False
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        return self._slots.evict_idle(now)
+
+    def slot(self, board_id: str, now: Optional[float] = None) -> int:
+        return self._slots.slot(board_id, now)
+
+    def remove(self, board_id: str):
+        self._slots.release(board_id)
+
+    def _elapsed(self, slots, ts: float) -> np.ndarray:
+        last = self.last_ts[slots]
+        dt = np.where(np.isnan(last), 0.0, ts - last)
+        self.last_ts[slots] = np.where(np.isnan(last), ts, np.maximum(last, ts))
+        return np.clip(dt, 0.0, MAX_DT)
+
+    def _predict(self, slot: int, dt: float):
+        self.prior[slot] = self.x[slot, :2]
+        F, Q = motion_model(dt)
+        self.x[slot] = F @ self.x[slot]
+        self.P[slot] = F @ self.P[slot] @ F.T + Q
+
+    def _predict_many(self, slots: np.ndarray, dt: np.ndarray):
+        self.prior[slots] = self.x[slots, :2]
+        # F отличается только членами dt у скоростей, поэтому собирается стопкой
+        F = np.broadcast_to(np.eye(4), (len(slots), 4, 4)).copy()
+        F[:, 0, 2] = dt
+        F[:, 1, 3] = dt
+        self.x[slots] = (F @ self.x[slots][:, :, None])[:, :, 0]
+        self.P[slots] = F @ self.P[slots] @ F.transpose(0, 2, 1) + Q_RATE * dt[:, None, None]
+
+    def _update(self, slots, z: np.ndarray, R: np.ndarray):
+        x = self.x[slots]
+        P = self.P[slots]
+        y = z - x[:, :2]
+        S = P[:, :2, :2] + R
+        det = S[:, 0, 0] * S[:, 1, 1] - S[:, 0, 1] * S[:, 1, 0]
+        S_inv = np.stack([np.stack([S[:, 1, 1], -S[:, 0, 1]], axis=-1),
+                          np.stack([-S[:, 1, 0], S[:, 0, 0]], axis=-1)], axis=-2) / det[:, None, None]
+        K = P[:, :, :2] @ S_inv
+        self.x[slots] = x + (K @ y[:, :, None])[:, :, 0]
+        self.P[slots] = P - K @ P[:, :2, :]
+
+    def predict(self, board_id: str, ts: Optional[float] = None):
+        """
+        Предсказание на момент измерения ts (сек, время из сообщения
+        или время приёма). dt берётся от предыдущего измерения этой платы.
+        """
+        if ts is None:
+            ts = time.time()
+        with self._lock:
+            slot = self.slot(board_id)
+            if self.ahead[slot]:
+                # шаг уже сделан predict_many для этого сообщения
+                self.ahead[slot] = False
+                return
+            self._predict(slot, float(self._elapsed(slot, ts)))
+
+    def predict_many(self, board_ids: list[str], ts: np.ndarray):
+        """
+        Предсказание сразу для пачки разных плат, каждая к своему ts (сек).
+        Следующий predict платы считается уже выполненным: так воркер делает
+        один шаг на всю пачку сообщений, а locate_heard его не повторяет.
+        """
+        with self._lock:
+            slots = np.array([self.slot(b) for b in board_ids], dtype=np.intp)
+            if len(slots):
+                # с той же точностью до мс, что motion_model у predict
+                dt = np.round(self._elapsed(slots, np.asarray(ts, dtype=np.float64)) * 1000) / 1000
+                self._predict_many(slots, dt)
+                self.ahead[slots] = True
+
+    def update(self, board_id: str, z: np.ndarray, R: np.ndarray):
+        with self._lock:
+            slot = self.slot(board_id)
+            self._update(slice(slot, slot + 1), np.asarray(z, dtype=np.float64).reshape(1, 2),
+                         np.asarray(R, dtype=np.float64).reshape(1, 2, 2))
+
+    def run(self, board_id: str, ts: np.ndarray, z: np.ndarray, R: np.ndarray) -> np.ndarray:
+        """
+        Фильтрация записанной последовательности фиксов одной платы:
+        ts (n,), z (n,2), R (n,2,2) -> отфильтрованные позиции (n,2).
+        Результат зависит только от ts, а не от скорости воспроизведения.
+        """
+        out = np.empty((len(ts), 2))
+        for i in range(len(ts)):
+            self.predict(board_id, float(ts[i]))
+            self.update(board_id, z[i], R[i])
+            out[i] = self.get_state(board_id)
+        return out
+
+    def hold(self, board_id: str, xy) -> int:
+        """
+        Отклоняет последнее движение: позиция возвращается в xy, скорость
+        обнуляется, ковариация остаётся. Возвращает число отклонений подряд.
+        """
+        with self._lock:
+            slot = self.slot(board_id)
+            self.x[slot, :2] = xy
+            self.x[slot, 2:] = 0.0
+            self.holds[slot] += 1
+            return int(self.holds[slot])
+
+    def release(self, board_id: str):
+        """Движение принято - счётчик отклонений сбрасывается."""
+        slot = self._slots.get(board_id)
+        if slot is not None:
+            self.holds[slot] = 0
+
+    def get_holds(self, board_id: str) -> int:
+        slot = self._slots.get(board_id)
+        return 0 if slot is None else int(self.holds[slot])
+
+    def get_state(self, board_id: str) -> Optional[tuple[float, float]]:
+        slot = self._slots.get(board_id)
+        if slot is None:
+            return None
+        return float(self.x[slot, 0]), float(self.x[slot, 1])
+
+    def get_prior(self, board_id: str) -> Optional[tuple[float, float]]:
+        """Позиция платы до последнего предсказания (последняя принятая оценка)."""
+        slot = self._slots.get(board_id)
+        if slot is None:
+            return None
+        return float(self.prior[slot, 0]), float(self.prior[slot, 1])
+
+    def get_position_var(self, board_id: str) -> Optional[float]:
+        """Дисперсия оценки позиции (м^2): trace(P[:2, :2])."""
+        slot = self._slots.get(board_id)
+        if slot is None:
+            return None
+        return float(self.P[slot, 0, 0] + self.P[slot, 1, 1])
+
+
+pool = TrackerPool()
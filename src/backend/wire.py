@@ -0,0 +1,117 @@
+"""
+Двоичный формат сообщения платы (версия 1), little-endian:
+
+    B   версия (WIRE_VERSION)
+    6s  id платы (machine.unique_id(), в hex - тот же id, что в топике)
+    I   номер сообщения
+    I   время измерения, unix сек (0 - неизвестно, берётся время приёма)
+    H   миллисекунды времени измерения
+    H   число пар
+    (H номер маяка, b rssi) * число пар
+
+Номер маяка - число в конце имени (beacon_7 -> 7), см. BeaconSnapshot.ids.
+JSON начинается с '[' или '{', поэтому форматы различаются по первому байту.
+Время передаётся целыми: на ESP32 float одинарной точности.
+
+Топик платы - test/beacons/s<корзина>/<id платы>, корзина - младший байт
+unique_id по модулю SHARD_BUCKETS (см. shard_bucket): воркеры cluster
+подписываются только на свои корзины, и брокер не рассылает каждому
+все сообщения. Старые прошивки публикуют в test/beacons/<id> и test/beacons.
+"""
+import binascii
+import struct
+import threading
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from beacon_registry import BeaconSnapshot
+
+WIRE_VERSION = 1
+TOPIC = "test/beacons"
+# корзин больше, чем воркеров: воркер i подписан на корзины i, i + N, ...
+SHARD_BUCKETS = 64
+HEADER = struct.Struct("<B6sIIHH")
+ENTRY = np.dtype([("beacon", "<u2"), ("rssi", "i1")])
+
+
+class Packet(NamedTuple):
+    board_id: str
+    seq: int
+    ts: Optional[float]
+    beacons: np.ndarray  # номера маяков, uint16
+    rssi: np.ndarray  # int8
+
+
+def shard_bucket(board_id: str) -> int:
+    """Корзина платы: последние две hex-цифры id (младший байт unique_id), как в прошивке."""
+    try:
+        return int(board_id[-2:], 16) % SHARD_BUCKETS
+    except ValueError:
+        return binascii.crc32(board_id.encode()) % SHARD_BUCKETS
+
+
+def board_topic(board_id: str) -> str:
+    return f"{TOPIC}/s{shard_bucket(board_id)}/{board_id}"
+
+
+def topic_bucket(topic: str) -> Optional[int]:
+    """Корзина из топика или None для топиков старых прошивок."""
+    parts = topic[len(TOPIC) + 1:].split("/") if topic.startswith(TOPIC + "/") else []
+    if len(parts) == 2 and parts[0][:1] == "s" and parts[0][1:].isdigit():
+        return int(parts[0][1:])
+    return None
+
+
+def is_binary(payload: bytes) -> bool:
+    return len(payload) > 0 and payload[0] == WIRE_VERSION
+
+
+def encode(board_id: bytes, seq: int, ts: Optional[float], beacons, rssi) -> bytes:
+    entries = np.empty(len(beacons), dtype=ENTRY)
+    entries["beacon"] = beacons
+    entries["rssi"] = np.clip(np.rint(rssi), -128, 127)
+    ms = int(round((ts or 0.0) * 1000))
+    return HEADER.pack(WIRE_VERSION, board_id, seq & 0xFFFFFFFF, ms // 1000, ms % 1000,
+                       len(entries)) + entries.tobytes()
+
+
+def decode(payload: bytes) -> Packet:
+    if len(payload) < HEADER.size:
+        raise ValueError("Короткое сообщение")
+    version, board, seq, ts_s, ts_ms, count = HEADER.unpack_from(payload)
+    if version != WIRE_VERSION:
+        raise ValueError(f"Неизвестная версия формата: {version}")
+    if len(payload) != HEADER.size + count * ENTRY.itemsize:
+        raise ValueError("Длина сообщения не совпадает с числом пар")
+    entries = np.frombuffer(payload, dtype=ENTRY, count=count, offset=HEADER.size)
+    return Packet(binascii.hexlify(board).decode(), seq, ts_s + ts_ms / 1000.0 if ts_s else None,
+                  entries["beacon"], entries["rssi"])
+
+
+_cache_lock = threading.Lock()
+_cache: Optional[tuple[int, np.ndarray]] = None
+
+
+def _rows_by_number(snap: BeaconSnapshot) -> np.ndarray:
+    """Номер маяка -> строка снимка (-1 - нет такого); строится раз на версию реестра."""
+    global _cache
+    cached = _cache
+    if cached is not None and cached[0] == snap.version:
+        return cached[1]
+    with _cache_lock:
+        if _cache is None or _cache[0] != snap.version:
+            numbers = {int(id_): i for i, id_ in enumerate(snap.ids) if id_.isdigit() and int(id_) <= 0xFFFF}
+            rows = np.full(max(numbers, default=0) + 1, -1, dtype=np.intp)
+            for number, i in numbers.items():
+                rows[number] = i
+            _cache = (snap.version, rows)
+        return _cache[1]
+
+
+def lookup(snap: BeaconSnapshot, beacons: np.ndarray) -> np.ndarray:
+    """Строки снимка для номеров маяков, -1 для неизвестных."""
+    rows = _rows_by_number(snap)
+    beacons = beacons.astype(np.intp)
+    known = beacons < len(rows)
+    return np.where(known, rows[np.where(known, beacons, 0)], -1)
@@ -1,6 +1,8 @@
 import time
+import array
 import bluetooth
 import network
+from micropython import const
 
 from models import BLData
 import mqtt
@@ -8,6 +10,23 @@ import mqtt
 SCAN_MS = 2000
 ATOM_SCAN_TIME = 100 
 
+# непрерывное сканирование: один gap_scan без остановки и публикация по таймеру
+CONTINUOUS_SCAN = True
+PUBLISH_HZ = 5
+# окно усреднения: последние WINDOW замеров маяка не старше WINDOW_MS
+WINDOW = const(8)
+WINDOW_MS = 1000
+USE_MEDIAN = False
+# номера маяков beacon_0 .. beacon_{MAX_BEACONS-1}
+MAX_BEACONS = const(64)
+# интервал и окно сканирования (мкс): равны - радио слушает всё время
+SCAN_INTERVAL_US = 30000
+SCAN_WINDOW_US = 30000
+
+_IRQ_SCAN_RESULT = const(5)
+_IRQ_SCAN_DONE = const(6)
+NAME_PREFIX = b"beacon_"
+
 SSID = "OnePlus"       
 PASSWORD = "1234abcd"
 # SSID = "TECNO POVA 5"       
@@ -86,11 +105,107 @@ def find_stations():
         res.append(BLData(name, avg_rssi))      
     return res
 
+# таблица замеров выделяется один раз: WINDOW ячеек на маяк
+win_rssi = array.array("b", bytes(MAX_BEACONS * WINDOW))
+win_ticks = array.array("l", bytes(4 * MAX_BEACONS * WINDOW))
+win_head = bytearray(MAX_BEACONS)
+win_used = bytearray(MAX_BEACONS)
+scanning = False
+
+def beacon_index(adv):
+    """Номер из имени beacon_N в рекламном пакете или -1; без выделения памяти."""
+    i = 0
+    L = len(adv)
+    while i + 1 < L:
+        length = adv[i]
+        if length == 0:
+            break
+        ad_type = adv[i + 1]
+        if ad_type == 0x08 or ad_type == 0x09:
+            start = i + 2
+            end = i + 1 + length
+            p = len(NAME_PREFIX)
+            if end > L or end - start <= p:
+                return -1
+            for k in range(p):
+                if adv[start + k] != NAME_PREFIX[k]:
+                    return -1
+            index = 0
+            for k in range(start + p, end):
+                c = adv[k] - 48
+                if c < 0 or c > 9:
+                    return -1
+                index = index * 10 + c
+            return index
+        i += 1 + length
+    return -1
+
+def continuous_irq(event, data):
+    global scanning
+    if event == _IRQ_SCAN_RESULT:
+        index = beacon_index(data[4])
+        if 0 <= index < MAX_BEACONS:
+            slot = index * WINDOW + win_head[index]
+            win_rssi[slot] = data[3]
+            win_ticks[slot] = time.ticks_ms()
+            win_head[index] = (win_head[index] + 1) % WINDOW
+            if win_used[index] < WINDOW:
+                win_used[index] += 1
+    elif event == _IRQ_SCAN_DONE:
+        scanning = False
+
+def start_continuous_scan():
+    global scanning
+    ble.irq(continuous_irq)
+    # duration 0 - сканировать, пока не остановят
+    ble.gap_scan(0, SCAN_INTERVAL_US, SCAN_WINDOW_US)
+    scanning = True
+
+def window_stations(now):
+    """Среднее (или медиана) RSSI маяков по свежим замерам окна."""
+    res = []
+    for index in range(MAX_BEACONS):
+        used = win_used[index]
+        if not used:
+            continue
+        base = index * WINDOW
+        values = []
+        for k in range(used):
+            if time.ticks_diff(now, win_ticks[base + k]) <= WINDOW_MS:
+                values.append(win_rssi[base + k])
+        if not values:
+            continue
+        if USE_MEDIAN:
+            values.sort()
+            rssi = values[len(values) // 2]
+        else:
+            rssi = round(sum(values) / len(values))
+        res.append(BLData.from_index(index, rssi))
+    return res
+
 ble = bluetooth.BLE()
 ble.active(True)
 connect_wifi()
 mqtt.mqtt_connect()
 
+if CONTINUOUS_SCAN:
+    publish_ms = 1000 // PUBLISH_HZ
+    start_continuous_scan()
+    deadline = time.ticks_ms()
+    while True:
+        deadline = time.ticks_add(deadline, publish_ms)
+        if not scanning:
+            start_continuous_scan()
+        res = window_stations(time.ticks_ms())
+        if res:
+            mqtt.mqtt_send_bldata(res)
+        delay = time.ticks_diff(deadline, time.ticks_ms())
+        if delay > 0:
+            time.sleep_ms(delay)
+        else:
+            # не успели - следующий срез считаем от текущего момента
+            deadline = time.ticks_ms()
+
 while True:
     res: list[BLData] = find_stations()
     res.sort(key=lambda i: i.get_index())
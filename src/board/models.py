@@ -1,4 +1,16 @@
 import ujson as json
+import ustruct as struct
+import time
+
+# двоичный формат сообщения (версия 1), разбирается в src/backend/wire.py:
+# заголовок (версия, id платы, номер, unix сек, мс, число пар) + пары (номер маяка, rssi)
+WIRE_VERSION = 1
+WIRE_HEADER = "<B6sIIHH"
+WIRE_HEADER_SIZE = struct.calcsize(WIRE_HEADER)
+WIRE_ENTRY = "<Hb"
+WIRE_ENTRY_SIZE = struct.calcsize(WIRE_ENTRY)
+# на ESP32 time считает от 2000 года
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
 
 class BLData():
     def __init__(self, name: str, rssi: int):
@@ -6,6 +18,14 @@ class BLData():
         self.rssi = rssi
         self.index = int(name.split("_")[1])
         
+    @staticmethod
+    def from_index(index: int, rssi: int) -> "BLData":
+        item = BLData.__new__(BLData)
+        item.name = "beacon_" + str(index)
+        item.rssi = rssi
+        item.index = index
+        return item
+
     def __repr__(self):
         return f"{self.name}, {self.rssi}"
     
@@ -20,4 +40,22 @@ def bl_list_to_json(data: list[BLData]) -> str:
         dict_data.append(i.to_dict())
     res = json.dumps(dict_data)
     return res
-    
+
+
+def unix_time():
+    """(сек, мс) unix-времени или (0, 0), если часы не выставлены - тогда сервер берёт время приёма."""
+    if time.gmtime()[0] < 2024:
+        return 0, 0
+    ms = time.time_ns() // 1000000
+    return ms // 1000 + EPOCH_OFFSET, ms % 1000
+
+
+def bl_list_to_bytes(data: list[BLData], board_id: bytes, seq: int) -> bytearray:
+    sec, ms = unix_time()
+    buf = bytearray(WIRE_HEADER_SIZE + WIRE_ENTRY_SIZE * len(data))
+    struct.pack_into(WIRE_HEADER, buf, 0, WIRE_VERSION, board_id, seq & 0xFFFFFFFF, sec, ms, len(data))
+    offset = WIRE_HEADER_SIZE
+    for i in data:
+        struct.pack_into(WIRE_ENTRY, buf, offset, i.index, max(-128, min(127, i.rssi)))
+        offset += WIRE_ENTRY_SIZE
+    return buf
@@ -1,10 +1,18 @@
-from models import BLData, bl_list_to_json
+from models import BLData, bl_list_to_bytes, bl_list_to_json
 from umqtt.simple import MQTTClient
 import ujson
+import machine
+import ubinascii
 MQTT_BROKER = "5.35.88.189"   # публичный брокер
 MQTT_PORT   = 1883
-CLIENT_ID   = "esp32_micropython"
-TOPIC       = "test/beacons"
+BOARD_UID   = machine.unique_id()
+BOARD_ID    = ubinascii.hexlify(BOARD_UID).decode()
+CLIENT_ID   = "esp32_" + BOARD_ID
+# корзина - младший байт id: воркеры приёма подписаны каждый на свои (см. backend wire.py)
+SHARD_BUCKETS = 64
+TOPIC       = "test/beacons/s%d/%s" % (BOARD_UID[-1] % SHARD_BUCKETS, BOARD_ID)
+# False - старый JSON-формат
+USE_BINARY  = True
 
 client = MQTTClient(CLIENT_ID, MQTT_BROKER, port=MQTT_PORT)
 
@@ -23,10 +31,17 @@ def mqtt_connect():
     else:
         raise Exception("No connect to MQTT")
     
+seq = 0
+
 def mqtt_send_bldata(data: list[BLData]):
-    json_res = bl_list_to_json(data)
+    global seq
+    if USE_BINARY:
+        payload = bl_list_to_bytes(data, BOARD_UID, seq)
+    else:
+        payload = bl_list_to_json(data)
+    seq += 1
 
-    client.publish(TOPIC, json_res)
+    client.publish(TOPIC, payload)
     #print("Отправлено:", json_res)
     
 def connect_mqtt():